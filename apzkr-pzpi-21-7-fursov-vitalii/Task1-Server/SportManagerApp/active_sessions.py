@@ -0,0 +1,158 @@
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import DateTimeField, ExpressionWrapper, F
+from django.utils import timezone
+
+from .metrics import LATENCY_BUCKETS, registry
+from .models import ModelVersion, UserTraining
+from .versions import bump_versions
+
+# ModelVersion row bumped whenever a user training or the time of a training
+# changes; other processes reload their resolver when it moves
+VERSION = 'session'
+
+
+def training_end():
+    return ExpressionWrapper(F('training__datetime') + F('training__duration'), output_field=DateTimeField())
+
+
+# Training sessions (user trainings) running around now, by sensor and by user.
+# Every session overlapping [now - SESSION_RESOLVER_GRACE, now + SESSION_RESOLVER_HORIZON]
+# is loaded with one query, so sessions are in memory before they start and a
+# lookup is a dict access. The resolver reloads when the horizon is reached or
+# the 'session' version changed, which it checks at most every
+# SESSION_RESOLVER_CHECK_INTERVAL seconds.
+# The loaded range and the time of the last check are published together as
+# window = (start, end, checked_at), so lookups running unlocked always read
+# one consistent window; None means nothing is loaded.
+class SessionResolver:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.by_sensor = {}
+        self.by_user = {}
+        self.window = None
+        self.version = None
+
+    # True when every session containing timestamp is loaded
+    def covers(self, timestamp):
+        window = self.window
+        return window is not None and window[0] <= timestamp <= window[1]
+
+    def due(self):
+        window = self.window
+        if window is None or timezone.now() >= window[1]:
+            return True
+        return time.monotonic() - window[2] >= getattr(settings, 'SESSION_RESOLVER_CHECK_INTERVAL', 1.0)
+
+    def refresh(self):
+        if not self.due():
+            return
+        with self.lock:
+            if not self.due():
+                return
+            window = self.window
+            version = ModelVersion.objects.filter(name=VERSION).values_list('version', 'updated_at').first()
+            if window is None or timezone.now() >= window[1] or version != self.version:
+                start, end = self.load(version)
+            else:
+                start, end = window[:2]
+            self.window = (start, end, time.monotonic())
+
+    def load(self, version):
+        started = time.perf_counter()
+        now = timezone.now()
+        start = now - timedelta(seconds=getattr(settings, 'SESSION_RESOLVER_GRACE', 5 * 60))
+        end = now + timedelta(seconds=getattr(settings, 'SESSION_RESOLVER_HORIZON', 60 * 60))
+        rows = (
+            UserTraining.objects.filter(training__datetime__lte=end)
+            .annotate(end=training_end())
+            .filter(end__gte=start)
+            .values_list('user_training_id', 'user_id', 'sensor_id', 'training__datetime', 'end')
+        )
+        by_sensor = {}
+        by_user = {}
+        for user_training_id, user_id, sensor_id, session_start, session_end in rows:
+            session = (session_start, session_end, user_training_id, user_id)
+            by_sensor.setdefault(sensor_id, []).append(session)
+            by_user.setdefault(user_id, []).append(session)
+
+        self.by_sensor, self.by_user, self.version = by_sensor, by_user, version
+        registry.observe('session_resolver_load_seconds', 'Time to load the active training sessions', LATENCY_BUCKETS, time.perf_counter() - started)
+        registry.set('session_resolver_sessions', 'Training sessions held by the resolver', sum(len(sessions) for sessions in by_user.values()))
+        return start, end
+
+    def invalidate(self):
+        with self.lock:
+            self.window = None
+
+    # (user_training_id, user_id) of the session the sensor is worn in at timestamp.
+    # None if there is none or several sessions share the sensor at that time.
+    def sensor_session(self, sensor_id, timestamp):
+        matches = [session for session in self.by_sensor.get(sensor_id, ()) if session[0] <= timestamp <= session[1]]
+        return matches[0][2:] if len(matches) == 1 else None
+
+    # user_ids with a session on the sensor at timestamp
+    def sensor_users(self, sensor_id, timestamp):
+        return {session[3] for session in self.by_sensor.get(sensor_id, ()) if session[0] <= timestamp <= session[1]}
+
+    # True when the user training is loaded and still running at timestamp
+    def running(self, user_id, user_training_id, timestamp):
+        return any(session[2] == user_training_id and session[1] > timestamp for session in self.by_user.get(user_id, ()))
+
+    # user_training_id of the user's session at timestamp, or None
+    def user_session(self, user_id, timestamp):
+        for start, end, user_training_id, _ in self.by_user.get(user_id, ()):
+            if start <= timestamp <= end:
+                return user_training_id
+        return None
+
+
+session_resolver = SessionResolver()
+
+
+# Drops the sessions of this process once the transaction commits and makes
+# other processes reload theirs
+def invalidate_sessions():
+    transaction.on_commit(session_resolver.invalidate)
+    bump_versions([VERSION])
+
+
+# The (sensor_id, user_id, timestamp) triples at which the user wears the
+# sensor in a training session: from the resolver around now and with one
+# query for older timestamps. Device tokens belong to a sensor, so they may
+# only submit data of the athlete wearing it.
+def worn_sensors(triples):
+    triples = set(triples)
+    if not triples:
+        return set()
+    session_resolver.refresh()
+    worn = set()
+    older = []
+    for triple in triples:
+        sensor_id, user_id, timestamp = triple
+        if session_resolver.covers(timestamp):
+            if user_id in session_resolver.sensor_users(sensor_id, timestamp):
+                worn.add(triple)
+        else:
+            older.append(triple)
+    if not older:
+        return worn
+
+    rows = (
+        UserTraining.objects.filter(sensor_id__in={triple[0] for triple in older}, training__datetime__lte=max(triple[2] for triple in older))
+        .annotate(end=training_end())
+        .filter(end__gte=min(triple[2] for triple in older))
+        .values_list('sensor_id', 'user_id', 'training__datetime', 'end')
+    )
+    sessions = {}
+    for sensor_id, user_id, start, end in rows:
+        sessions.setdefault((sensor_id, user_id), []).append((start, end))
+    worn.update(
+        triple for triple in older
+        if any(start <= triple[2] <= end for start, end in sessions.get(triple[:2], ()))
+    )
+    return worn
@@ -0,0 +1,119 @@
+import time
+from datetime import timedelta
+from operator import attrgetter
+
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+
+from .metrics import LATENCY_BUCKETS, registry
+from .models import HeartRateAlert, HeartRateBaseline
+
+BASELINE_FIELDS = ['count', 'mean', 'm2', 'ewma', 'timestamp', 'alerted']
+
+
+# Streaming detector run by store_readings on every stored batch, inside its
+# transaction. The state of a training session is its HeartRateBaseline row,
+# locked until the batch is stored, so the readings of one session are checked
+# in turn whichever process stores them, and no process sees a gap or a jump
+# because another one took the readings in between. A batch costs three
+# queries: create missing baselines, lock them, update them.
+# A reading is flagged as
+#   zone    - above HEART_RATE_ALERT_LIMIT of the maximum heart rate 220 - age
+#   spike   - HEART_RATE_SPIKE_SIGMA deviations (and at least
+#             HEART_RATE_SPIKE_MIN_DELTA bpm) away from the EWMA, once
+#             HEART_RATE_WARMUP readings of the session were seen
+#   dropout - below HEART_RATE_MIN_PULSE, or the first reading after no data
+#             for HEART_RATE_DROPOUT_GAP seconds
+# A session gets at most one alert of a kind every HEART_RATE_ALERT_COOLDOWN
+# seconds. Readings outside a training session are only checked against the
+# zone and the minimum pulse; readings older than the last one checked in
+# their session are skipped.
+def detect_anomalies(readings, ages):
+    started = time.perf_counter()
+    options = {
+        'limit': getattr(settings, 'HEART_RATE_ALERT_LIMIT', 0.95),
+        'sigma': getattr(settings, 'HEART_RATE_SPIKE_SIGMA', 4.0),
+        'min_delta': getattr(settings, 'HEART_RATE_SPIKE_MIN_DELTA', 25),
+        'warmup': getattr(settings, 'HEART_RATE_WARMUP', 30),
+        'min_pulse': getattr(settings, 'HEART_RATE_MIN_PULSE', 30),
+        'gap': timedelta(seconds=getattr(settings, 'HEART_RATE_DROPOUT_GAP', 10)),
+        'cooldown': timedelta(seconds=getattr(settings, 'HEART_RATE_ALERT_COOLDOWN', 60)),
+        'alpha': getattr(settings, 'HEART_RATE_EWMA_ALPHA', 0.2),
+    }
+    baselines = lock_baselines({reading.user_training_id for reading in readings} - {None})
+    alerts = []
+    for reading in sorted(readings, key=attrgetter('timestamp')):
+        alert = observe(reading, baselines.get(reading.user_training_id), ages.get(reading.user_id), options)
+        if alert is not None:
+            alerts.append(alert)
+    HeartRateBaseline.objects.bulk_update(baselines.values(), BASELINE_FIELDS)
+
+    for alert in alerts:
+        registry.increment('heart_rate_alerts_total', 'Heart rate alerts raised', kind=alert.kind)
+    registry.observe('anomaly_detection_seconds', 'Time to check one stored batch for anomalies', LATENCY_BUCKETS, time.perf_counter() - started)
+    return alerts
+
+
+# Baselines of the user trainings, created if missing and locked in key order
+# until the transaction ends
+def lock_baselines(user_training_ids):
+    if not user_training_ids:
+        return {}
+    ids = sorted(user_training_ids)
+    HeartRateBaseline.objects.bulk_create([HeartRateBaseline(user_training_id=pk) for pk in ids], ignore_conflicts=True)
+    return {baseline.pk: baseline for baseline in HeartRateBaseline.objects.select_for_update().filter(pk__in=ids).order_by('pk')}
+
+
+def observe(reading, baseline, age, options):
+    if baseline is not None and baseline.timestamp is not None and reading.timestamp <= baseline.timestamp:
+        return None
+
+    pulse = reading.pulse
+    kind = detail = None
+    if pulse < options['min_pulse']:
+        kind, detail = 'dropout', f'Pulse {pulse} bpm is below {options["min_pulse"]} bpm'
+    elif baseline is not None and baseline.timestamp is not None and reading.timestamp - baseline.timestamp > options['gap']:
+        kind, detail = 'dropout', f'No readings for {(reading.timestamp - baseline.timestamp).total_seconds():.0f}s'
+    elif age is not None and pulse > options['limit'] * (220 - age):
+        kind, detail = 'zone', f'Pulse {pulse} bpm is above {options["limit"]:.0%} of the maximum heart rate {220 - age} bpm'
+    elif baseline is not None and baseline.count >= options['warmup']:
+        residual = pulse - baseline.ewma
+        if abs(residual) >= max(options['sigma'] * baseline.deviation, options['min_delta']):
+            kind, detail = 'spike', f'Pulse {pulse} bpm is {residual:+.0f} bpm from the expected {baseline.ewma:.0f} bpm'
+
+    expected = None
+    if baseline is not None:
+        expected = baseline.ewma
+        if pulse >= options['min_pulse']:
+            update_baseline(baseline, pulse, options['alpha'])
+        baseline.timestamp = reading.timestamp
+
+    if kind is None:
+        return None
+    if baseline is not None:
+        last = baseline.alerted.get(kind)
+        if last is not None and reading.timestamp - parse_datetime(last) < options['cooldown']:
+            return None
+        baseline.alerted[kind] = reading.timestamp.isoformat()
+    return HeartRateAlert(
+        user_id=reading.user_id,
+        sensor_id=reading.sensor_id,
+        user_training_id=reading.user_training_id,
+        kind=kind,
+        timestamp=reading.timestamp,
+        pulse=pulse,
+        expected=expected,
+        detail=detail,
+    )
+
+
+def update_baseline(baseline, pulse, alpha):
+    if baseline.ewma is None:
+        baseline.ewma = float(pulse)
+        return
+    residual = pulse - baseline.ewma
+    baseline.count += 1
+    delta = residual - baseline.mean
+    baseline.mean += delta / baseline.count
+    baseline.m2 += delta * (residual - baseline.mean)
+    baseline.ewma += alpha * residual
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class SportmanagerappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'SportManagerApp'
+
+    def ready(self):
+        from . import checks, signals, tasks  # noqa: F401
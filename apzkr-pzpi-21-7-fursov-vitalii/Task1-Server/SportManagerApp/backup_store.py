@@ -0,0 +1,265 @@
+import fcntl
+import hashlib
+import json
+import os
+import random
+import shutil
+import tempfile
+import zlib
+from contextlib import contextmanager
+from datetime import timedelta
+
+import numpy as np
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+MIN_CHUNK = 2 * 1024
+AVERAGE_CHUNK_BITS = 13
+MAX_CHUNK = 64 * 1024
+READ_SIZE = 1024 * 1024
+HASH_WINDOW = 64
+MASK = np.uint64(((1 << AVERAGE_CHUNK_BITS) - 1) << (64 - AVERAGE_CHUNK_BITS))
+
+# Gear table of the rolling hash; fixed seed so boundaries are stable between runs
+GEAR = np.array([random.Random(20240625 + index).getrandbits(64) for index in range(256)], dtype=np.uint64)
+
+
+# Content-defined chunking with a gear rolling hash (as in FastCDC):
+# a boundary is cut where the top bits of the hash are zero, so an insertion
+# or deletion only changes the chunks around it and the rest still deduplicate.
+def iter_chunks(stream):
+    pending = b''
+    while True:
+        data = stream.read(READ_SIZE)
+        if not data:
+            break
+        pending += data
+        if len(pending) < MAX_CHUNK:
+            continue
+        cuts = _cut_points(pending)
+        start = 0
+        while len(pending) - start >= MAX_CHUNK:
+            end = _boundary(cuts, start, start + MAX_CHUNK)
+            yield pending[start:end]
+            start = end
+        pending = pending[start:]
+
+    cuts = _cut_points(pending)
+    start = 0
+    while start < len(pending):
+        end = _boundary(cuts, start, min(start + MAX_CHUNK, len(pending)))
+        yield pending[start:end]
+        start = end
+
+
+# Positions whose gear hash has the top AVERAGE_CHUNK_BITS bits zero, for the
+# whole buffer at once. The rolling hash at a byte is the sum of GEAR[byte]
+# shifted left by its distance to the position, and shifts of 64 or more fall
+# off, so it only depends on the last HASH_WINDOW bytes: summing the buffer's
+# gear values over windows doubling up to 64 gives every hash in six passes.
+# The cut points are the same as those of the byte-by-byte hash since
+# MIN_CHUNK is longer than the window.
+def _cut_points(data):
+    hashes = GEAR[np.frombuffer(data, dtype=np.uint8)]
+    shifted = np.empty_like(hashes)
+    width = 1
+    while width < HASH_WINDOW:
+        np.left_shift(hashes[:-width], np.uint64(width), out=shifted[width:])
+        hashes[width:] += shifted[width:]
+        width *= 2
+    return np.flatnonzero((hashes & MASK) == 0)
+
+
+# End of the chunk starting at start: after the first cut point at least
+# MIN_CHUNK bytes in, or limit if there is none before it
+def _boundary(cuts, start, limit):
+    if limit - start <= MIN_CHUNK:
+        return limit
+    index = np.searchsorted(cuts, start + MIN_CHUNK)
+    if index < len(cuts) and cuts[index] < limit:
+        return int(cuts[index]) + 1
+    return limit
+
+
+class BackupStore:
+    def __init__(self, root, compression=6):
+        self.root = str(root)
+        self.compression = compression
+        self.chunks_dir = os.path.join(self.root, 'chunks')
+        self.snapshots_dir = os.path.join(self.root, 'snapshots')
+        os.makedirs(self.chunks_dir, exist_ok=True)
+        os.makedirs(self.snapshots_dir, exist_ok=True)
+
+    def chunk_path(self, digest):
+        return os.path.join(self.chunks_dir, digest[:2], digest)
+
+    def manifest_path(self, name):
+        return os.path.join(self.snapshots_dir, f'{name}.json')
+
+    # File lock over the whole store, also between processes. Adding and
+    # extracting snapshots hold it shared and may run side by side; prune and gc
+    # hold it exclusively, so they never see the chunks of a snapshot whose
+    # manifest is not written yet, nor delete chunks being read.
+    @contextmanager
+    def locked(self, exclusive=False):
+        with open(os.path.join(self.root, '.lock'), 'a') as handle:
+            fcntl.flock(handle, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+    def _write_atomic(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        with os.fdopen(descriptor, 'wb') as handle:
+            handle.write(data)
+        os.replace(temporary, path)
+
+    # Stores a dump file or a directory-format dump as a snapshot.
+    # Only chunks that are not in the store yet are written.
+    def add_snapshot(self, source, name=None, metadata=None):
+        with self.locked():
+            return self._add_snapshot(str(source), name, metadata)
+
+    def _add_snapshot(self, source, name, metadata):
+        name = name or os.path.basename(source.rstrip(os.sep))
+        return self.write_manifest(name, self.store_tree(source), os.path.isdir(source), metadata)
+
+    # Chunks a dump file, or every file of a directory-format dump, into the
+    # store and returns their manifest entries. Callers hold locked() until
+    # the manifest is written.
+    def store_tree(self, source):
+        source = str(source)
+        if os.path.isdir(source):
+            paths = sorted(
+                os.path.relpath(os.path.join(directory, filename), source)
+                for directory, _, filenames in os.walk(source)
+                for filename in filenames
+            )
+        else:
+            paths = [os.path.basename(source)]
+
+        files = []
+        for relative in paths:
+            full_path = os.path.join(source, relative) if os.path.isdir(source) else source
+            with open(full_path, 'rb') as handle:
+                files.append(self.store_file(handle, relative))
+        return files
+
+    # Chunks one file read from a binary stream into the store and returns its
+    # manifest entry. Callers hold locked() until the manifest is written.
+    def store_file(self, handle, relative):
+        entry = {'path': relative, 'size': 0, 'chunks': [], 'chunks_new': 0, 'bytes_written': 0}
+        for chunk in iter_chunks(handle):
+            digest = hashlib.sha256(chunk).hexdigest()
+            entry['chunks'].append([digest, len(chunk)])
+            entry['size'] += len(chunk)
+            chunk_path = self.chunk_path(digest)
+            if not os.path.exists(chunk_path):
+                compressed = zlib.compress(chunk, self.compression)
+                self._write_atomic(chunk_path, compressed)
+                entry['chunks_new'] += 1
+                entry['bytes_written'] += len(compressed)
+        return entry
+
+    def write_manifest(self, name, files, directory, metadata=None):
+        manifest = {
+            'name': name,
+            'created_at': timezone.now().isoformat(),
+            'directory': directory,
+            'files': files,
+            'bytes_total': sum(entry['size'] for entry in files),
+            'bytes_written': sum(entry['bytes_written'] for entry in files),
+            'chunks_total': sum(len(entry['chunks']) for entry in files),
+            'chunks_new': sum(entry['chunks_new'] for entry in files),
+            **(metadata or {}),
+        }
+        self._write_atomic(self.manifest_path(name), json.dumps(manifest).encode())
+        return manifest
+
+    def manifest(self, name):
+        with open(self.manifest_path(name)) as handle:
+            return json.load(handle)
+
+    # Manifests of all snapshots, oldest first
+    def snapshots(self):
+        manifests = []
+        for filename in os.listdir(self.snapshots_dir):
+            if filename.endswith('.json'):
+                manifests.append(self.manifest(filename[:-len('.json')]))
+        return sorted(manifests, key=lambda manifest: manifest['created_at'])
+
+    # Rebuilds a snapshot as a file or directory under destination and returns its path
+    def extract(self, name, destination):
+        with self.locked():
+            return self._extract(name, destination)
+
+    def _extract(self, name, destination):
+        manifest = self.manifest(name)
+        target = os.path.join(str(destination), name)
+        if not manifest['directory']:
+            os.makedirs(str(destination), exist_ok=True)
+            target = os.path.join(str(destination), manifest['files'][0]['path'])
+        for entry in manifest['files']:
+            path = os.path.join(target, entry['path']) if manifest['directory'] else target
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as handle:
+                for digest, _ in entry['chunks']:
+                    with open(self.chunk_path(digest), 'rb') as chunk:
+                        handle.write(zlib.decompress(chunk.read()))
+        return target
+
+    def delete_snapshot(self, name):
+        os.remove(self.manifest_path(name))
+
+    # Retention: keeps the newest keep_last snapshots and every snapshot younger
+    # than keep_days, deletes the other manifests and garbage-collects their chunks.
+    def prune(self, keep_last=None, keep_days=None):
+        with self.locked(exclusive=True):
+            return self._prune(keep_last, keep_days)
+
+    def _prune(self, keep_last, keep_days):
+        manifests = self.snapshots()
+        keep = set()
+        if keep_last:
+            keep.update(manifest['name'] for manifest in manifests[-keep_last:])
+        if keep_days is not None:
+            cutoff = timezone.now() - timedelta(days=keep_days)
+            keep.update(manifest['name'] for manifest in manifests if parse_datetime(manifest['created_at']) >= cutoff)
+        if keep_last is None and keep_days is None:
+            keep.update(manifest['name'] for manifest in manifests)
+
+        removed = [manifest['name'] for manifest in manifests if manifest['name'] not in keep]
+        for name in removed:
+            self.delete_snapshot(name)
+        return removed, self._gc()
+
+    # Deletes chunks that no snapshot references; returns (chunks, bytes) freed
+    def gc(self):
+        with self.locked(exclusive=True):
+            return self._gc()
+
+    def _gc(self):
+        referenced = {
+            digest
+            for manifest in self.snapshots()
+            for entry in manifest['files']
+            for digest, _ in entry['chunks']
+        }
+        freed_chunks = freed_bytes = 0
+        for directory, _, filenames in os.walk(self.chunks_dir):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                if not filename.startswith('.tmp-') and filename not in referenced:
+                    freed_bytes += os.path.getsize(path)
+                    os.remove(path)
+                    freed_chunks += 1
+        return freed_chunks, freed_bytes
+
+
+def remove_dump(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
@@ -0,0 +1,306 @@
+import io
+import json
+import logging
+import os
+import subprocess
+import threading
+import time
+from contextlib import nullcontext
+from datetime import datetime
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+from .backup_store import BackupStore, remove_dump
+from .jobs import enqueue
+from .models import DatabaseBackup
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {
+    'plain': '.sql',
+    'custom': '.dump',
+    'directory': '',
+}
+PROGRESS_INTERVAL = 1.0
+
+
+def backup_dir():
+    return str(getattr(settings, 'BACKUP_DIR', os.path.join(settings.BASE_DIR, 'backups')))
+
+
+def use_store():
+    return getattr(settings, 'BACKUP_USE_STORE', False)
+
+
+def get_store():
+    return BackupStore(
+        getattr(settings, 'BACKUP_STORE_DIR', os.path.join(backup_dir(), 'store')),
+        compression=getattr(settings, 'BACKUP_COMPRESSION', 6),
+    )
+
+
+def database_env():
+    env = os.environ.copy()
+    password = settings.DATABASES['default'].get('PASSWORD')
+    if password:
+        env['PGPASSWORD'] = password
+    return env
+
+
+def connection_args():
+    db = settings.DATABASES['default']
+    args = []
+    for option, key in (('--host', 'HOST'), ('--port', 'PORT'), ('--username', 'USER')):
+        if db.get(key):
+            args += [option, str(db[key])]
+    return args
+
+
+# pg_dump writes to stdout when path is None
+def dump_command(path, backup_format, jobs, compression, snapshot_id=None):
+    command = [getattr(settings, 'BACKUP_PG_DUMP_PATH', 'pg_dump'), *connection_args(), '--format', backup_format, '--verbose']
+    if path is not None:
+        command += ['--file', path]
+    if snapshot_id:
+        command += ['--snapshot', snapshot_id]
+    if backup_format == 'directory':
+        command += ['--jobs', str(jobs)]
+    if backup_format in ('directory', 'custom'):
+        command += ['--compress', str(compression)]
+    command.append(settings.DATABASES['default']['NAME'])
+    return command
+
+
+def create_backup(backup_format=None, jobs=None, compression=None, requested_by=None):
+    backup_format = backup_format or getattr(settings, 'BACKUP_FORMAT', 'directory')
+    if backup_format not in FORMATS:
+        raise ValueError(f'Unknown backup format: {backup_format}')
+    date_str = datetime.now().strftime('%Y%m%d%H%M%S')
+    name = f"{os.path.basename(str(settings.DATABASES['default']['NAME']))}_backup_{date_str}{FORMATS[backup_format]}"
+    # Compressed dumps change entirely on small edits and would defeat
+    # deduplication, so the store gets raw data and compresses chunks itself
+    if use_store():
+        if compression:
+            logger.warning('pg_dump compression %s is ignored: the backup store compresses the chunks with BACKUP_COMPRESSION', compression)
+        compression = 0
+    elif compression is None:
+        compression = getattr(settings, 'BACKUP_COMPRESSION', 6)
+    return DatabaseBackup.objects.create(
+        format=backup_format,
+        jobs=jobs or getattr(settings, 'BACKUP_JOBS', 4),
+        compression=compression,
+        path=os.path.join(backup_dir(), name),
+        requested_by=requested_by,
+    )
+
+
+# Row count and an order-independent checksum (sum of per-row md5 prefixes) of every table.
+# Backends other than PostgreSQL only get row counts.
+def table_stats(db_connection, tables):
+    stats = {}
+    with db_connection.cursor() as cursor:
+        for table in tables:
+            name = db_connection.ops.quote_name(table)
+            if db_connection.vendor == 'postgresql':
+                cursor.execute(
+                    f"SELECT count(*), coalesce(sum(('x' || substr(md5(t::text), 1, 15))::bit(60)::bigint), 0)::text FROM {name} t"
+                )
+            else:
+                cursor.execute(f'SELECT count(*), NULL FROM {name}')
+            rows, checksum = cursor.fetchone()
+            stats[table] = {'rows': rows, 'checksum': checksum}
+    return stats
+
+
+# Opens a REPEATABLE READ transaction on a separate connection and exports its snapshot,
+# so the table statistics and pg_dump see exactly the same data.
+# Returns (connection, snapshot id); the snapshot lives until the connection is closed.
+def open_snapshot():
+    snapshot_connection = connections.create_connection('default')
+    if snapshot_connection.vendor != 'postgresql':
+        return snapshot_connection, None
+    snapshot_connection.set_autocommit(False)
+    with snapshot_connection.cursor() as cursor:
+        cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY')
+        cursor.execute('SELECT pg_export_snapshot()')
+        return snapshot_connection, cursor.fetchone()[0]
+
+
+def manifest_path(path):
+    return f'{path}.manifest.json'
+
+
+# Runs pg_dump for a DatabaseBackup row and keeps its status and progress up to date.
+# Progress is the share of tables whose data pg_dump has started dumping.
+# With the store, plain and custom dumps are never written to disk as a whole:
+# pg_dump's stdout is chunked straight into the store. pg_dump cannot write a
+# directory-format dump to a pipe, so that one is dumped in parallel to
+# backup.path, each table file is chunked into the store and the directory
+# removed. The snapshot's manifest is only written once pg_dump succeeded.
+def run_backup(backup, on_progress=None):
+    os.makedirs(backup_dir(), exist_ok=True)
+    # A failed attempt of a retried job leaves a partial dump at the same path,
+    # and pg_dump refuses to write a directory-format dump into it
+    remove_dump(backup.path)
+    store = get_store() if use_store() else None
+    snapshot_connection, snapshot_id = open_snapshot()
+    try:
+        with snapshot_connection.cursor() as cursor:
+            tables = snapshot_connection.introspection.table_names(cursor)
+        stats = table_stats(snapshot_connection, tables)
+        DatabaseBackup.objects.filter(pk=backup.pk).update(status='running', started_at=timezone.now(), tables_total=len(tables))
+        manifest = {
+            'backup_id': backup.pk,
+            'format': backup.format,
+            'created_at': timezone.now().isoformat(),
+            'tables': stats,
+        }
+        # Held until the manifest references the chunks, so gc cannot remove them
+        with store.locked() if store else nullcontext():
+            stream = store if backup.format != 'directory' else None
+            return_code, errors, tables_done, stored = dump_database(backup, snapshot_id, len(tables), stream, on_progress)
+            snapshot = ''
+            if return_code == 0:
+                try:
+                    if store:
+                        files = [stored] if stream else store.store_tree(backup.path)
+                        snapshot = store.write_manifest(os.path.basename(backup.path), files, not stream, manifest)['name']
+                    else:
+                        with open(manifest_path(backup.path), 'w') as handle:
+                            json.dump(manifest, handle)
+                except OSError as error:
+                    return_code, errors = -1, [f'Storing the backup failed: {error}']
+    finally:
+        snapshot_connection.close()
+        if store:
+            remove_dump(backup.path)
+
+    if snapshot:
+        prune_store(store)
+    status = 'succeeded' if return_code == 0 else 'failed'
+    DatabaseBackup.objects.filter(pk=backup.pk).update(
+        status=status,
+        tables_done=tables_done,
+        snapshot=snapshot,
+        error='\n'.join(errors) if status == 'failed' else '',
+        finished_at=timezone.now(),
+    )
+    backup.refresh_from_db()
+    return backup
+
+
+# Runs pg_dump, into backup.path or from its stdout into store, and parses its
+# progress from stderr. Returns (return code, errors, tables done, the store's
+# file entry of the dump).
+def dump_database(backup, snapshot_id, tables_total, store=None, on_progress=None):
+    tables_done = 0
+    last_update = 0
+    errors = []
+    stored = {}
+    try:
+        process = subprocess.Popen(
+            dump_command(None if store else backup.path, backup.format, backup.jobs, backup.compression, snapshot_id),
+            stderr=subprocess.PIPE,
+            stdout=subprocess.PIPE if store else subprocess.DEVNULL,
+            env=database_env(),
+        )
+    except OSError as error:
+        return -1, [str(error)], tables_done, None
+
+    chunker = None
+    if store:
+        chunker = threading.Thread(target=store_output, args=(store, process, os.path.basename(backup.path), stored), daemon=True)
+        chunker.start()
+    for line in io.TextIOWrapper(process.stderr, errors='replace'):
+        if 'dumping contents of table' in line:
+            tables_done += 1
+            if time.monotonic() - last_update >= PROGRESS_INTERVAL:
+                last_update = time.monotonic()
+                DatabaseBackup.objects.filter(pk=backup.pk).update(tables_done=tables_done)
+                if on_progress:
+                    on_progress(tables_done, tables_total)
+        elif 'error' in line.lower():
+            errors.append(line.strip())
+    return_code = process.wait()
+    if chunker:
+        chunker.join()
+        if 'error' in stored:
+            return -1, errors + [f'Storing the backup failed: {stored["error"]}'], tables_done, None
+    return return_code, errors, tables_done, stored.get('entry')
+
+
+# Chunks pg_dump's stdout into the store. If that fails, pg_dump is stopped
+# rather than left blocked on a full pipe.
+def store_output(store, process, filename, stored):
+    try:
+        with process.stdout:
+            stored['entry'] = store.store_file(process.stdout, filename)
+    except OSError as error:
+        stored['error'] = error
+        process.kill()
+
+
+# Applies the retention policy of the store
+def prune_store(store):
+    store.prune(
+        keep_last=getattr(settings, 'BACKUP_KEEP_LAST', None),
+        keep_days=getattr(settings, 'BACKUP_KEEP_DAYS', None),
+    )
+
+
+# Creates a DatabaseBackup row and queues it for the runworker command
+def start_backup(requested_by=None, **options):
+    backup = create_backup(requested_by=requested_by, **options)
+    enqueue('backup', requested_by=requested_by, backup_id=backup.pk)
+    return backup
+
+
+def guess_format(path):
+    if os.path.isdir(path):
+        return 'directory'
+    return 'plain' if path.endswith('.sql') else 'custom'
+
+
+# Commands that load a dump, as (phase, command) pairs.
+# Archive formats are restored in three passes: schema, table data with parallel
+# jobs, then indexes and constraints (post-data) built once the data is in.
+# Plain SQL dumps can only be replayed serially through psql.
+def restore_commands(path, backup_format, dbname, jobs, clean=False):
+    if backup_format == 'plain':
+        psql = getattr(settings, 'BACKUP_PSQL_PATH', 'psql')
+        return [('load', [psql, *connection_args(), '--dbname', dbname, '--set', 'ON_ERROR_STOP=1', '--quiet', '--file', path])]
+
+    pg_restore = [getattr(settings, 'BACKUP_PG_RESTORE_PATH', 'pg_restore'), *connection_args(), '--dbname', dbname, '--exit-on-error']
+    schema = pg_restore + ['--section=pre-data'] + (['--clean', '--if-exists'] if clean else [])
+    return [
+        ('schema', schema + [path]),
+        ('data', pg_restore + ['--section=data', '--jobs', str(jobs), path]),
+        ('indexes', pg_restore + ['--section=post-data', '--jobs', str(jobs), path]),
+    ]
+
+
+# Compares the tables of a database with the statistics recorded in a backup manifest.
+# Returns a list of human readable mismatches.
+def verify_tables(expected, dbname=None):
+    db_connection = connections.create_connection('default')
+    if dbname:
+        db_connection.settings_dict = {**db_connection.settings_dict, 'NAME': dbname}
+    try:
+        with db_connection.cursor() as cursor:
+            existing = set(db_connection.introspection.table_names(cursor))
+        actual = table_stats(db_connection, [table for table in expected if table in existing])
+    finally:
+        db_connection.close()
+
+    mismatches = []
+    for table, stats in sorted(expected.items()):
+        restored = actual.get(table)
+        if restored is None:
+            mismatches.append(f'{table}: missing')
+        elif restored['rows'] != stats['rows']:
+            mismatches.append(f"{table}: {restored['rows']} rows, expected {stats['rows']}")
+        elif restored['checksum'] != stats['checksum']:
+            mismatches.append(f'{table}: checksum differs')
+    return mismatches
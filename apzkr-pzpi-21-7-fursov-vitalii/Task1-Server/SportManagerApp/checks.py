@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.checks import Error, register
+
+LOCAL_CACHE = 'django.core.cache.backends.locmem.LocMemCache'
+
+
+# Cached pages are evicted by signals in the process that made the change. A
+# per-process cache in other server processes keeps serving the old page, and
+# under a new ETag once the version was bumped.
+@register()
+def check_shared_cache(app_configs, **kwargs):
+    if getattr(settings, 'WEB_CONCURRENCY', 1) <= 1:
+        return []
+    return [
+        Error(
+            f'The {alias!r} cache is local to each process but WEB_CONCURRENCY is {settings.WEB_CONCURRENCY}.',
+            hint='Use a shared cache backend, e.g. SPORTMANAGER_CACHE=file or SPORTMANAGER_CACHE=database.',
+            id='SportManagerApp.E001',
+        )
+        for alias, options in settings.CACHES.items()
+        if options.get('BACKEND') == LOCAL_CACHE
+    ]
@@ -0,0 +1,92 @@
+import csv
+import json
+from io import StringIO
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import HeartRateReading, MatchTeam, UserTraining
+from .pagination import list_filters
+
+EXPORT_CHUNK_SIZE = 2000
+FLUSH_SIZE = 64 * 1024
+
+# dataset -> (model, filter lookups, [(column, lookup), ...])
+DATASETS = {
+    'user_trainings': (
+        UserTraining,
+        {'team': 'user__team_id', 'training': 'training_id', 'date': 'training__datetime'},
+        [
+            ('user_training_id', 'user_training_id'),
+            ('user_id', 'user_id'),
+            ('user_email', 'user__email'),
+            ('team_id', 'user__team_id'),
+            ('training_id', 'training_id'),
+            ('training_datetime', 'training__datetime'),
+            ('location', 'training__location'),
+            ('duration', 'training__duration'),
+            ('sensor_id', 'sensor_id'),
+            ('intensity', 'intensity'),
+        ],
+    ),
+    'match_teams': (
+        MatchTeam,
+        {'team': 'team_id', 'competition': 'match__competition_id', 'date': 'match__datetime'},
+        [
+            ('match_team_id', 'match_team_id'),
+            ('match_id', 'match_id'),
+            ('match_datetime', 'match__datetime'),
+            ('competition_id', 'match__competition_id'),
+            ('competition', 'match__competition__name'),
+            ('team_id', 'team_id'),
+            ('team', 'team__name'),
+            ('team_score', 'team_score'),
+        ],
+    ),
+    'readings': (
+        HeartRateReading,
+        {'team': 'user__team_id', 'training': 'user_training__training_id', 'date': 'timestamp'},
+        [
+            ('reading_id', 'reading_id'),
+            ('timestamp', 'timestamp'),
+            ('sensor_id', 'sensor_id'),
+            ('user_id', 'user_id'),
+            ('user_training_id', 'user_training_id'),
+            ('pulse', 'pulse'),
+        ],
+    ),
+}
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+# Rows of a dataset with the filters applied in SQL, fetched through a server-side cursor
+def export_rows(dataset, params):
+    model, filter_fields, columns = DATASETS[dataset]
+    queryset = model.objects.filter(**list_filters(params, **filter_fields)).order_by('pk')
+    return queryset.values_list(*[lookup for _, lookup in columns]).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+# Yields the encoded export in ~64 KB pieces so memory stays flat whatever the table size
+def export_stream(dataset, params, export_format):
+    headers = [column for column, _ in DATASETS[dataset][2]]
+    buffer = StringIO()
+
+    if export_format == 'csv':
+        writer = csv.writer(buffer)
+        writer.writerow(headers)
+        write = writer.writerow
+    else:
+        def write(row):
+            buffer.write(json.dumps(dict(zip(headers, row)), cls=DjangoJSONEncoder))
+            buffer.write('\n')
+
+    for row in export_rows(dataset, params):
+        write(row)
+        if buffer.tell() >= FLUSH_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
@@ -0,0 +1,242 @@
+import io
+import json
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .active_sessions import session_resolver
+from .anomalies import detect_anomalies
+from .live import live_hub
+from .models import HeartRateAlert, HeartRateReading, Sensor, User, UserTraining
+from .recommendations import invalidate_recommendations
+from .rollups import apply_rollups, attach_user_trainings
+from .training_load import refresh_training_loads
+from .versions import bump_versions
+
+MIN_PULSE = 20
+MAX_PULSE = 250
+NULL = '\\N'
+
+
+class ReadingError(ValueError):
+    pass
+
+
+def max_batch_size():
+    return getattr(settings, 'INGESTION_MAX_BATCH', 10000)
+
+
+def bulk_size():
+    return getattr(settings, 'INGESTION_BULK_SIZE', 1000)
+
+
+def parse_timestamp(value):
+    if value is None or value == '':
+        return timezone.now()
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return datetime.fromtimestamp(value, tz=dt_timezone.utc)
+    if isinstance(value, str):
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise ReadingError(f'Invalid timestamp: {value!r}')
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        return parsed
+    raise ReadingError(f'Invalid timestamp: {value!r}')
+
+
+def parse_int(value, field):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ReadingError(f'Invalid {field}: {value!r}')
+
+
+# Converts one item of a batch into an unsaved HeartRateReading.
+# An item is either an object with sensor_id, user_id, timestamp and pulse
+# or a [timestamp, pulse] pair using the batch-level sensor_id and user_id.
+# Without a user_id the reading is attributed to the training session the
+# sensor is worn in when it is stored.
+def parse_reading(item, defaults):
+    if isinstance(item, (list, tuple)):
+        if len(item) != 2:
+            raise ReadingError('Reading pairs must be [timestamp, pulse]')
+        item = {'timestamp': item[0], 'pulse': item[1]}
+    if not isinstance(item, dict):
+        raise ReadingError('Reading must be an object or a [timestamp, pulse] pair')
+
+    sensor_id = parse_int(item.get('sensor_id', defaults.get('sensor_id')), 'sensor_id')
+    user_id = item.get('user_id', defaults.get('user_id'))
+    user_id = None if user_id in (None, '') else parse_int(user_id, 'user_id')
+    pulse = parse_int(item.get('pulse'), 'pulse')
+    if not MIN_PULSE <= pulse <= MAX_PULSE:
+        raise ReadingError(f'Pulse {pulse} is outside {MIN_PULSE}-{MAX_PULSE} bpm')
+
+    return HeartRateReading(
+        sensor_id=sensor_id,
+        user_id=user_id,
+        timestamp=parse_timestamp(item.get('timestamp')),
+        pulse=pulse,
+    )
+
+
+# Parses a request body into readings.
+# Accepts a JSON list of readings or an object {"sensor_id", "user_id", "readings": [...]}
+# Returns (readings, errors) where errors is a list of {'index', 'error'}.
+def parse_batch(body):
+    try:
+        payload = json.loads(body)
+    except (TypeError, ValueError):
+        raise ReadingError('Request body must be valid JSON')
+
+    if isinstance(payload, list):
+        items, defaults = payload, {}
+    elif isinstance(payload, dict) and isinstance(payload.get('readings'), list):
+        items, defaults = payload['readings'], payload
+    else:
+        raise ReadingError('Expected a list of readings or an object with a "readings" list')
+
+    if len(items) > max_batch_size():
+        raise ReadingError(f'Batch is larger than {max_batch_size()} readings')
+
+    readings = []
+    errors = []
+    for index, item in enumerate(items):
+        try:
+            readings.append(parse_reading(item, defaults))
+        except ReadingError as error:
+            errors.append({'index': index, 'error': str(error)})
+    return readings, errors
+
+
+# COPY costs far less per row than multi-row INSERTs on PostgreSQL. psycopg2
+# streams a text-format file through copy_expert, psycopg 3 writes rows through
+# cursor.copy(); other databases fall back to bulk_create.
+def insert_readings(readings):
+    if connection.vendor != 'postgresql':
+        HeartRateReading.objects.bulk_create(readings, batch_size=bulk_size())
+        return
+
+    quote = connection.ops.quote_name
+    meta = HeartRateReading._meta
+    columns = [meta.get_field(name).column for name in ('sensor', 'user', 'user_training', 'timestamp', 'pulse')]
+    sql = f'COPY {quote(meta.db_table)} ({", ".join(quote(column) for column in columns)}) FROM STDIN'
+    with connection.cursor() as cursor:
+        raw = cursor.cursor
+        if hasattr(raw, 'copy_expert'):
+            data = io.StringIO(''.join(
+                f'{reading.sensor_id}\t{reading.user_id}\t{NULL if reading.user_training_id is None else reading.user_training_id}'
+                f'\t{reading.timestamp.isoformat()}\t{reading.pulse}\n'
+                for reading in readings
+            ))
+            raw.copy_expert(sql, data)
+        else:
+            with raw.copy(sql) as copy:
+                for reading in readings:
+                    copy.write_row((reading.sensor_id, reading.user_id, reading.user_training_id, reading.timestamp, reading.pulse))
+
+
+# Persists a batch of readings in one transaction.
+# Readings without a user get the user and UserTraining of the sensor's active session.
+# Anomalies found by the streaming detector are stored with the readings.
+# Readings pointing at unknown sensors or users are dropped and reported back,
+# everything else is linked to its UserTraining, written with COPY (or bulk INSERTs) and
+# folded into the rollups, and the latest pulse of every sensor is copied to
+# Sensor.heart_rate with a single UPDATE.
+# Cached recommendations of users whose trainings got readings are dropped.
+def store_readings(readings):
+    if not readings:
+        return [], []
+
+    rejected = []
+    if any(reading.user_id is None for reading in readings):
+        session_resolver.refresh()
+        resolved = []
+        for reading in readings:
+            session = None
+            if reading.user_id is None and session_resolver.covers(reading.timestamp):
+                session = session_resolver.sensor_session(reading.sensor_id, reading.timestamp)
+            if reading.user_id is not None:
+                resolved.append(reading)
+            elif session is None:
+                rejected.append((reading, f'No active training for sensor {reading.sensor_id}'))
+            else:
+                reading.user_training_id, reading.user_id = session
+                resolved.append(reading)
+        readings = resolved
+
+    sensor_ids = {reading.sensor_id for reading in readings}
+    user_ids = {reading.user_id for reading in readings}
+
+    with transaction.atomic():
+        known_sensors = set(Sensor.objects.filter(pk__in=sensor_ids).values_list('pk', flat=True))
+        known_users = dict(User.objects.filter(pk__in=user_ids).values_list('pk', 'age'))
+
+        accepted = []
+        for reading in readings:
+            if reading.sensor_id not in known_sensors:
+                rejected.append((reading, f'Unknown sensor {reading.sensor_id}'))
+            elif reading.user_id not in known_users:
+                rejected.append((reading, f'Unknown user {reading.user_id}'))
+            else:
+                accepted.append(reading)
+
+        attach_user_trainings(accepted)
+        insert_readings(accepted)
+        apply_rollups(accepted)
+        # Sessions still running have no training load to correct yet
+        now = timezone.now()
+        refresh_training_loads({
+            reading.user_training_id for reading in accepted
+            if reading.user_training_id is not None and not session_resolver.running(reading.user_id, reading.user_training_id, now)
+        })
+        HeartRateAlert.objects.bulk_create(detect_anomalies(accepted, known_users), batch_size=bulk_size())
+
+        latest = {}
+        for reading in accepted:
+            current = latest.get(reading.sensor_id)
+            if current is None or reading.timestamp >= current.timestamp:
+                latest[reading.sensor_id] = reading
+        Sensor.objects.bulk_update(
+            [Sensor(sensor_id=sensor_id, heart_rate=reading.pulse) for sensor_id, reading in latest.items()],
+            ['heart_rate'],
+            batch_size=bulk_size(),
+        )
+
+    invalidate_recommendations({reading.user_id for reading in accepted if reading.user_training_id is not None})
+    if accepted:
+        bump_versions([HeartRateReading, Sensor], throttle=True)
+        transaction.on_commit(lambda: live_hub.publish(accepted))
+    return accepted, rejected
+
+
+# Copies the latest pulse of sensors sending without a user_id to Sensor.heart_rate.
+# pulses is {sensor_id: pulse}; unknown sensors are ignored.
+def store_sensor_pulses(pulses):
+    if not pulses:
+        return 0
+    sensors = [Sensor(sensor_id=sensor_id, heart_rate=pulse) for sensor_id, pulse in pulses.items()]
+    updated = Sensor.objects.bulk_update(sensors, ['heart_rate'], batch_size=bulk_size())
+    bump_versions([Sensor], throttle=True)
+    return updated
+
+
+# Stores the running average pulse of training sessions, resolved from the
+# sensor's active session when the device sent it (see device_usertraining_update).
+# averages is {user_training_id: (user_id, average_pulse)}.
+def store_average_pulses(averages):
+    if not averages:
+        return 0
+    user_trainings = [UserTraining(user_training_id=user_training_id, intensity=pulse) for user_training_id, (_, pulse) in averages.items()]
+    updated = UserTraining.objects.bulk_update(user_trainings, ['intensity'], batch_size=bulk_size())
+    now = timezone.now()
+    refresh_training_loads(
+        user_training_id for user_training_id, (user_id, _) in averages.items()
+        if not session_resolver.running(user_id, user_training_id, now)
+    )
+    invalidate_recommendations({user_id for user_id, _ in averages.values()})
+    bump_versions([UserTraining], throttle=True)
+    return updated
@@ -0,0 +1,115 @@
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import Job
+
+# task name -> (function, max attempts)
+TASKS = {}
+
+
+# Registers a function as a background task.
+# The function receives the Job's arguments as keyword arguments and may return
+# a JSON-serializable result that is stored on the job.
+def task(name=None, max_attempts=None):
+    def register(function):
+        TASKS[name or function.__name__] = (function, max_attempts)
+        return function
+    return register
+
+
+# With a dedupe_key, a job still queued under that key is moved to run_after
+# and returned instead of adding another one. It stays locked until the
+# caller's transaction commits, so no worker runs it before it can see the
+# caller's writes; a worker claiming it first makes this add a new job.
+def enqueue(task_name, requested_by=None, run_after=None, dedupe_key='', **arguments):
+    if task_name not in TASKS:
+        raise ValueError(f'Unknown task: {task_name}')
+    max_attempts = TASKS[task_name][1] or getattr(settings, 'JOB_MAX_ATTEMPTS', 3)
+    job = Job(
+        task=task_name,
+        dedupe_key=dedupe_key,
+        arguments=arguments,
+        max_attempts=max_attempts,
+        run_after=run_after or timezone.now(),
+        requested_by=requested_by,
+    )
+    if not dedupe_key:
+        job.save()
+        return job
+
+    with transaction.atomic():
+        while True:
+            queued = Job.objects.select_for_update().filter(dedupe_key=dedupe_key, status='queued').first()
+            if queued is not None:
+                if queued.run_after != job.run_after:
+                    queued.run_after = job.run_after
+                    queued.save(update_fields=['run_after'])
+                return queued
+            try:
+                with transaction.atomic():
+                    job.save(force_insert=True)
+                return job
+            except IntegrityError:
+                # Another transaction queued one under the key in between
+                job.pk = None
+
+
+# Locks the oldest due job and marks it running.
+# SKIP LOCKED lets any number of workers poll the table without blocking each other.
+def claim_job(worker):
+    with transaction.atomic():
+        job = (
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(status='queued', run_after__lte=timezone.now())
+            .order_by('run_after', 'job_id')
+            .first()
+        )
+        if job is None:
+            return None
+        job.status = 'running'
+        job.attempts += 1
+        job.locked_by = worker
+        job.locked_at = job.started_at = timezone.now()
+        job.save(update_fields=['status', 'attempts', 'locked_by', 'locked_at', 'started_at'])
+    return job
+
+
+def retry_delay(attempts):
+    return timedelta(seconds=getattr(settings, 'JOB_RETRY_DELAY', 30) * 2 ** (attempts - 1))
+
+
+# Runs a claimed job; failures are retried with exponential backoff until max_attempts
+def run_job(job):
+    entry = TASKS.get(job.task)
+    try:
+        if entry is None:
+            raise LookupError(f'Unknown task: {job.task}')
+        result = entry[0](**job.arguments)
+    except Exception:
+        job.error = traceback.format_exc()
+        if entry is not None and job.attempts < job.max_attempts:
+            job.status = 'queued'
+            job.run_after = timezone.now() + retry_delay(job.attempts)
+        else:
+            job.status = 'failed'
+            job.finished_at = timezone.now()
+    else:
+        job.status = 'succeeded'
+        job.result = result
+        job.error = ''
+        job.finished_at = timezone.now()
+
+    job.locked_by = ''
+    job.locked_at = None
+    job.save(update_fields=['status', 'result', 'error', 'run_after', 'locked_by', 'locked_at', 'finished_at'])
+    return job
+
+
+# Requeues jobs whose worker died: running for longer than JOB_TIMEOUT seconds
+def requeue_stale_jobs():
+    cutoff = timezone.now() - timedelta(seconds=getattr(settings, 'JOB_TIMEOUT', 3600))
+    return Job.objects.filter(status='running', locked_at__lt=cutoff).update(status='queued', locked_by='', locked_at=None)
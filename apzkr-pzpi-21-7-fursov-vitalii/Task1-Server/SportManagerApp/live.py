@@ -0,0 +1,224 @@
+import asyncio
+import threading
+from collections import deque
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .active_sessions import session_resolver
+from .metrics import registry
+from .models import HeartRateReading, Training, UserTraining
+from .recommendations import heart_rate_zone
+
+
+def live_window():
+    return timedelta(seconds=getattr(settings, 'LIVE_AVERAGE_WINDOW', 30))
+
+
+# Latest pulse of one athlete in a training and the readings of the last
+# LIVE_AVERAGE_WINDOW seconds for the rolling average
+class Athlete:
+    def __init__(self, user_training_id, user_id, name, age):
+        self.user_training_id = user_training_id
+        self.user_id = user_id
+        self.name = name
+        self.age = age
+        self.window = deque()
+        self.total = 0
+        self.pulse = self.timestamp = None
+
+    def add(self, timestamp, pulse, window):
+        if self.timestamp is None or timestamp >= self.timestamp:
+            self.timestamp, self.pulse = timestamp, pulse
+        elif timestamp < self.timestamp - window:
+            return
+        self.window.append((timestamp, pulse))
+        self.total += pulse
+        start = self.timestamp - window
+        while self.window[0][0] < start:
+            self.total -= self.window.popleft()[1]
+
+    def as_json(self):
+        return {
+            'user_training_id': self.user_training_id,
+            'user_id': self.user_id,
+            'name': self.name,
+            'pulse': self.pulse,
+            'zone': heart_rate_zone(self.pulse, self.age) if self.pulse is not None and self.age is not None else None,
+            'average': round(self.total / len(self.window), 1) if self.window else None,
+            'timestamp': self.timestamp,
+        }
+
+
+class LiveTraining:
+    def __init__(self, training_id):
+        self.training_id = training_id
+        self.athletes = {}
+        self.subscribers = set()
+        self.loaded = False
+
+
+# One open live connection. Updates are merged per athlete until the
+# connection sends them, so a slow client gets the latest state, not a backlog.
+class Subscriber:
+    def __init__(self, training):
+        self.training = training
+        self.pending = {}
+        self.event = asyncio.Event()
+        self.closed = False
+
+    def push(self, athletes):
+        for athlete in athletes:
+            self.pending[athlete['user_training_id']] = athlete
+        self.event.set()
+
+    def take(self):
+        pending, self.pending = self.pending, {}
+        self.event.clear()
+        return list(pending.values())
+
+    def close(self):
+        self.closed = True
+        self.event.set()
+
+
+# In-process fan-out of stored readings to the live connections of trainings.
+# Only trainings somebody watches are held: publish() looks every reading up
+# by its user training in one dict, updates the athlete and hands the changed
+# athletes of each training to the event loop in one call, which pushes them
+# to every subscriber. Subscribers are only touched in the event loop; the
+# athletes are shared with the threads storing readings under the lock.
+class LiveHub:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.trainings = {}
+        self.athletes = {}
+        self.loop = None
+        self.version = None
+
+    def connections(self):
+        return sum(len(training.subscribers) for training in self.trainings.values())
+
+    # Called in the event loop; load() fills the training in a thread afterwards
+    def subscribe(self, training_id):
+        self.loop = asyncio.get_running_loop()
+        with self.lock:
+            training = self.trainings.setdefault(training_id, LiveTraining(training_id))
+            subscriber = Subscriber(training)
+            training.subscribers.add(subscriber)
+        registry.set('live_connections', 'Open live training connections', self.connections())
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        training = subscriber.training
+        with self.lock:
+            training.subscribers.discard(subscriber)
+            if not training.subscribers and self.trainings.get(training.training_id) is training:
+                del self.trainings[training.training_id]
+                for user_training_id in training.athletes:
+                    self.athletes.pop(user_training_id, None)
+        registry.set('live_connections', 'Open live training connections', self.connections())
+
+    # Loads the athletes of a training and their readings of the last window.
+    # Returns False if the training does not exist.
+    def load(self, training):
+        close_old_connections()
+        if training.loaded:
+            return True
+        if not Training.objects.filter(pk=training.training_id).exists():
+            return False
+        athletes = {
+            user_training_id: Athlete(user_training_id, user_id, name, age)
+            for user_training_id, user_id, name, age in UserTraining.objects.filter(training_id=training.training_id)
+            .values_list('user_training_id', 'user_id', 'user__first_name', 'user__age')
+        }
+        window = live_window()
+        readings = (
+            HeartRateReading.objects.filter(user_training_id__in=list(athletes), timestamp__gte=timezone.now() - window)
+            .order_by('timestamp')
+            .values_list('user_training_id', 'timestamp', 'pulse')
+        )
+        for user_training_id, timestamp, pulse in readings:
+            athletes[user_training_id].add(timestamp, pulse, window)
+
+        with self.lock:
+            if not training.loaded and self.trainings.get(training.training_id) is training:
+                training.athletes = athletes
+                training.loaded = True
+                self.athletes.update((user_training_id, (training, athlete)) for user_training_id, athlete in athletes.items())
+        return True
+
+    def snapshot(self, training):
+        with self.lock:
+            return [athlete.as_json() for athlete in training.athletes.values()]
+
+    # Picks up athletes added to or removed from watched trainings, once the
+    # active sessions changed
+    def reload(self, version):
+        trainings = [training for training in list(self.trainings.values()) if training.loaded]
+        rows = UserTraining.objects.filter(training_id__in=[training.training_id for training in trainings]).values_list(
+            'user_training_id', 'training_id', 'user_id', 'user__first_name', 'user__age'
+        )
+        members = {}
+        for user_training_id, training_id, user_id, name, age in rows:
+            members.setdefault(training_id, []).append((user_training_id, user_id, name, age))
+
+        with self.lock:
+            for training in trainings:
+                if self.trainings.get(training.training_id) is not training:
+                    continue
+                athletes = {}
+                for user_training_id, user_id, name, age in members.get(training.training_id, ()):
+                    athlete = training.athletes.get(user_training_id)
+                    if athlete is None or athlete.user_id != user_id:
+                        athlete = Athlete(user_training_id, user_id, name, age)
+                    athlete.name, athlete.age = name, age
+                    athletes[user_training_id] = athlete
+                for user_training_id in training.athletes.keys() - athletes.keys():
+                    self.athletes.pop(user_training_id, None)
+                self.athletes.update((user_training_id, (training, athlete)) for user_training_id, athlete in athletes.items())
+                training.athletes = athletes
+            self.version = version
+
+    # Called with the readings of a committed batch, from any thread
+    def publish(self, readings):
+        if not self.trainings:
+            return
+        version = session_resolver.version
+        if version != self.version:
+            self.reload(version)
+        window = live_window()
+        changed = {}
+        with self.lock:
+            for reading in readings:
+                entry = self.athletes.get(reading.user_training_id)
+                if entry is None:
+                    continue
+                training, athlete = entry
+                athlete.add(reading.timestamp, reading.pulse, window)
+                changed.setdefault(training, {})[athlete.user_training_id] = athlete
+            updates = [(training, [athlete.as_json() for athlete in athletes.values()]) for training, athletes in changed.items()]
+        if not updates:
+            return
+        try:
+            self.loop.call_soon_threadsafe(self.deliver, updates)
+        except RuntimeError:
+            # The event loop is closed: the server is shutting down
+            pass
+
+    def deliver(self, updates):
+        for training, athletes in updates:
+            for subscriber in training.subscribers:
+                subscriber.push(athletes)
+            registry.increment('live_updates_total', 'Athlete updates pushed to live connections', len(athletes) * len(training.subscribers))
+
+    # Ends every live connection of this process
+    def close(self):
+        for training in list(self.trainings.values()):
+            for subscriber in list(training.subscribers):
+                subscriber.close()
+
+
+live_hub = LiveHub()
@@ -1,27 +1,27 @@
-import os
-from django.core.management.base import BaseCommand
-from django.conf import settings
-import datetime
+from django.core.management.base import BaseCommand, CommandError
+
+from SportManagerApp.backups import FORMATS, create_backup, run_backup
+
 
 class Command(BaseCommand):
     help = 'Backup the PostgreSQL database'
 
-    def handle(self, *args, **kwargs):
-        # Backup database
-        db_name = settings.DATABASES['default']['NAME']
-        db_user = settings.DATABASES['default']['USER']
-        db_password = settings.DATABASES['default']['PASSWORD']
-        db_host = settings.DATABASES['default']['HOST']
-        db_port = settings.DATABASES['default']['PORT']
-
-        backup_dir = os.path.join(settings.BASE_DIR, 'backups')
-        os.makedirs(backup_dir, exist_ok=True)
-        date_str = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
-        db_backup_file = os.path.join(backup_dir, f'{db_name}_backup_{date_str}.sql')
-
-        os.environ['PGPASSWORD'] = db_password
-        pg_dump_path = '/Library/PostgreSQL/16/bin/pg_dump'  
-        dump_cmd = f'{pg_dump_path} -U {db_user} -h {db_host} -p {db_port} {db_name} > {db_backup_file}'
-        os.system(dump_cmd)
-
-        self.stdout.write(self.style.SUCCESS(f'Successfully backed up the database to {db_backup_file}'))
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(FORMATS), help='pg_dump format (default: BACKUP_FORMAT)')
+        parser.add_argument('--jobs', type=int, help='Parallel dump jobs for the directory format (default: BACKUP_JOBS)')
+        parser.add_argument('--compress', type=int, choices=range(0, 10), help='Compression level 0-9 (default: BACKUP_COMPRESSION)')
+
+    def handle(self, *args, **options):
+        backup = create_backup(backup_format=options['format'], jobs=options['jobs'], compression=options['compress'])
+
+        def on_progress(done, total):
+            self.stdout.write(f'Dumped {done}/{total} tables')
+
+        backup = run_backup(backup, on_progress=on_progress)
+        if backup.status != 'succeeded':
+            raise CommandError(f'Backup failed: {backup.error}')
+
+        if backup.snapshot:
+            self.stdout.write(self.style.SUCCESS(f'Successfully backed up the database to snapshot {backup.snapshot} of the backup store'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Successfully backed up the database to {backup.path}'))
@@ -0,0 +1,52 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from SportManagerApp.backups import get_store
+
+
+class Command(BaseCommand):
+    help = 'Manage the deduplicated backup store'
+
+    def add_arguments(self, parser):
+        actions = parser.add_subparsers(dest='action', required=True)
+        actions.add_parser('list', help='List snapshots')
+        add = actions.add_parser('add', help='Add an existing dump file or directory as a snapshot')
+        add.add_argument('path')
+        add.add_argument('--name')
+        add.add_argument('--format', default='plain', choices=['plain', 'custom', 'directory'])
+        extract = actions.add_parser('extract', help='Rebuild a snapshot on disk')
+        extract.add_argument('name')
+        extract.add_argument('destination')
+        prune = actions.add_parser('prune', help='Apply the retention policy and collect unreferenced chunks')
+        prune.add_argument('--keep-last', type=int, default=getattr(settings, 'BACKUP_KEEP_LAST', None))
+        prune.add_argument('--keep-days', type=int, default=getattr(settings, 'BACKUP_KEEP_DAYS', None))
+        actions.add_parser('gc', help='Delete chunks no snapshot references')
+
+    def handle(self, *args, **options):
+        store = get_store()
+        action = options['action']
+
+        if action == 'list':
+            for manifest in store.snapshots():
+                self.stdout.write(
+                    f"{manifest['name']}  {manifest['created_at']}  {manifest['bytes_total']} bytes, "
+                    f"{manifest['chunks_new']}/{manifest['chunks_total']} new chunks, {manifest['bytes_written']} bytes written"
+                )
+        elif action == 'add':
+            manifest = store.add_snapshot(options['path'], name=options['name'], metadata={'format': options['format']})
+            self.stdout.write(self.style.SUCCESS(
+                f"Stored {manifest['name']}: {manifest['chunks_new']}/{manifest['chunks_total']} new chunks, "
+                f"{manifest['bytes_written']} of {manifest['bytes_total']} bytes written"
+            ))
+        elif action == 'extract':
+            try:
+                path = store.extract(options['name'], options['destination'])
+            except FileNotFoundError:
+                raise CommandError(f"Snapshot {options['name']} does not exist")
+            self.stdout.write(self.style.SUCCESS(f'Extracted {options["name"]} to {path}'))
+        elif action == 'prune':
+            removed, (chunks, freed) = store.prune(keep_last=options['keep_last'], keep_days=options['keep_days'])
+            self.stdout.write(self.style.SUCCESS(f'Removed {len(removed)} snapshots, {chunks} chunks, {freed} bytes'))
+        elif action == 'gc':
+            chunks, freed = store.gc()
+            self.stdout.write(self.style.SUCCESS(f'Removed {chunks} chunks, {freed} bytes'))
@@ -0,0 +1,185 @@
+import json
+import statistics
+import time
+from datetime import date
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import URLPattern, URLResolver, get_resolver, reverse
+from django.utils import timezone
+
+from SportManagerApp.models import Competition, DatabaseBackup, Job, Match, MatchTeam, Sensor, Team, Training, User, UserTraining
+
+# View name prefix -> model whose latest row fills the <pk> of the URL
+PK_MODELS = {
+    'user': User,
+    'team': Team,
+    'match': Match,
+    'matchteam': MatchTeam,
+    'competition': Competition,
+    'training': Training,
+    'usertraining': UserTraining,
+    'sensor': Sensor,
+    'backup': DatabaseBackup,
+    'job': Job,
+}
+
+# Views that change data or the session on GET
+SKIP_VIEWS = {'backup', 'rebuild_stats', 'logout'}
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def iter_patterns(patterns):
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            if pattern.app_name != 'admin':
+                yield from iter_patterns(pattern.url_patterns)
+        elif isinstance(pattern, URLPattern) and pattern.name:
+            yield pattern
+
+
+# Drives every named GET URL of the project through the test client and reports
+# p50/p95 latency and SQL query counts. Results are written as JSON and can be
+# compared with an earlier run to catch regressions.
+class Command(BaseCommand):
+    help = 'Benchmark every URL of the project with the Django test client'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--user', help='Email of the user to log in as (default: the first admin)')
+        parser.add_argument('--only', nargs='*', help='Benchmark only these view names')
+        parser.add_argument('--output', help='Write the results to this JSON file')
+        parser.add_argument('--compare', help='JSON results of an earlier run to compare with')
+        parser.add_argument('--threshold', type=float, default=20.0, help='Allowed p95 slowdown in percent')
+        parser.add_argument('--fail-on-regression', action='store_true')
+
+    def handle(self, *args, **options):
+        user = self.get_user(options['user'])
+        urls = self.collect_urls(options['only'])
+
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'], QUERY_BUDGET_MODE='log'):
+            # Broken views are reported with their 500 status instead of stopping the run
+            client = Client(raise_request_exception=False)
+            if user:
+                client.force_login(user)
+            results = {}
+            for name, route, url in urls:
+                result = self.measure(client, url, options['iterations'])
+                if result is None:
+                    continue
+                # Views routed from several URLs are keyed by name and route
+                results[name if name not in results else f'{name} {route}'] = result
+                self.stdout.write(
+                    f"{name:32} {result['status']}  p50 {result['p50_ms']:8.1f} ms  p95 {result['p95_ms']:8.1f} ms  "
+                    f"cold {result['cold_ms']:8.1f} ms  {result['queries']} queries"
+                )
+
+        report = {
+            'created_at': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'iterations': options['iterations'],
+            'user': user.email if user else None,
+            'rows': {model.__name__: model.objects.count() for model in [User, Team, Competition, Match, Training, UserTraining]},
+            'results': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                json.dump(report, handle, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+        if options['compare']:
+            regressions = self.compare(options['compare'], results, options['threshold'])
+            if regressions and options['fail_on_regression']:
+                raise CommandError(f'{len(regressions)} views regressed')
+
+    def get_user(self, email):
+        if email:
+            try:
+                return User.objects.get(email=email)
+            except User.DoesNotExist:
+                raise CommandError(f'User {email} does not exist')
+        return User.objects.filter(role='admin').order_by('pk').first()
+
+    # (view name, route, URL) of every GET endpoint, with path arguments filled from existing rows
+    def collect_urls(self, only):
+        urls = []
+        for pattern in iter_patterns(get_resolver().url_patterns):
+            name = pattern.name
+            if name in SKIP_VIEWS or 'delete' in name or (only and name not in only):
+                continue
+            kwargs = {}
+            for argument in pattern.pattern.converters:
+                if argument == 'pk':
+                    model = PK_MODELS.get(name.split('_')[0])
+                    pk = model.objects.order_by('-pk').values_list('pk', flat=True).first() if model else None
+                    if pk is None:
+                        break
+                    kwargs['pk'] = pk
+                elif argument == 'year':
+                    kwargs['year'] = date.today().year
+                elif argument == 'month':
+                    kwargs['month'] = date.today().month
+                elif argument == 'date':
+                    kwargs['date'] = date.today().isoformat()
+                elif argument == 'dataset':
+                    kwargs['dataset'] = 'user_trainings'
+                else:
+                    break
+            else:
+                urls.append((name, str(pattern.pattern), reverse(name, kwargs=kwargs)))
+        return urls
+
+    # First request is reported as cold (empty caches), the rest give the percentiles.
+    # POST-only endpoints (405 on GET) are skipped.
+    def measure(self, client, url, iterations):
+        timings = []
+        queries = []
+        status = None
+        for _ in range(iterations + 1):
+            with CaptureQueriesContext(connection) as context:
+                started = time.perf_counter()
+                response = client.get(url)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                timings.append((time.perf_counter() - started) * 1000)
+            queries.append(len(context.captured_queries))
+            status = response.status_code
+            if status == 405:
+                return None
+        warm = timings[1:] or timings
+        return {
+            'url': url,
+            'status': status,
+            'cold_ms': round(timings[0], 2),
+            'p50_ms': round(statistics.median(warm), 2),
+            'p95_ms': round(percentile(warm, 0.95), 2),
+            'mean_ms': round(statistics.fmean(warm), 2),
+            'queries': max(queries[1:] or queries),
+            'cold_queries': queries[0],
+        }
+
+    def compare(self, path, results, threshold):
+        with open(path) as handle:
+            previous = json.load(handle)['results']
+        regressions = []
+        for name, result in results.items():
+            before = previous.get(name)
+            if before is None:
+                continue
+            slowdown = (result['p95_ms'] / before['p95_ms'] - 1) * 100 if before['p95_ms'] else 0
+            if slowdown > threshold or result['queries'] > before['queries']:
+                regressions.append(name)
+                self.stdout.write(self.style.WARNING(
+                    f"{name}: p95 {before['p95_ms']} -> {result['p95_ms']} ms ({slowdown:+.0f}%), "
+                    f"queries {before['queries']} -> {result['queries']}"
+                ))
+        if not regressions:
+            self.stdout.write(self.style.SUCCESS('No regressions'))
+        return regressions
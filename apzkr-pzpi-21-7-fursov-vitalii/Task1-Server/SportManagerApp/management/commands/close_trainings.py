@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from SportManagerApp.training_load import close_trainings, rebuild_daily_loads
+
+
+# Computes the training load of ended trainings. The close_trainings task does
+# the same at the end of every training; this command catches up after imports
+# or a stopped worker and can rebuild the daily loads.
+class Command(BaseCommand):
+    help = 'Compute the training load of ended trainings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--rebuild', action='store_true', help='Recompute the daily loads from the stored training loads')
+
+    def handle(self, *args, **options):
+        closed = close_trainings(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Computed the training load of {closed} user trainings'))
+        if options['rebuild']:
+            rebuild_daily_loads(chunk_size=options['chunk_size'])
+            self.stdout.write(self.style.SUCCESS('Rebuilt the daily training loads'))
@@ -0,0 +1,38 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from SportManagerApp.exports import DATASETS, FORMATS, export_stream
+
+
+class Command(BaseCommand):
+    help = 'Stream UserTraining, MatchTeam or heart-rate reading rows as CSV or NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=sorted(DATASETS))
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+        parser.add_argument('--output', help='File to write to (default: stdout)')
+        parser.add_argument('--date-from', help='YYYY-MM-DD, inclusive')
+        parser.add_argument('--date-to', help='YYYY-MM-DD, inclusive')
+        parser.add_argument('--team', type=int)
+        parser.add_argument('--competition', type=int)
+        parser.add_argument('--training', type=int)
+
+    def handle(self, *args, **options):
+        params = {
+            'date_from': options['date_from'],
+            'date_to': options['date_to'],
+            'team': options['team'],
+            'competition': options['competition'],
+            'training': options['training'],
+        }
+        output = open(options['output'], 'w', newline='') if options['output'] else sys.stdout
+        try:
+            for piece in export_stream(options['dataset'], params, options['format']):
+                output.write(piece)
+        finally:
+            if options['output']:
+                output.close()
+
+        if options['output']:
+            self.stderr.write(self.style.SUCCESS(f'Exported {options["dataset"]} to {options["output"]}'))
@@ -0,0 +1,42 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from SportManagerApp.models import Sensor, User
+from SportManagerApp.tokens import issue_token
+
+
+# Issues device tokens for provisioning sensors (and the load generator) and
+# user tokens for scripts, without going through the API.
+class Command(BaseCommand):
+    help = 'Issue bearer tokens for sensors or users'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sensors', nargs='*', type=int, default=[], help='Sensor ids')
+        parser.add_argument('--sensor-range', nargs=2, type=int, metavar=('FIRST', 'LAST'), help='Inclusive range of sensor ids')
+        parser.add_argument('--users', nargs='*', default=[], help='User emails')
+        parser.add_argument('--ttl', type=int, help='Lifetime in seconds (default and maximum from the settings)')
+        parser.add_argument('--output', help='Write {"sensors": {id: token}, "users": {email: token}} to this JSON file')
+
+    def handle(self, *args, **options):
+        sensor_ids = set(options['sensors'])
+        if options['sensor_range']:
+            first, last = options['sensor_range']
+            sensor_ids.update(range(first, last + 1))
+        known_sensors = set(Sensor.objects.filter(pk__in=sensor_ids).values_list('pk', flat=True))
+        if sensor_ids - known_sensors:
+            raise CommandError(f'Unknown sensors: {sorted(sensor_ids - known_sensors)[:20]}')
+        users = dict(User.objects.filter(email__in=options['users']).values_list('email', 'pk'))
+        if set(options['users']) - set(users):
+            raise CommandError(f"Unknown users: {sorted(set(options['users']) - set(users))}")
+
+        tokens = {
+            'sensors': {str(sensor_id): issue_token('device', sensor_id, options['ttl'])[0] for sensor_id in sorted(sensor_ids)},
+            'users': {email: issue_token('user', user_id, options['ttl'])[0] for email, user_id in users.items()},
+        }
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                json.dump(tokens, handle, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Issued {len(tokens['sensors'])} device and {len(tokens['users'])} user tokens to {options['output']}"))
+        else:
+            self.stdout.write(json.dumps(tokens, indent=2))
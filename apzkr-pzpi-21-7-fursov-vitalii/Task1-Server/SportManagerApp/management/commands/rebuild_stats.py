@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from SportManagerApp.models import Competition, Match, MatchResult, MatchTeam, Team
+from SportManagerApp.page_cache import invalidate_pages
+from SportManagerApp.results import refresh_match_results
+from SportManagerApp.standings import invalidate_standings
+from SportManagerApp.team_stats import reset_team_stats
+from SportManagerApp.versions import bump_versions
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the denormalized match results and team statistics from scratch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        with transaction.atomic():
+            MatchResult.objects.all().delete()
+            reset_team_stats()
+            chunk = []
+            count = 0
+            for match_id in Match.objects.order_by('pk').values_list('pk', flat=True).iterator(chunk_size=chunk_size):
+                chunk.append(match_id)
+                if len(chunk) == chunk_size:
+                    refresh_match_results(chunk)
+                    count += len(chunk)
+                    chunk = []
+            refresh_match_results(chunk)
+            count += len(chunk)
+
+            # Pages, standings and ETags built on the old results are dropped once this commits
+            competition_ids = list(Competition.objects.values_list('pk', flat=True))
+            invalidate_pages(competition_ids, competition_list=True)
+            invalidate_standings(competition_ids)
+            bump_versions([Match, MatchTeam, Team, Competition])
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt results and team statistics from {count} matches'))
@@ -0,0 +1,85 @@
+import json
+import os
+import subprocess
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from SportManagerApp.active_sessions import invalidate_sessions
+from SportManagerApp.backups import database_env, get_store, guess_format, manifest_path, restore_commands, verify_tables
+from SportManagerApp.versions import TRACKED_MODELS, bump_versions
+
+
+class Command(BaseCommand):
+    help = 'Restore the PostgreSQL database from a backup store snapshot or a dump and verify it'
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help='Snapshot name in the backup store or path to a dump')
+        parser.add_argument('--jobs', type=int, default=getattr(settings, 'BACKUP_RESTORE_JOBS', 4), help='Parallel jobs for the data and index phases')
+        parser.add_argument('--dbname', help='Database to restore into (default: the configured database)')
+        parser.add_argument('--clean', action='store_true', help='Drop existing objects before recreating them')
+        parser.add_argument('--no-verify', action='store_true', help='Skip the row count and checksum verification')
+
+    def handle(self, *args, **options):
+        dbname = options['dbname'] or settings.DATABASES['default']['NAME']
+        timings = []
+        started = time.monotonic()
+
+        with tempfile.TemporaryDirectory(prefix='restore-') as workdir:
+            path, manifest = self.resolve_source(options['source'], workdir, timings)
+            backup_format = manifest.get('format') or guess_format(path)
+            self.stdout.write(f'Restoring {options["source"]} ({backup_format}) into {dbname}')
+
+            for phase, command in restore_commands(path, backup_format, dbname, options['jobs'], clean=options['clean']):
+                phase_started = time.monotonic()
+                result = subprocess.run(command, env=database_env(), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+                if result.returncode != 0:
+                    raise CommandError(f'Restore failed during {phase}: {result.stderr.strip()}')
+                self.record(timings, phase, phase_started)
+
+        if options['no_verify']:
+            self.stdout.write('Verification skipped')
+        elif not manifest.get('tables'):
+            self.stdout.write(self.style.WARNING('The backup has no table manifest, verification skipped'))
+        else:
+            phase_started = time.monotonic()
+            mismatches = verify_tables(manifest['tables'], dbname=dbname)
+            self.record(timings, 'verify', phase_started)
+            if mismatches:
+                raise CommandError('Verification failed:\n' + '\n'.join(mismatches))
+            self.stdout.write(f"Verified {len(manifest['tables'])} tables")
+
+        # Pages fetched before the restore must not be answered with 304
+        if dbname == settings.DATABASES['default']['NAME']:
+            bump_versions(TRACKED_MODELS)
+            invalidate_sessions()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully restored {options["source"]} in {time.monotonic() - started:.1f}s '
+            f'(' + ', '.join(f'{phase} {seconds:.1f}s' for phase, seconds in timings) + ')'
+        ))
+
+    # Returns (dump path, manifest); store snapshots are extracted into workdir first
+    def resolve_source(self, source, workdir, timings):
+        store = get_store()
+        if os.path.exists(store.manifest_path(source)):
+            phase_started = time.monotonic()
+            manifest = store.manifest(source)
+            path = store.extract(source, workdir)
+            self.record(timings, 'extract', phase_started)
+            return path, manifest
+
+        if not os.path.exists(source):
+            raise CommandError(f'{source} is neither a snapshot of the backup store nor a dump')
+        manifest = {}
+        if os.path.exists(manifest_path(source)):
+            with open(manifest_path(source)) as handle:
+                manifest = json.load(handle)
+        return source, manifest
+
+    def record(self, timings, phase, phase_started):
+        seconds = time.monotonic() - phase_started
+        timings.append((phase, seconds))
+        self.stdout.write(f'{phase}: {seconds:.1f}s')
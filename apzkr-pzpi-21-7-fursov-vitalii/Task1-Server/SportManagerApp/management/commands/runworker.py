@@ -0,0 +1,80 @@
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection, connections
+
+from SportManagerApp.jobs import claim_job, requeue_stale_jobs, run_job
+
+
+# One worker thread: claims and runs jobs until stopped (or until the queue is empty in burst mode)
+def work(name, stop, poll_interval, burst):
+    try:
+        while not stop.is_set():
+            close_old_connections()
+            job = claim_job(name)
+            if job is None:
+                if burst:
+                    break
+                stop.wait(poll_interval)
+                continue
+            run_job(job)
+    finally:
+        connection.close()
+
+
+# One worker process with a pool of threads; SIGTERM/SIGINT let running jobs finish
+def run_process(index, threads, poll_interval, burst):
+    stop = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *args: stop.set())
+
+    prefix = f'{socket.gethostname()}:{os.getpid()}'
+    pool = [
+        threading.Thread(target=work, args=(f'{prefix}:{number}', stop, poll_interval, burst), name=f'worker-{index}-{number}')
+        for number in range(threads)
+    ]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+
+
+class Command(BaseCommand):
+    help = 'Run background jobs from the job queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=getattr(settings, 'JOB_WORKER_PROCESSES', 1))
+        parser.add_argument('--threads', type=int, default=getattr(settings, 'JOB_WORKER_THREADS', 4))
+        parser.add_argument('--poll-interval', type=float, default=getattr(settings, 'JOB_POLL_INTERVAL', 1.0))
+        parser.add_argument('--burst', action='store_true', help='Exit once the queue is empty')
+
+    def handle(self, *args, **options):
+        requeued = requeue_stale_jobs()
+        if requeued:
+            self.stdout.write(f'Requeued {requeued} stale jobs')
+
+        process_args = (options['threads'], options['poll_interval'], options['burst'])
+        self.stdout.write(f"Starting {options['processes']} worker processes with {options['threads']} threads each")
+        if options['processes'] <= 1:
+            run_process(0, *process_args)
+            return
+
+        # Forked children must not share the parent's database connections
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        processes = [context.Process(target=run_process, args=(index, *process_args)) for index in range(options['processes'])]
+        for process in processes:
+            process.start()
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.join()
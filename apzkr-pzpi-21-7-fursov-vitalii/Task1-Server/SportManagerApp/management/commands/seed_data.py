@@ -0,0 +1,215 @@
+import math
+import random
+import time
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from SportManagerApp.active_sessions import invalidate_sessions
+from SportManagerApp.ingestion import store_readings
+from SportManagerApp.models import Competition, HeartRateReading, Match, MatchTeam, Sensor, Team, Training, User, UserTraining
+from SportManagerApp.training_load import close_trainings
+from SportManagerApp.versions import TRACKED_MODELS, bump_versions
+
+CITIES = ['Kharkiv', 'Kyiv', 'Lviv', 'Odesa', 'Dnipro', 'Poltava', 'Vinnytsia', 'Chernihiv']
+SPORTS = ['Football', 'Basketball', 'Volleyball', 'Handball', 'Hockey']
+LOCATIONS = ['Central Stadium', 'Sports Palace', 'City Arena', 'Training Base', 'University Gym']
+SESSION_SAMPLE = 10000
+
+
+def chunked(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+# Seeds a synthetic season with bulk INSERTs.
+# Signals do not fire for bulk_create, so the derived tables are rebuilt at the end:
+# match results and team statistics through rebuild_stats, heart-rate rollups by
+# storing the readings through the regular ingestion path. Model versions are
+# bumped so conditional GETs see the new rows.
+class Command(BaseCommand):
+    help = 'Seed a large synthetic dataset (users, teams, competitions, matches, trainings, heart-rate readings)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50000)
+        parser.add_argument('--teams', type=int, default=2000)
+        parser.add_argument('--competitions', type=int, default=100)
+        parser.add_argument('--matches', type=int, default=100000)
+        parser.add_argument('--trainings', type=int, default=20000)
+        parser.add_argument('--trainings-per-user', type=int, default=20)
+        parser.add_argument('--sensors', type=int, default=1000)
+        parser.add_argument('--readings', type=int, default=2000000)
+        parser.add_argument('--days', type=int, default=365, help='Length of the season ending today')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.season_end = timezone.now().replace(minute=0, second=0, microsecond=0)
+        self.season_start = self.season_end - timedelta(days=options['days'])
+
+        teams = self.step('teams', self.create_teams, options['teams'])
+        users = self.step('users', self.create_users, options['users'], teams)
+        competitions = self.step('competitions', self.create_competitions, options['competitions'])
+        self.step('matches', self.create_matches, options['matches'], competitions, teams)
+        sensors = self.step('sensors', self.create_sensors, options['sensors'])
+        trainings = self.step('trainings', self.create_trainings, options['trainings'])
+        sessions = self.step('user trainings', self.create_user_trainings, users, trainings, sensors, options['trainings_per_user'])
+        self.step('readings', self.create_readings, options['readings'], sessions)
+        self.step('statistics', call_command, 'rebuild_stats', stdout=self.stdout)
+        self.step('training loads', close_trainings)
+        cache.clear()
+        bump_versions(TRACKED_MODELS)
+        invalidate_sessions()
+        self.stdout.write(self.style.SUCCESS('Successfully seeded the database'))
+
+    def step(self, name, function, *args, **kwargs):
+        started = time.monotonic()
+        result = function(*args, **kwargs)
+        self.stdout.write(f'{name}: {time.monotonic() - started:.1f}s')
+        return result
+
+    def bulk_create(self, model, objects):
+        created = []
+        for chunk in chunked(objects, self.batch_size):
+            created += model.objects.bulk_create(chunk)
+        return created
+
+    def random_datetime(self):
+        seconds = int((self.season_end - self.season_start).total_seconds())
+        return self.season_start + timedelta(seconds=self.random.randrange(0, seconds, 15 * 60))
+
+    def create_teams(self, count):
+        offset = Team.objects.count()
+        return self.bulk_create(Team, [
+            Team(name=f'Team {offset + index}', city=self.random.choice(CITIES), sport_type=self.random.choice(SPORTS))
+            for index in range(count)
+        ])
+
+    def create_users(self, count, teams):
+        offset = User.objects.count()
+        # Hashing is deliberately slow, so every seeded user shares one password hash
+        password = make_password('password')
+        users = []
+        for index in range(count):
+            number = offset + index
+            role = 'coach' if index % 25 == 0 else 'sportsman'
+            users.append(User(
+                email=f'seed{number}@example.com',
+                password=password,
+                team=self.random.choice(teams) if teams else None,
+                first_name=f'Athlete {number}',
+                age=self.random.randint(16, 40),
+                gender=self.random.choice(['male', 'female']),
+                height=self.random.randint(155, 205),
+                weight=self.random.randint(50, 110),
+                role=role,
+            ))
+        return self.bulk_create(User, users)
+
+    def create_competitions(self, count):
+        offset = Competition.objects.count()
+        return self.bulk_create(Competition, [
+            Competition(
+                name=f'Cup {offset + index}',
+                prize_pool=self.random.randrange(1000, 1000000, 1000),
+                league=f'League {index % 10 + 1}',
+                sport_type=self.random.choice(SPORTS),
+            )
+            for index in range(count)
+        ])
+
+    # Matches are created chunk by chunk together with their two MatchTeam rows
+    def create_matches(self, count, competitions, teams):
+        if not competitions or len(teams) < 2:
+            return
+        for chunk_start in range(0, count, self.batch_size):
+            matches = Match.objects.bulk_create([
+                Match(
+                    datetime=self.random_datetime(),
+                    location=self.random.choice(LOCATIONS),
+                    duration=timedelta(minutes=self.random.choice([60, 90, 120])),
+                    competition=self.random.choice(competitions),
+                )
+                for _ in range(min(self.batch_size, count - chunk_start))
+            ])
+            match_teams = []
+            for match in matches:
+                for team in self.random.sample(teams, 2):
+                    match_teams.append(MatchTeam(match=match, team=team, team_score=self.random.choice([0, 0, 1, 1, 1, 2, 2, 3, 4])))
+            MatchTeam.objects.bulk_create(match_teams)
+
+    def create_sensors(self, count):
+        return self.bulk_create(Sensor, [Sensor(heart_rate=self.random.randint(55, 75)) for _ in range(count)])
+
+    def create_trainings(self, count):
+        return self.bulk_create(Training, [
+            Training(
+                datetime=self.random_datetime(),
+                location=self.random.choice(LOCATIONS),
+                duration=timedelta(minutes=self.random.choice([45, 60, 90])),
+            )
+            for _ in range(count)
+        ])
+
+    # Returns a sample of at most SESSION_SAMPLE finished user trainings as
+    # (user_training_id, user_id, sensor_id, start, duration) to attach readings to
+    def create_user_trainings(self, users, trainings, sensors, per_user):
+        if not trainings or not sensors:
+            return []
+        now = timezone.now()
+        finished = []
+        seen = 0
+        pending = []
+        for index, user in enumerate(users):
+            for training in self.random.sample(trainings, min(per_user, len(trainings))):
+                pending.append(UserTraining(user=user, training=training, sensor=self.random.choice(sensors), intensity=self.random.randint(90, 180)))
+            if len(pending) >= self.batch_size or index == len(users) - 1:
+                for user_training in UserTraining.objects.bulk_create(pending):
+                    training = user_training.training
+                    if training.datetime + training.duration >= now:
+                        continue
+                    # Reservoir sampling keeps memory flat however many rows are created
+                    seen += 1
+                    session = (user_training.pk, user_training.user_id, user_training.sensor_id, training.datetime, training.duration)
+                    if len(finished) < SESSION_SAMPLE:
+                        finished.append(session)
+                    elif self.random.randrange(seen) < SESSION_SAMPLE:
+                        finished[self.random.randrange(SESSION_SAMPLE)] = session
+                pending = []
+        return finished
+
+    # One reading per second during past trainings: warm-up, a working plateau with
+    # interval peaks and noise, and a cool-down.
+    def create_readings(self, count, sessions):
+        if not sessions:
+            return 0
+        created = 0
+        batch = []
+        while created + len(batch) < count:
+            user_training_id, user_id, sensor_id, start, duration = self.random.choice(sessions)
+            seconds = min(int(duration.total_seconds()), count - created - len(batch))
+            rest = self.random.randint(55, 75)
+            plateau = self.random.randint(120, 175)
+            for second in range(seconds):
+                progress = second / max(seconds - 1, 1)
+                level = min(1.0, progress * 8, (1 - progress) * 10)
+                pulse = rest + (plateau - rest) * level + 10 * math.sin(second / 90) + self.random.gauss(0, 3)
+                batch.append(HeartRateReading(
+                    sensor_id=sensor_id,
+                    user_id=user_id,
+                    user_training_id=user_training_id,
+                    timestamp=start + timedelta(seconds=second),
+                    pulse=max(40, min(220, round(pulse))),
+                ))
+            if len(batch) >= self.batch_size:
+                store_readings(batch)
+                created += len(batch)
+                batch = []
+        store_readings(batch)
+        return created + len(batch)
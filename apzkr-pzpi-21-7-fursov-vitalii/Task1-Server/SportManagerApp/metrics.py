@@ -0,0 +1,92 @@
+import bisect
+import threading
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+# In-process metrics registry. Every worker process keeps its own values,
+# so Prometheus should scrape each process (or run a single one per target).
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    # name -> (type, help, buckets, {labels: value})
+    def _series(self, name, metric_type, help_text, buckets=None):
+        if name not in self.metrics:
+            self.metrics[name] = (metric_type, help_text, buckets, {})
+        return self.metrics[name][3]
+
+    def observe(self, name, help_text, buckets, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self._series(name, 'histogram', help_text, buckets)
+            if key not in series:
+                series[key] = Histogram(buckets)
+            series[key].observe(value)
+
+    def increment(self, name, help_text, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self._series(name, 'counter', help_text)
+            series[key] = series.get(key, 0) + amount
+
+    def set(self, name, help_text, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self._series(name, 'gauge', help_text)[key] = value
+
+    def clear(self):
+        with self.lock:
+            self.metrics.clear()
+
+    # Prometheus text exposition format 0.0.4
+    def render(self):
+        lines = []
+        with self.lock:
+            for name, (metric_type, help_text, buckets, series) in sorted(self.metrics.items()):
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {metric_type}')
+                for key, value in sorted(series.items()):
+                    if metric_type != 'histogram':
+                        lines.append(f'{name}{format_labels(key)} {format_value(value)}')
+                        continue
+                    cumulative = 0
+                    for bound, count in zip([*buckets, '+Inf'], value.counts):
+                        cumulative += count
+                        le = bound if bound == '+Inf' else format_value(bound)
+                        lines.append(f'{name}_bucket{format_labels(key + (("le", le),))} {cumulative}')
+                    lines.append(f'{name}_sum{format_labels(key)} {format_value(value.sum)}')
+                    lines.append(f'{name}_count{format_labels(key)} {value.count}')
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(key):
+    if not key:
+        return ''
+    return '{' + ','.join(f'{label}="{escape_label(value)}"' for label, value in key) + '}'
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(value):
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+registry = Registry()
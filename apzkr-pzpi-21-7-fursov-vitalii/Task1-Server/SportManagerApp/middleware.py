@@ -0,0 +1,92 @@
+import logging
+import re
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+
+from .metrics import LATENCY_BUCKETS, QUERY_COUNT_BUCKETS, registry
+
+logger = logging.getLogger(__name__)
+
+NUMBERS = re.compile(r"\b\d+\b|'[^']*'")
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+# Declares how many SQL queries a view may run per request.
+# Checked by QueryMetricsMiddleware when QUERY_BUDGET_MODE is 'log' or 'strict'.
+def query_budget(max_queries):
+    def decorator(view):
+        view.query_budget = max_queries
+        return view
+    return decorator
+
+
+# Collects the SQL statements run while handling a request
+class QueryRecorder:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            self.statements.append(sql)
+
+
+# Records latency, SQL query count and SQL time per view as Prometheus histograms
+# and enforces the view's query budget.
+class QueryMetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.mode = getattr(settings, 'QUERY_BUDGET_MODE', 'off')
+        if self.mode not in ('off', 'log', 'strict'):
+            raise ImproperlyConfigured("QUERY_BUDGET_MODE must be 'off', 'log' or 'strict'")
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+        duration = time.perf_counter() - started
+
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        registry.observe('django_request_duration_seconds', 'Request latency by view', LATENCY_BUCKETS, duration, view=view, method=request.method)
+        registry.observe('django_request_queries', 'SQL queries per request by view', QUERY_COUNT_BUCKETS, recorder.count, view=view)
+        registry.observe('django_request_query_duration_seconds', 'SQL time per request by view', LATENCY_BUCKETS, recorder.duration, view=view)
+        registry.increment('django_responses_total', 'Responses by view and status', view=view, status=response.status_code)
+
+        budget = self.budget(match)
+        if self.mode != 'off' and budget is not None and recorder.count > budget:
+            self.exceeded(view, budget, recorder)
+        return response
+
+    def budget(self, match):
+        if match is None:
+            return None
+        budgets = getattr(settings, 'QUERY_BUDGETS', {})
+        if match.view_name in budgets:
+            return budgets[match.view_name]
+        return getattr(match.func, 'query_budget', getattr(settings, 'QUERY_BUDGET_DEFAULT', None))
+
+    def exceeded(self, view, budget, recorder):
+        registry.increment('django_query_budget_exceeded_total', 'Requests that ran more SQL queries than their budget', view=view)
+        # Statements that only differ in literals are usually an N+1 loop
+        repeated = Counter(NUMBERS.sub('?', sql) for sql in recorder.statements).most_common(3)
+        message = f'{view} ran {recorder.count} SQL queries, budget is {budget}. Most repeated: ' + '; '.join(
+            f'{count}x {sql[:200]}' for sql, count in repeated
+        )
+        if self.mode == 'strict':
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
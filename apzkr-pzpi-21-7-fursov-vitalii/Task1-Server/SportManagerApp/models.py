@@ -1,4 +1,8 @@
+import math
+
 from django.db import models
+from django.utils import timezone
+from django.contrib.postgres.indexes import BrinIndex
 from django.contrib.auth.models import BaseUserManager, AbstractBaseUser
 
 class CustomUserManager(BaseUserManager):
@@ -63,7 +67,7 @@ class MatchTeam(models.Model):
     team_score = models.PositiveIntegerField()
 
     def __str__(self):
-        return f'Match {self.match.match_id} - Team {self.team.name}'
+        return f'Match {self.match_id} - Team {self.team.name}'
 
 class Competition(models.Model):
     competition_id = models.AutoField(primary_key=True)
@@ -75,9 +79,112 @@ class Competition(models.Model):
     def __str__(self):
         return self.name
 
+# Denormalized copy of a match and its scores, refreshed by signals on every write.
+# Not constrained to Match so the row survives until the delete signal has consumed it.
+class MatchResult(models.Model):
+    match = models.OneToOneField(Match, on_delete=models.DO_NOTHING, db_constraint=False, primary_key=True)
+    competition = models.ForeignKey('Competition', on_delete=models.DO_NOTHING, db_constraint=False)
+    datetime = models.DateTimeField()
+    location = models.CharField(max_length=100)
+    duration = models.DurationField()
+    entries = models.JSONField(default=list)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['competition', 'datetime'], name='match_result_competition_idx'),
+        ]
+
+    def __str__(self):
+        return f'Result of match {self.match_id}'
+
+    def _entry(self, index, key):
+        return self.entries[index][key] if len(self.entries) > index else None
+
+    @property
+    def team1(self):
+        return self._entry(0, 'team_name')
+
+    @property
+    def score1(self):
+        return self._entry(0, 'score')
+
+    @property
+    def team2(self):
+        return self._entry(1, 'team_name')
+
+    @property
+    def score2(self):
+        return self._entry(1, 'score')
+
+# Materialized team statistics, maintained incrementally from MatchResult and User changes.
+# TeamCompetitionRecord doubles as the league table row of a team in a competition.
+class TeamStats(models.Model):
+    team = models.OneToOneField(Team, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    members_count = models.PositiveIntegerField(default=0)
+    age_sum = models.PositiveIntegerField(default=0)
+    matches_count = models.PositiveIntegerField(default=0)
+    wins = models.PositiveIntegerField(default=0)
+    score_sum = models.PositiveBigIntegerField(default=0)
+    competitions_count = models.PositiveIntegerField(default=0)
+    best_competition = models.ForeignKey('Competition', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    best_competition_score = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f'Statistics of team {self.team_id}'
+
+    @property
+    def most_successful_competition(self):
+        return self.best_competition.name if self.best_competition else None
+
+    @property
+    def most_successful_competition_score(self):
+        return self.best_competition_score
+
+    @property
+    def average_age(self):
+        return self.age_sum / self.members_count if self.members_count else None
+
+    @property
+    def win_percentage(self):
+        return self.wins / self.matches_count * 100 if self.matches_count else 0
+
+    @property
+    def average_goals_per_match(self):
+        return self.score_sum / self.matches_count if self.matches_count else None
+
+class TeamCompetitionRecord(models.Model):
+    team = models.ForeignKey(Team, on_delete=models.CASCADE, db_index=False)
+    competition = models.ForeignKey('Competition', on_delete=models.CASCADE)
+    matches = models.PositiveIntegerField(default=0)
+    wins = models.PositiveIntegerField(default=0)
+    draws = models.PositiveIntegerField(default=0)
+    losses = models.PositiveIntegerField(default=0)
+    score_for = models.PositiveBigIntegerField(default=0)
+    score_against = models.PositiveBigIntegerField(default=0)
+    points = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['team', 'competition'], name='team_competition_record_key'),
+        ]
+        indexes = [
+            models.Index(fields=['competition', '-points'], name='standings_competition_idx'),
+        ]
+
+    def __str__(self):
+        return f'Team {self.team_id} in competition {self.competition_id}'
+
+    @property
+    def played(self):
+        return self.wins + self.draws + self.losses
+
+    @property
+    def score_difference(self):
+        return self.score_for - self.score_against
+
 class Training(models.Model):
     training_id = models.AutoField(primary_key=True)
-    datetime = models.DateTimeField()
+    datetime = models.DateTimeField(db_index=True)
     location = models.CharField(max_length=100)
     duration = models.DurationField()
 
@@ -92,11 +199,257 @@ class UserTraining(models.Model):
     intensity = models.PositiveIntegerField(default=1)
 
     def __str__(self):
-        return f'User {self.user.email} - Training {self.training.training_id}'
+        return f'User {self.user.email} - Training {self.training_id}'
 
 class Sensor(models.Model):
     sensor_id = models.AutoField(primary_key=True)
     heart_rate = models.PositiveIntegerField()
 
     def __str__(self):
-        return f'Sensor {self.sensor_id}'
\ No newline at end of file
+        return f'Sensor {self.sensor_id}'
+
+# Raw readings are append-only: rows are never updated, so the table is
+# physically ordered by arrival time and a BRIN index covers time range scans
+class HeartRateReading(models.Model):
+    reading_id = models.BigAutoField(primary_key=True)
+    sensor = models.ForeignKey(Sensor, on_delete=models.CASCADE, db_index=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
+    user_training = models.ForeignKey(UserTraining, on_delete=models.SET_NULL, null=True, blank=True, db_index=False)
+    timestamp = models.DateTimeField()
+    pulse = models.PositiveSmallIntegerField()
+
+    class Meta:
+        indexes = [
+            BrinIndex(fields=['timestamp'], name='reading_timestamp_brin'),
+            models.Index(fields=['user', 'timestamp'], name='reading_user_time_idx'),
+            models.Index(fields=['sensor', 'timestamp'], name='reading_sensor_time_idx'),
+            models.Index(fields=['user_training', 'timestamp'], name='reading_training_time_idx'),
+        ]
+
+    def __str__(self):
+        return f'Sensor {self.sensor_id} - {self.pulse} bpm at {self.timestamp}'
+
+class HeartRateRollup(models.Model):
+    sensor = models.ForeignKey(Sensor, on_delete=models.CASCADE, db_index=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
+    bucket = models.DateTimeField()
+    count = models.PositiveIntegerField()
+    pulse_sum = models.PositiveBigIntegerField()
+    pulse_min = models.PositiveSmallIntegerField()
+    pulse_max = models.PositiveSmallIntegerField()
+
+    class Meta:
+        abstract = True
+
+    @property
+    def average(self):
+        return self.pulse_sum / self.count if self.count else None
+
+class HeartRateSecond(HeartRateRollup):
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'bucket', 'sensor'], name='heart_rate_second_key'),
+        ]
+
+class HeartRateMinute(HeartRateRollup):
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'bucket', 'sensor'], name='heart_rate_minute_key'),
+        ]
+
+class TrainingHeartRate(models.Model):
+    user_training = models.OneToOneField(UserTraining, on_delete=models.CASCADE, primary_key=True)
+    count = models.PositiveIntegerField()
+    pulse_sum = models.PositiveBigIntegerField()
+    pulse_min = models.PositiveSmallIntegerField()
+    pulse_max = models.PositiveSmallIntegerField()
+    first_timestamp = models.DateTimeField()
+    last_timestamp = models.DateTimeField()
+
+    @property
+    def average(self):
+        return self.pulse_sum / self.count if self.count else None
+
+    def __str__(self):
+        return f'User training {self.user_training_id} - {self.count} readings'
+
+# Banister TRIMP of a user training, computed once after the training ended
+# (training_load.py); the date is the local day the training started
+class TrainingLoad(models.Model):
+    user_training = models.OneToOneField(UserTraining, on_delete=models.CASCADE, primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
+    date = models.DateField()
+    trimp = models.FloatField()
+    closed_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'User training {self.user_training_id} - TRIMP {self.trimp:.0f}'
+
+# Training load of a user on a day, with the acute load (sum of the last 7 days)
+# and the chronic load (average week of the last 28 days) as of that day.
+# Maintained incrementally: a closed training adds to its day and the 27 days after it.
+class DailyTrainingLoad(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
+    date = models.DateField()
+    load = models.FloatField(default=0)
+    acute = models.FloatField(default=0)
+    chronic = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'date'], name='daily_training_load_key'),
+        ]
+
+    # Acute:chronic workload ratio
+    @property
+    def ratio(self):
+        return self.acute / self.chronic if self.chronic else None
+
+    def __str__(self):
+        return f'User {self.user_id} on {self.date} - load {self.load:.0f}'
+
+# Running statistics of the pulse in a training session, kept by the anomaly
+# detector (anomalies.py): the EWMA of the pulse as the expected value, and
+# Welford's mean and variance of the pulse's deviation from it. alerted holds
+# the time of the last alert of every kind.
+class HeartRateBaseline(models.Model):
+    user_training = models.OneToOneField(UserTraining, on_delete=models.CASCADE, primary_key=True)
+    count = models.PositiveIntegerField(default=0)
+    mean = models.FloatField(default=0.0)
+    m2 = models.FloatField(default=0.0)
+    ewma = models.FloatField(null=True, blank=True)
+    timestamp = models.DateTimeField(null=True, blank=True)
+    alerted = models.JSONField(default=dict)
+
+    @property
+    def deviation(self):
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+    def __str__(self):
+        return f'User training {self.user_training_id} - expected {self.ewma} bpm'
+
+# Written by the anomaly detector on the ingestion path (anomalies.py)
+class HeartRateAlert(models.Model):
+    KIND_CHOICES = [
+        ('zone', 'Above the zone limit'),
+        ('spike', 'Sudden spike'),
+        ('dropout', 'Dropout'),
+    ]
+
+    alert_id = models.BigAutoField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
+    sensor = models.ForeignKey(Sensor, on_delete=models.CASCADE, db_index=False)
+    user_training = models.ForeignKey(UserTraining, on_delete=models.SET_NULL, null=True, blank=True)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    timestamp = models.DateTimeField()
+    pulse = models.PositiveSmallIntegerField()
+    expected = models.FloatField(null=True, blank=True)
+    detail = models.CharField(max_length=200)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'timestamp'], name='alert_user_time_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.get_kind_display()} of user {self.user_id} at {self.timestamp}'
+
+class DatabaseBackup(models.Model):
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    ]
+
+    backup_id = models.AutoField(primary_key=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    format = models.CharField(max_length=20)
+    jobs = models.PositiveSmallIntegerField(default=1)
+    compression = models.PositiveSmallIntegerField(default=0)
+    path = models.CharField(max_length=500, blank=True)
+    snapshot = models.CharField(max_length=200, blank=True)
+    tables_total = models.PositiveIntegerField(default=0)
+    tables_done = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    requested_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f'Backup {self.backup_id} ({self.status})'
+
+    @property
+    def progress(self):
+        if self.status == 'succeeded':
+            return 100
+        return int(self.tables_done * 100 / self.tables_total) if self.tables_total else 0
+
+
+# Background job run by the runworker command
+class Job(models.Model):
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    ]
+
+    job_id = models.BigAutoField(primary_key=True)
+    task = models.CharField(max_length=100)
+    # Jobs enqueued with the same key share one queued job (see jobs.enqueue)
+    dedupe_key = models.CharField(max_length=100, blank=True)
+    arguments = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    requested_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after']),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['dedupe_key'],
+                condition=models.Q(status='queued') & ~models.Q(dedupe_key=''),
+                name='job_queued_dedupe_key',
+            ),
+        ]
+
+    def __str__(self):
+        return f'Job {self.job_id} {self.task} ({self.status})'
+
+
+# Write counter of a model, bumped after every commit that changes its rows.
+# Views build their ETag from the counters of the models they read.
+class ModelVersion(models.Model):
+    name = models.CharField(max_length=100, primary_key=True)
+    version = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f'{self.name} v{self.version}'
+
+
+# Bearer token revoked before it expired. A row without token_id revokes every
+# token of the subject (e.g. 'device:5') issued up to issued_before.
+class RevokedToken(models.Model):
+    revoked_id = models.BigAutoField(primary_key=True)
+    token_id = models.CharField(max_length=32, blank=True)
+    subject = models.CharField(max_length=50)
+    issued_before = models.DateTimeField()
+    expires_at = models.DateTimeField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'Revoked {self.token_id or "all tokens"} of {self.subject}'
@@ -0,0 +1,57 @@
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+
+COMPETITION_LIST = 'competition_list'
+COMPETITION_DETAIL = 'competition_detail'
+
+
+def page_cache():
+    return caches[getattr(settings, 'PAGE_CACHE_ALIAS', 'default')]
+
+
+def page_cache_key(page, pk=None, variant='html'):
+    return f'page:{page}:{variant}' if pk is None else f'page:{page}:{pk}:{variant}'
+
+
+# Caches a view's rendered response under page_cache_key(page, kwargs['pk'], variant).
+# HTML pages depend on the navigation of the logged in user, so only anonymous
+# responses are cached for them; JSON variants are the same for everyone.
+def cached_page(page, variant='html'):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method != 'GET' or (variant == 'html' and request.user.is_authenticated):
+                return view(request, *args, **kwargs)
+
+            cache = page_cache()
+            key = page_cache_key(page, kwargs.get('pk'), variant)
+            cached = cache.get(key)
+            if cached is not None:
+                content, content_type = cached
+                response = HttpResponse(content, content_type=content_type)
+                response['X-Page-Cache'] = 'hit'
+                return response
+
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200 and not response.streaming:
+                cache.set(key, (response.content, response['Content-Type']), getattr(settings, 'PAGE_CACHE_TIMEOUT', 24 * 60 * 60))
+                response['X-Page-Cache'] = 'miss'
+            return response
+        return wrapper
+    return decorator
+
+
+# Evicts cached pages once the surrounding transaction commits, so a request
+# running in between cannot put the old version back into the cache.
+def invalidate_pages(competition_ids=(), competition_list=False):
+    keys = []
+    for competition_id in set(competition_ids) - {None}:
+        keys += [page_cache_key(COMPETITION_DETAIL, competition_id, variant) for variant in ('html', 'json')]
+    if competition_list:
+        keys += [page_cache_key(COMPETITION_LIST, variant=variant) for variant in ('html', 'json')]
+    if keys:
+        transaction.on_commit(lambda: page_cache().delete_many(keys))
@@ -0,0 +1,84 @@
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+
+class KeysetPage:
+    def __init__(self, request, items, key, has_next, has_previous):
+        self.items = items
+        self.has_next = has_next and bool(items)
+        self.has_previous = has_previous and bool(items)
+        self.next_query = self._query(request, after=getattr(items[-1], key)) if self.has_next else ''
+        self.previous_query = self._query(request, before=getattr(items[0], key)) if self.has_previous else ''
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    @staticmethod
+    def _query(request, **cursor):
+        params = request.GET.copy()
+        params.pop('after', None)
+        params.pop('before', None)
+        params.update(cursor)
+        return params.urlencode()
+
+
+def _cursor(request, name):
+    try:
+        return int(request.GET[name])
+    except (KeyError, ValueError):
+        return None
+
+
+def page_size(request):
+    default = getattr(settings, 'LIST_PAGE_SIZE', 50)
+    maximum = getattr(settings, 'LIST_MAX_PAGE_SIZE', 500)
+    try:
+        size = int(request.GET.get('page_size', default))
+    except ValueError:
+        size = default
+    return max(1, min(size, maximum))
+
+
+# Keyset (cursor) pagination on a unique integer key, usually the primary key.
+# ?after=<key> moves forward and ?before=<key> moves back; every page is a
+# single "WHERE key > cursor ORDER BY key LIMIT n" query however deep it is.
+def keyset_paginate(request, queryset, key):
+    size = page_size(request)
+    after = _cursor(request, 'after')
+    before = _cursor(request, 'before')
+
+    if before is not None:
+        items = list(queryset.filter(**{f'{key}__lt': before}).order_by(f'-{key}')[:size + 1])
+        has_previous = len(items) > size
+        items = items[:size]
+        items.reverse()
+        return KeysetPage(request, items, key, has_next=True, has_previous=has_previous)
+
+    if after is not None:
+        queryset = queryset.filter(**{f'{key}__gt': after})
+    items = list(queryset.order_by(key)[:size + 1])
+    has_next = len(items) > size
+    return KeysetPage(request, items[:size], key, has_next=has_next, has_previous=after is not None)
+
+
+# Optional team, training, competition and date_from/date_to (YYYY-MM-DD, inclusive) filters
+# taken from a QueryDict or dict. fields maps a filter name to the lookup it applies to.
+def list_filters(params, **fields):
+    filters = {}
+    for name in ('team', 'training', 'competition'):
+        if name in fields and str(params.get(name) or '').isdigit():
+            filters[fields[name]] = int(params[name])
+
+    if 'date' in fields:
+        for name, lookup, shift in (('date_from', 'gte', 0), ('date_to', 'lt', 1)):
+            try:
+                day = datetime.strptime(params.get(name) or '', '%Y-%m-%d')
+            except ValueError:
+                continue
+            filters[f"{fields['date']}__{lookup}"] = timezone.make_aware(day + timedelta(days=shift))
+    return filters
@@ -0,0 +1,152 @@
+import array
+import atexit
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import InterfaceError, OperationalError, close_old_connections, connection
+
+from .ingestion import store_readings
+from .metrics import LATENCY_BUCKETS, registry
+from .models import HeartRateReading
+
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+FLUSH_SIZE_BUCKETS = (1, 10, 100, 500, 1000, 5000, 10000, 50000, 100000)
+
+
+def buffering_enabled():
+    return getattr(settings, 'READING_BUFFER_ENABLED', True)
+
+
+# Write-behind buffer for the heart-rate readings of one worker process.
+# Readings are kept as four array columns (about 26 bytes each instead of a
+# model instance) and written by a background thread through store_readings,
+# i.e. one transaction and one COPY per flush, every READING_BUFFER_FLUSH_INTERVAL
+# seconds or as soon as READING_BUFFER_FLUSH_SIZE readings are waiting.
+# add() refuses readings above READING_BUFFER_CAPACITY so callers can answer 503,
+# and whatever is left is written when the process exits.
+class ReadingBuffer:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.columns = self.empty()
+        self.thread = None
+        self.pid = None
+        self.stopping = False
+        self.registered = False
+
+    # sensor id, user id (0 when the session resolves it), timestamp in
+    # microseconds since the epoch, pulse
+    @staticmethod
+    def empty():
+        return array.array('q'), array.array('q'), array.array('q'), array.array('H')
+
+    def __len__(self):
+        return len(self.columns[3])
+
+    def add(self, readings):
+        self.start()
+        with self.lock:
+            if len(self) + len(readings) > getattr(settings, 'READING_BUFFER_CAPACITY', 200000):
+                registry.increment('reading_buffer_refused_total', 'Readings refused because the buffer was full', len(readings))
+                return False
+            sensors, users, timestamps, pulses = self.columns
+            for reading in readings:
+                sensors.append(reading.sensor_id)
+                users.append(reading.user_id or 0)
+                timestamps.append((reading.timestamp - EPOCH) // MICROSECOND)
+                pulses.append(reading.pulse)
+            size = len(self)
+        registry.set('reading_buffer_size', 'Readings waiting in the write-behind buffer', size)
+        if size >= getattr(settings, 'READING_BUFFER_FLUSH_SIZE', 10000):
+            self.wakeup.set()
+        return True
+
+    def take(self):
+        with self.lock:
+            columns, self.columns = self.columns, self.empty()
+        registry.set('reading_buffer_size', 'Readings waiting in the write-behind buffer', 0)
+        return columns
+
+    # Puts a batch back after a connection failure, if there is still room for it
+    def restore(self, columns):
+        with self.lock:
+            if len(self) + len(columns[3]) > getattr(settings, 'READING_BUFFER_CAPACITY', 200000):
+                return False
+            for column, values in zip(self.columns, columns):
+                column.extend(values)
+        return True
+
+    def flush(self):
+        with self.flush_lock:
+            columns = self.take()
+            if not columns[3]:
+                return 0
+            readings = [
+                HeartRateReading(sensor_id=sensor_id, user_id=user_id or None, timestamp=EPOCH + timestamp * MICROSECOND, pulse=pulse)
+                for sensor_id, user_id, timestamp, pulse in zip(*columns)
+            ]
+            started = time.perf_counter()
+            close_old_connections()
+            try:
+                accepted, rejected = store_readings(readings)
+            except (OperationalError, InterfaceError):
+                logger.exception('Flushing %d readings failed, will retry', len(readings))
+                if not self.restore(columns):
+                    registry.increment('reading_buffer_lost_total', 'Readings lost because their flush failed', len(readings))
+                return 0
+            except Exception:
+                logger.exception('Flushing %d readings failed, dropping them', len(readings))
+                registry.increment('reading_buffer_lost_total', 'Readings lost because their flush failed', len(readings))
+                return 0
+
+            registry.observe('reading_buffer_flush_seconds', 'Time to write one buffer flush', LATENCY_BUCKETS, time.perf_counter() - started)
+            registry.observe('reading_buffer_flush_readings', 'Readings per buffer flush', FLUSH_SIZE_BUCKETS, len(readings))
+            if rejected:
+                registry.increment('reading_buffer_rejected_total', 'Buffered readings of unknown sensors or users', len(rejected))
+            return len(accepted)
+
+    def run(self):
+        while not self.stopping:
+            self.wakeup.wait(getattr(settings, 'READING_BUFFER_FLUSH_INTERVAL', 1.0))
+            self.wakeup.clear()
+            self.flush()
+        connection.close()
+
+    # Starts the flush thread in this process. A child forked from a process
+    # that already buffered readings drops its copy: the parent writes them.
+    def start(self):
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            if self.pid is not None:
+                self.columns = self.empty()
+            self.pid = os.getpid()
+            self.stopping = False
+            self.thread = threading.Thread(target=self.run, name='reading-buffer', daemon=True)
+            self.thread.start()
+            if not self.registered:
+                atexit.register(self.close)
+                self.registered = True
+
+    # Stops the flush thread and writes what is left
+    def close(self):
+        if self.pid != os.getpid():
+            return
+        self.stopping = True
+        self.wakeup.set()
+        self.thread.join(timeout=30)
+        self.pid = None
+        self.flush()
+
+
+reading_buffer = ReadingBuffer()
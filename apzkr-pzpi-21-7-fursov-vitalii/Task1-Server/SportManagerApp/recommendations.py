@@ -0,0 +1,115 @@
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from .models import UserTraining
+
+RECENT_TRAININGS = 10
+ZONES = ['rest', 'moderate', 'high', 'maximum']
+
+
+def recommendation_cache_key(user_id):
+    return f'recommendation:{user_id}'
+
+
+def recommendation_text(total, moderate, high):
+    if total == 0:
+        return "No recent training data available."
+    if moderate / total > 0.5:
+        return "You are doing a good amount of moderate intensity training. Keep it up!"
+    if high / total > 0.5:
+        return "You are doing a lot of high intensity training. Consider incorporating more moderate intensity sessions."
+    return "Your training intensity is well balanced. Continue with your current routine."
+
+
+# Zone of one pulse, with the bands of build_recommendations
+def heart_rate_zone(pulse, age):
+    mhr = 220 - age
+    if 0.5 * mhr <= pulse <= 0.7 * mhr:
+        return 'moderate'
+    if 0.7 * mhr < pulse <= 0.85 * mhr:
+        return 'high'
+    if pulse > 0.85 * mhr:
+        return 'maximum'
+    return 'rest'
+
+
+# Last RECENT_TRAININGS trainings of every user in one query, newest first:
+# (user_id, age, intensity, reading count, reading pulse sum)
+def recent_trainings(user_ids):
+    return (
+        UserTraining.objects.filter(user_id__in=user_ids)
+        .annotate(row=Window(RowNumber(), partition_by=[F('user_id')], order_by=[F('training__datetime').desc(), F('pk').desc()]))
+        .filter(row__lte=RECENT_TRAININGS)
+        .values_list('user_id', 'user__age', 'intensity', 'trainingheartrate__count', 'trainingheartrate__pulse_sum')
+    )
+
+
+# Heart rate zone distribution of the recent trainings of many users at once.
+# A training's intensity is its average pulse from the stored readings, or the
+# intensity reported by the sensor when it has no readings; zones are the
+# 50-70% (moderate) and 70-85% (high) bands of the maximum heart rate 220 - age.
+def build_recommendations(user_ids):
+    user_ids = list(user_ids)
+    results = {
+        user_id: {'user_id': user_id, 'trainings': 0, 'zones': dict.fromkeys(ZONES, 0), 'recommendation': recommendation_text(0, 0, 0)}
+        for user_id in user_ids
+    }
+    rows = list(recent_trainings(user_ids))
+    if not rows:
+        return results
+
+    users, ages, intensities, counts, sums = (np.array(column, dtype=float) for column in zip(*[
+        (user_id, age, intensity, count or 0, pulse_sum or 0) for user_id, age, intensity, count, pulse_sum in rows
+    ]))
+    pulse = np.where(counts > 0, sums / np.maximum(counts, 1), intensities)
+    mhr = 220 - ages
+    moderate = (pulse >= 0.5 * mhr) & (pulse <= 0.7 * mhr)
+    high = ~moderate & (pulse >= 0.7 * mhr) & (pulse <= 0.85 * mhr)
+    maximum = pulse > 0.85 * mhr
+    rest = ~(moderate | high | maximum)
+
+    user_index, positions = np.unique(users, return_inverse=True)
+    zone_counts = [np.bincount(positions, weights=zone, minlength=len(user_index)) for zone in (rest, moderate, high, maximum)]
+    totals = np.bincount(positions, minlength=len(user_index))
+
+    for position, user_id in enumerate(user_index.astype(int).tolist()):
+        zones = {zone: int(column[position]) for zone, column in zip(ZONES, zone_counts)}
+        total = int(totals[position])
+        results[user_id] = {
+            'user_id': user_id,
+            'trainings': total,
+            'zones': zones,
+            'recommendation': recommendation_text(total, zones['moderate'], zones['high']),
+        }
+    return results
+
+
+# Recommendations of many users; cached per user until their training data changes
+def get_recommendations(user_ids):
+    keys = {recommendation_cache_key(user_id): user_id for user_id in user_ids}
+    cached = cache.get_many(list(keys))
+    results = {keys[key]: value for key, value in cached.items()}
+    missing = [user_id for user_id in user_ids if user_id not in results]
+    if missing:
+        built = build_recommendations(missing)
+        cache.set_many(
+            {recommendation_cache_key(user_id): value for user_id, value in built.items()},
+            getattr(settings, 'RECOMMENDATION_CACHE_TIMEOUT', 24 * 60 * 60),
+        )
+        results.update(built)
+    return results
+
+
+def get_recommendation(user_id):
+    return get_recommendations([user_id])[user_id]
+
+
+# Deleted after commit: deleting earlier lets a concurrent request cache the old data again
+def invalidate_recommendations(user_ids):
+    keys = [recommendation_cache_key(user_id) for user_id in set(user_ids)]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
@@ -0,0 +1,75 @@
+from django.db import transaction
+
+from .models import Match, MatchResult, MatchTeam
+from .team_stats import apply_match_deltas
+
+
+# Recomputes the denormalized MatchResult rows of the given matches and applies
+# the difference to the team statistics. Reading and writing the results costs a
+# constant number of queries however many matches are passed; results of
+# matches that no longer exist are removed. The matches and their results are
+# locked in key order first, so concurrent writes to one match apply their
+# differences one after the other, each against the result the previous left.
+def refresh_match_results(match_ids):
+    match_ids = sorted(set(match_ids))
+    if not match_ids:
+        return
+
+    with transaction.atomic():
+        matches = {match.pk: match for match in Match.objects.select_for_update().filter(pk__in=match_ids).order_by('pk')}
+        existing = {result.pk: result for result in MatchResult.objects.select_for_update().filter(pk__in=match_ids).order_by('pk')}
+        entries = {match_id: [] for match_id in matches}
+        match_teams = (
+            MatchTeam.objects.filter(match_id__in=matches.keys())
+            .order_by('match_team_id')
+            .values_list('match_id', 'team_id', 'team__name', 'team_score')
+        )
+        for match_id, team_id, team_name, score in match_teams:
+            entries[match_id].append({'team_id': team_id, 'team_name': team_name, 'score': score})
+
+        new_results = {}
+        to_create = []
+        to_update = []
+        for match_id, match in matches.items():
+            result = MatchResult(
+                match_id=match_id,
+                competition_id=match.competition_id,
+                datetime=match.datetime,
+                location=match.location,
+                duration=match.duration,
+                entries=entries[match_id],
+            )
+            new_results[match_id] = result
+            if match_id in existing:
+                to_update.append(result)
+            else:
+                to_create.append(result)
+
+        MatchResult.objects.bulk_create(to_create)
+        MatchResult.objects.bulk_update(to_update, ['competition', 'datetime', 'location', 'duration', 'entries'])
+        removed = [match_id for match_id in existing if match_id not in matches]
+        if removed:
+            MatchResult.objects.filter(pk__in=removed).delete()
+
+        apply_match_deltas(existing, new_results)
+
+
+def refresh_team_results(team_id):
+    refresh_match_results(MatchTeam.objects.filter(team_id=team_id).values_list('match_id', flat=True))
+
+
+# Match results of a competition shaped for competition_detail.html
+def competition_match_results(competition_id):
+    results = MatchResult.objects.filter(competition_id=competition_id).order_by('datetime', 'match_id')
+    return [
+        {
+            'team1': result.team1,
+            'score1': result.score1,
+            'team2': result.team2,
+            'score2': result.score2,
+            'duration': result.duration,
+            'location': result.location,
+        }
+        for result in results
+        if len(result.entries) == 2
+    ]
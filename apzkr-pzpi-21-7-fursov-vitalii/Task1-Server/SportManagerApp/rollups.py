@@ -0,0 +1,142 @@
+from datetime import datetime
+
+from django.db import connection
+from django.db.models import DateTimeField, ExpressionWrapper, F
+
+from .active_sessions import session_resolver
+from .models import HeartRateMinute, HeartRateSecond, TrainingHeartRate, UserTraining
+
+UPSERT_CHUNK = 1000
+
+
+def second_bucket(timestamp):
+    return timestamp.replace(microsecond=0)
+
+
+def minute_bucket(timestamp):
+    return timestamp.replace(second=0, microsecond=0)
+
+
+# Links readings to the UserTraining whose training window contains them.
+# Readings around now are resolved from the in-memory active sessions; older
+# ones with one query per batch: every training of their users that overlaps
+# their time range.
+def attach_user_trainings(readings):
+    pending = [reading for reading in readings if reading.user_training_id is None]
+    if not pending:
+        return
+
+    session_resolver.refresh()
+    older = []
+    for reading in pending:
+        if session_resolver.covers(reading.timestamp):
+            reading.user_training_id = session_resolver.user_session(reading.user_id, reading.timestamp)
+        else:
+            older.append(reading)
+    pending = older
+    if not pending:
+        return
+
+    first = min(reading.timestamp for reading in pending)
+    last = max(reading.timestamp for reading in pending)
+    windows = {}
+    rows = (
+        UserTraining.objects.filter(user_id__in={reading.user_id for reading in pending}, training__datetime__lte=last)
+        .annotate(end=ExpressionWrapper(F('training__datetime') + F('training__duration'), output_field=DateTimeField()))
+        .filter(end__gte=first)
+        .values_list('user_training_id', 'user_id', 'training__datetime', 'end')
+    )
+    for user_training_id, user_id, start, end in rows:
+        windows.setdefault(user_id, []).append((start, end, user_training_id))
+
+    for reading in pending:
+        for start, end, user_training_id in windows.get(reading.user_id, ()):
+            if start <= reading.timestamp <= end:
+                reading.user_training_id = user_training_id
+                break
+
+
+def _merge(buckets, key, pulse):
+    entry = buckets.get(key)
+    if entry is None:
+        entry = buckets[key] = [0, 0, pulse, pulse]
+    entry[0] += 1
+    entry[1] += pulse
+    entry[2] = min(entry[2], pulse)
+    entry[3] = max(entry[3], pulse)
+    return entry
+
+
+def _adapt(value):
+    if isinstance(value, datetime):
+        return connection.ops.adapt_datetimefield_value(value)
+    return value
+
+
+# INSERT ... ON CONFLICT DO UPDATE that adds the batch aggregates to the stored ones.
+# Rows are sorted by key so concurrent flushes lock them in the same order.
+def _upsert(model, key_columns, rows, min_columns=(), max_columns=()):
+    if not rows:
+        return
+
+    table = connection.ops.quote_name(model._meta.db_table)
+    value_columns = ['count', 'pulse_sum', 'pulse_min', 'pulse_max', *min_columns, *max_columns]
+    columns = [*key_columns, *value_columns]
+    least, greatest = ('LEAST', 'GREATEST') if connection.vendor == 'postgresql' else ('MIN', 'MAX')
+
+    updates = [
+        f'count = {table}.count + EXCLUDED.count',
+        f'pulse_sum = {table}.pulse_sum + EXCLUDED.pulse_sum',
+    ]
+    updates += [f'{column} = {least}({table}.{column}, EXCLUDED.{column})' for column in ['pulse_min', *min_columns]]
+    updates += [f'{column} = {greatest}({table}.{column}, EXCLUDED.{column})' for column in ['pulse_max', *max_columns]]
+
+    rows = sorted(rows)
+    placeholders = '(' + ', '.join(['%s'] * len(columns)) + ')'
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), UPSERT_CHUNK):
+            chunk = rows[start:start + UPSERT_CHUNK]
+            cursor.execute(
+                f'INSERT INTO {table} ({", ".join(columns)}) VALUES {", ".join([placeholders] * len(chunk))} '
+                f'ON CONFLICT ({", ".join(key_columns)}) DO UPDATE SET {", ".join(updates)}',
+                [_adapt(value) for row in chunk for value in row],
+            )
+
+
+# Folds a batch of stored readings into the 1-second, 1-minute and per-training rollups.
+# Must run inside the transaction that inserted the readings.
+def apply_rollups(readings):
+    seconds = {}
+    minutes = {}
+    trainings = {}
+    for reading in readings:
+        _merge(seconds, (reading.user_id, second_bucket(reading.timestamp), reading.sensor_id), reading.pulse)
+        _merge(minutes, (reading.user_id, minute_bucket(reading.timestamp), reading.sensor_id), reading.pulse)
+        if reading.user_training_id is not None:
+            entry = _merge(trainings, reading.user_training_id, reading.pulse)
+            if len(entry) == 4:
+                entry += [reading.timestamp, reading.timestamp]
+            else:
+                entry[4] = min(entry[4], reading.timestamp)
+                entry[5] = max(entry[5], reading.timestamp)
+
+    bucket_columns = ['user_id', 'bucket', 'sensor_id']
+    _upsert(HeartRateSecond, bucket_columns, [(*key, *values) for key, values in seconds.items()])
+    _upsert(HeartRateMinute, bucket_columns, [(*key, *values) for key, values in minutes.items()])
+    _upsert(
+        TrainingHeartRate,
+        ['user_training_id'],
+        [(key, *values) for key, values in trainings.items()],
+        min_columns=['first_timestamp'],
+        max_columns=['last_timestamp'],
+    )
+
+
+# Heart rate series of a user from the rollups, oldest bucket first
+def heart_rate_series(user_id, start, end, resolution='minute'):
+    model = HeartRateSecond if resolution == 'second' else HeartRateMinute
+    return (
+        model.objects.filter(user_id=user_id, bucket__gte=start, bucket__lt=end)
+        .order_by('bucket')
+        .values_list('bucket', 'count', 'pulse_sum', 'pulse_min', 'pulse_max')
+    )
@@ -0,0 +1,175 @@
+from django.db.models.signals import post_delete, post_init, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .active_sessions import invalidate_sessions
+from .jobs import enqueue
+from .models import Competition, Match, MatchTeam, Sensor, Team, TeamCompetitionRecord, Training, User, UserTraining
+from .page_cache import invalidate_pages
+from .recommendations import invalidate_recommendations
+from .results import refresh_match_results, refresh_team_results
+from .standings import invalidate_team_standings
+from .team_stats import apply_member_change, ensure_team_stats
+from .tokens import revoke_subject
+from .training_load import reopen_training_loads
+from .training_calendar import invalidate_month
+from .versions import TRACKED_MODELS, bump_versions
+
+# Fields whose values as loaded (or as last saved) the handlers below compare
+# with the current ones to find out what a save changed
+ORIGINAL_FIELDS = {
+    Training: ['datetime', 'duration'],
+    Match: ['competition_id'],
+    MatchTeam: ['match_id'],
+    Team: ['name'],
+    User: ['team_id', 'age'],
+    UserTraining: ['sensor_id', 'user_id', 'training_id', 'intensity'],
+}
+
+# One snapshot per instance, taken when it is loaded and taken again once
+# every post_save handler has seen it (connected at the end of this module)
+def remember_original_values(sender, instance, **kwargs):
+    instance._original = {field: instance.__dict__.get(field) for field in ORIGINAL_FIELDS[sender]}
+
+def changed(instance, *fields):
+    return any(instance._original[field] != getattr(instance, field) for field in fields)
+
+for model in ORIGINAL_FIELDS:
+    post_init.connect(remember_original_values, sender=model, dispatch_uid=f'remember_original_{model._meta.model_name}')
+
+# Training calendar cache
+@receiver(post_save, sender=Training)
+def invalidate_training_calendar(sender, instance, **kwargs):
+    invalidate_month(instance._original['datetime'])
+    invalidate_month(instance.datetime)
+
+@receiver(post_delete, sender=Training)
+def invalidate_deleted_training_calendar(sender, instance, **kwargs):
+    invalidate_month(instance.datetime)
+
+# Denormalized match results
+@receiver(post_save, sender=MatchTeam)
+@receiver(post_delete, sender=MatchTeam)
+def refresh_match_team_result(sender, instance, **kwargs):
+    refresh_match_results({instance._original['match_id'], instance.match_id} - {None})
+
+@receiver(post_save, sender=Match)
+@receiver(post_delete, sender=Match)
+def refresh_match_result(sender, instance, **kwargs):
+    refresh_match_results([instance.pk])
+
+@receiver(post_save, sender=Team)
+def refresh_team_name_in_results(sender, instance, created, **kwargs):
+    if created:
+        ensure_team_stats([instance.pk])
+    elif changed(instance, 'name'):
+        refresh_team_results(instance.pk)
+        invalidate_team_standings(instance.pk)
+
+# Team statistics: members and their ages
+@receiver(post_save, sender=User)
+def update_team_members(sender, instance, created, **kwargs):
+    previous = None if created else (instance._original['team_id'], instance._original['age'])
+    apply_member_change(previous, (instance.team_id, instance.age))
+
+@receiver(post_delete, sender=User)
+def remove_team_member(sender, instance, **kwargs):
+    apply_member_change((instance._original['team_id'], instance._original['age']), None)
+
+# Training recommendations: recent trainings of a user and their age
+@receiver(post_save, sender=UserTraining)
+@receiver(post_delete, sender=UserTraining)
+def invalidate_user_training_recommendations(sender, instance, **kwargs):
+    invalidate_recommendations({instance._original['user_id'], instance.user_id} - {None})
+
+@receiver(post_save, sender=Training)
+def invalidate_training_recommendations(sender, instance, created, **kwargs):
+    if not created and changed(instance, 'datetime'):
+        invalidate_recommendations(UserTraining.objects.filter(training=instance).values_list('user_id', flat=True))
+
+@receiver(post_save, sender=User)
+def invalidate_user_recommendation(sender, instance, created, **kwargs):
+    if not created and changed(instance, 'age'):
+        invalidate_recommendations([instance.pk])
+
+# Cached competition pages
+@receiver(post_save, sender=Competition)
+@receiver(post_delete, sender=Competition)
+def invalidate_competition_pages(sender, instance, **kwargs):
+    invalidate_pages([instance.pk], competition_list=True)
+
+@receiver(post_save, sender=Match)
+@receiver(post_delete, sender=Match)
+def invalidate_match_pages(sender, instance, **kwargs):
+    invalidate_pages({instance._original['competition_id'], instance.competition_id})
+
+@receiver(post_save, sender=MatchTeam)
+@receiver(post_delete, sender=MatchTeam)
+def invalidate_match_team_pages(sender, instance, **kwargs):
+    match_ids = {instance._original['match_id'], instance.match_id} - {None}
+    invalidate_pages(Match.objects.filter(pk__in=match_ids).values_list('competition_id', flat=True))
+
+@receiver(post_save, sender=Team)
+def invalidate_team_pages(sender, instance, created, **kwargs):
+    if not created and changed(instance, 'name'):
+        invalidate_pages(TeamCompetitionRecord.objects.filter(team_id=instance.pk).values_list('competition_id', flat=True))
+
+# Model versions for conditional GET
+def bump_model_version(sender, instance, **kwargs):
+    bump_versions([sender])
+
+for model in TRACKED_MODELS:
+    post_save.connect(bump_model_version, sender=model, dispatch_uid=f'bump_{model._meta.model_name}_version_on_save')
+    post_delete.connect(bump_model_version, sender=model, dispatch_uid=f'bump_{model._meta.model_name}_version_on_delete')
+
+# Tokens of deleted users and sensors
+@receiver(post_delete, sender=User)
+def revoke_user_tokens(sender, instance, **kwargs):
+    revoke_subject('user', instance.pk)
+
+@receiver(post_delete, sender=Sensor)
+def revoke_sensor_tokens(sender, instance, **kwargs):
+    revoke_subject('device', instance.pk)
+
+# Active training sessions resolving sensors to user trainings
+@receiver(post_save, sender=UserTraining)
+def invalidate_user_training_session(sender, instance, created, **kwargs):
+    if created or changed(instance, 'sensor_id', 'user_id', 'training_id'):
+        invalidate_sessions()
+
+@receiver(post_delete, sender=UserTraining)
+def invalidate_deleted_user_training_session(sender, instance, **kwargs):
+    invalidate_sessions()
+
+@receiver(post_save, sender=Training)
+def invalidate_training_sessions(sender, instance, created, **kwargs):
+    if not created and changed(instance, 'datetime', 'duration'):
+        invalidate_sessions()
+
+@receiver(post_delete, sender=Training)
+def invalidate_deleted_training_sessions(sender, instance, **kwargs):
+    invalidate_sessions()
+
+# Training load, computed by the close_trainings task once a training has ended.
+# A closed load whose training, user or pulse changes is taken back out of the
+# daily loads and computed again.
+@receiver(post_save, sender=Training)
+def schedule_training_close(sender, instance, created, **kwargs):
+    if created or changed(instance, 'datetime', 'duration'):
+        if not created:
+            reopen_training_loads(UserTraining.objects.filter(training=instance).values_list('pk', flat=True))
+        enqueue('close_trainings', run_after=instance.datetime + instance.duration, dedupe_key=f'close_trainings:{instance.pk}')
+
+@receiver(post_save, sender=UserTraining)
+def schedule_late_user_training_close(sender, instance, created, **kwargs):
+    reopened = not created and changed(instance, 'user_id', 'training_id', 'intensity') and reopen_training_loads([instance.pk])
+    if (created or reopened) and instance.training.datetime + instance.training.duration <= timezone.now():
+        enqueue('close_trainings', dedupe_key='close_trainings')
+
+@receiver(pre_delete, sender=UserTraining)
+def remove_deleted_training_load(sender, instance, **kwargs):
+    reopen_training_loads([instance.pk])
+
+# Connected last, so it runs after every handler above has compared the values
+for model in ORIGINAL_FIELDS:
+    post_save.connect(remember_original_values, sender=model, dispatch_uid=f'reset_original_{model._meta.model_name}')
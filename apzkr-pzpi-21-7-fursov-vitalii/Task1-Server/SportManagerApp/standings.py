@@ -0,0 +1,61 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+
+from .models import TeamCompetitionRecord
+
+
+def standings_cache_key(competition_id):
+    return f'standings:{competition_id}'
+
+
+# League table of a competition: points, then score difference, then scored points.
+# Teams level on all three share a rank.
+def build_standings(competition_id):
+    records = (
+        TeamCompetitionRecord.objects.filter(competition_id=competition_id)
+        .annotate(difference=F('score_for') - F('score_against'))
+        .order_by('-points', '-difference', '-score_for', 'team__name')
+        .values_list('team_id', 'team__name', 'wins', 'draws', 'losses', 'score_for', 'score_against', 'points')
+    )
+    table = []
+    previous_key = None
+    for position, (team_id, team_name, wins, draws, losses, score_for, score_against, points) in enumerate(records, start=1):
+        key = (points, score_for - score_against, score_for)
+        rank = table[-1]['rank'] if key == previous_key else position
+        previous_key = key
+        table.append({
+            'rank': rank,
+            'team_id': team_id,
+            'team': team_name,
+            'played': wins + draws + losses,
+            'wins': wins,
+            'draws': draws,
+            'losses': losses,
+            'score_for': score_for,
+            'score_against': score_against,
+            'score_difference': score_for - score_against,
+            'points': points,
+        })
+    return table
+
+
+def get_standings(competition_id):
+    key = standings_cache_key(competition_id)
+    table = cache.get(key)
+    if table is None:
+        table = build_standings(competition_id)
+        cache.set(key, table, getattr(settings, 'STANDINGS_CACHE_TIMEOUT', 60 * 60))
+    return table
+
+
+# Deleted after commit: deleting earlier lets a concurrent request cache the old table again
+def invalidate_standings(competition_ids):
+    keys = [standings_cache_key(competition_id) for competition_id in competition_ids]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def invalidate_team_standings(team_id):
+    invalidate_standings(TeamCompetitionRecord.objects.filter(team_id=team_id).values_list('competition_id', flat=True))
@@ -0,0 +1,50 @@
+import os
+import uuid
+from io import StringIO
+
+from django.conf import settings
+from django.core.management import call_command
+from django.utils import timezone
+
+from .backups import run_backup
+from .exports import export_stream
+from .jobs import task
+from .models import DatabaseBackup
+from .training_load import close_trainings as close_ended_trainings
+
+
+def export_dir():
+    return str(getattr(settings, 'EXPORT_DIR', os.path.join(settings.BASE_DIR, 'exports')))
+
+
+@task()
+def backup(backup_id):
+    backup = run_backup(DatabaseBackup.objects.get(pk=backup_id))
+    if backup.status != 'succeeded':
+        raise RuntimeError(f'Backup {backup_id} failed: {backup.error}')
+    return {'backup_id': backup_id, 'path': backup.path, 'snapshot': backup.snapshot}
+
+
+@task()
+def rebuild_stats(chunk_size=1000):
+    output = StringIO()
+    call_command('rebuild_stats', chunk_size=chunk_size, stdout=output)
+    return {'output': output.getvalue().strip()}
+
+
+# Scheduled for the end of every training by the Training signals
+@task()
+def close_trainings():
+    return {'closed': close_ended_trainings()}
+
+
+# Writes an export to EXPORT_DIR; the file is served by the job download view
+@task()
+def export(dataset, export_format='csv', params=None):
+    os.makedirs(export_dir(), exist_ok=True)
+    filename = f"{dataset}_{timezone.now().strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:8]}.{export_format}"
+    path = os.path.join(export_dir(), filename)
+    with open(path, 'w', newline='') as output:
+        for piece in export_stream(dataset, params or {}, export_format):
+            output.write(piece)
+    return {'path': path, 'filename': f'{dataset}.{export_format}', 'size': os.path.getsize(path)}
@@ -0,0 +1,166 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count, F, Sum
+
+from .models import Team, TeamCompetitionRecord, TeamStats, User
+from .standings import invalidate_standings
+
+
+RECORD_FIELDS = ['matches', 'wins', 'draws', 'losses', 'score_for', 'score_against', 'points']
+UPSERT_CHUNK = 1000
+
+
+def points_for(outcome):
+    return getattr(settings, 'STANDINGS_POINTS', {'win': 3, 'draw': 1, 'loss': 0})[outcome]
+
+
+# What a match contributes to each team: (team_id, competition_id) -> values in RECORD_FIELDS order.
+# A team wins when its score is higher than every other team's score in the match,
+# draws when it shares the top score and loses otherwise; a match with a single
+# team counts towards matches and score only.
+def match_contributions(result):
+    contributions = {}
+    if result is None:
+        return contributions
+    for index, entry in enumerate(result.entries):
+        others = [other['score'] for other_index, other in enumerate(result.entries) if other_index != index]
+        values = [1, 0, 0, 0, entry['score'], sum(others), 0]
+        if others:
+            best_other = max(others)
+            if entry['score'] > best_other:
+                values[1], values[6] = 1, points_for('win')
+            elif entry['score'] == best_other:
+                values[2], values[6] = 1, points_for('draw')
+            else:
+                values[3], values[6] = 1, points_for('loss')
+        total = contributions.setdefault((entry['team_id'], result.competition_id), [0] * len(RECORD_FIELDS))
+        for position, value in enumerate(values):
+            total[position] += value
+    return contributions
+
+
+def ensure_team_stats(team_ids):
+    TeamStats.objects.bulk_create([TeamStats(team_id=team_id) for team_id in team_ids], ignore_conflicts=True)
+
+
+# Applies the difference between the previously stored and the new MatchResult rows
+# to the team/competition records (standings) and to TeamStats.
+# old_results and new_results map match_id -> MatchResult (or None when missing).
+# Only existing TeamStats rows are updated: a team that is being deleted has
+# already lost its row and must not get it back.
+def apply_match_deltas(old_results, new_results):
+    record_deltas = defaultdict(lambda: [0] * len(RECORD_FIELDS))
+    for match_id in set(old_results) | set(new_results):
+        for sign, result in ((-1, old_results.get(match_id)), (1, new_results.get(match_id))):
+            for key, values in match_contributions(result).items():
+                delta = record_deltas[key]
+                for position, value in enumerate(values):
+                    delta[position] += sign * value
+
+    record_deltas = {key: values for key, values in record_deltas.items() if any(values)}
+    if not record_deltas:
+        return
+
+    team_deltas = defaultdict(lambda: [0, 0, 0])
+    for (team_id, competition_id), values in record_deltas.items():
+        delta = dict(zip(RECORD_FIELDS, values))
+        team_delta = team_deltas[team_id]
+        team_delta[0] += delta['matches']
+        team_delta[1] += delta['wins']
+        team_delta[2] += delta['score_for']
+
+    upsert_records(record_deltas)
+    TeamCompetitionRecord.objects.filter(team_id__in=team_deltas.keys(), matches=0).delete()
+    invalidate_standings({competition_id for _, competition_id in record_deltas})
+
+    records = defaultdict(list)
+    for team_id, competition_id, score_for in (
+        TeamCompetitionRecord.objects.filter(team_id__in=team_deltas.keys())
+        .order_by('team_id', '-score_for', 'competition_id')
+        .values_list('team_id', 'competition_id', 'score_for')
+    ):
+        records[team_id].append((competition_id, score_for))
+
+    for team_id, (matches, wins, score) in team_deltas.items():
+        team_records = records.get(team_id, [])
+        best_competition_id, best_score = team_records[0] if team_records else (None, 0)
+        TeamStats.objects.filter(team_id=team_id).update(
+            matches_count=F('matches_count') + matches,
+            wins=F('wins') + wins,
+            score_sum=F('score_sum') + score,
+            competitions_count=len(team_records),
+            best_competition_id=best_competition_id,
+            best_competition_score=best_score,
+        )
+
+
+# Adds the deltas to the team/competition records in key order. Deltas without
+# negative values go through INSERT ... ON CONFLICT DO UPDATE, which creates
+# the records of teams new to a competition; the others can only apply to
+# existing records (the columns are unsigned) and are plain UPDATEs.
+def upsert_records(record_deltas):
+    rows = []
+    for (team_id, competition_id), values in sorted(record_deltas.items()):
+        if min(values) >= 0:
+            rows.append((team_id, competition_id, *values))
+        else:
+            TeamCompetitionRecord.objects.filter(team_id=team_id, competition_id=competition_id).update(
+                **{field: F(field) + value for field, value in zip(RECORD_FIELDS, values) if value}
+            )
+    if not rows:
+        return
+
+    table = connection.ops.quote_name(TeamCompetitionRecord._meta.db_table)
+    columns = ['team_id', 'competition_id', *RECORD_FIELDS]
+    updates = ', '.join(f'{column} = {table}.{column} + EXCLUDED.{column}' for column in RECORD_FIELDS)
+    placeholders = '(' + ', '.join(['%s'] * len(columns)) + ')'
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), UPSERT_CHUNK):
+            chunk = rows[start:start + UPSERT_CHUNK]
+            cursor.execute(
+                f'INSERT INTO {table} ({", ".join(columns)}) VALUES {", ".join([placeholders] * len(chunk))} '
+                f'ON CONFLICT (team_id, competition_id) DO UPDATE SET {updates}',
+                [value for row in chunk for value in row],
+            )
+
+
+# Moves a member's age between teams when a User joins, leaves or changes team or age.
+# old and new are (team_id, age) pairs, None when the user did not exist.
+def apply_member_change(old, new):
+    if old == new:
+        return
+    deltas = defaultdict(lambda: [0, 0])
+    for state, sign in ((old, -1), (new, 1)):
+        if state is not None and state[0] is not None:
+            deltas[state[0]][0] += sign
+            deltas[state[0]][1] += sign * state[1]
+
+    for team_id, (members, ages) in deltas.items():
+        TeamStats.objects.filter(team_id=team_id).update(
+            members_count=F('members_count') + members,
+            age_sum=F('age_sum') + ages,
+        )
+
+
+# Recreates every TeamStats row with the member aggregates; match aggregates are
+# added back by replaying the match results (see the rebuild_stats command).
+def reset_team_stats():
+    TeamCompetitionRecord.objects.all().delete()
+    TeamStats.objects.all().delete()
+    members = {
+        row['team']: row
+        for row in User.objects.filter(team__isnull=False).values('team').annotate(count=Count('pk'), ages=Sum('age'))
+    }
+    TeamStats.objects.bulk_create(
+        [
+            TeamStats(
+                team_id=team_id,
+                members_count=members.get(team_id, {}).get('count', 0),
+                age_sum=members.get(team_id, {}).get('ages') or 0,
+            )
+            for team_id in Team.objects.values_list('pk', flat=True).iterator()
+        ],
+        batch_size=1000,
+    )
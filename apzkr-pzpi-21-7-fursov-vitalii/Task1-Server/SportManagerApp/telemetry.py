@@ -0,0 +1,361 @@
+import asyncio
+import json
+import logging
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+from types import SimpleNamespace
+from urllib.parse import parse_qsl
+
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections
+from django.http.cookie import parse_cookie
+from django.utils import timezone
+
+from .active_sessions import session_resolver, worn_sensors
+from .ingestion import ReadingError, parse_batch, parse_int, parse_reading, store_average_pulses, store_sensor_pulses
+from .live import live_hub
+from .metrics import LATENCY_BUCKETS, registry
+from .reading_buffer import reading_buffer
+from .tokens import TokenError, revocations, token_user, verify_token
+
+logger = logging.getLogger(__name__)
+
+LIVE_PATH = re.compile(r'^/trainings/(\d+)/live/$')
+
+class HTTPError(Exception):
+    def __init__(self, status, message, headers=()):
+        super().__init__(message)
+        self.status = status
+        self.headers = list(headers)
+
+
+# Pulses accepted by the fast path and not yet written, latest value only:
+# {sensor_id: pulse} of beats without a user,
+# {user_training_id: (user_id, average pulse)} of the sensors' sessions
+class TelemetryQueue:
+    def __init__(self):
+        self.sensor_pulses = {}
+        self.average_pulses = {}
+
+    def __len__(self):
+        return len(self.sensor_pulses) + len(self.average_pulses)
+
+    def take(self):
+        batch = (self.sensor_pulses, self.average_pulses)
+        self.sensor_pulses, self.average_pulses = {}, {}
+        return batch
+
+
+def write_pulses(sensor_pulses, average_pulses):
+    close_old_connections()
+    started = time.perf_counter()
+    try:
+        store_sensor_pulses(sensor_pulses)
+        store_average_pulses(average_pulses)
+    except Exception:
+        logger.exception('Writing %d telemetry pulses failed', len(sensor_pulses) + len(average_pulses))
+    registry.observe('telemetry_flush_duration_seconds', 'Time to write the queued pulses', LATENCY_BUCKETS, time.perf_counter() - started)
+
+
+def refresh_sessions():
+    close_old_connections()
+    session_resolver.refresh()
+
+
+def check_wearers(triples):
+    close_old_connections()
+    return worn_sensors(triples)
+
+
+# ASGI application answering the device endpoints (/api/readings/, /sensor_update/,
+# /usertraining_update/) before Django: no middleware, sessions or templates.
+# Requests are authenticated with device tokens, parsed and answered with 202:
+# readings go to the process's write-behind buffer, the latest pulses are
+# written by one database thread every TELEMETRY_FLUSH_INTERVAL seconds.
+# GET /trainings/<id>/live/ streams the training's athletes as Server-Sent
+# Events from the live hub. Everything else, including device endpoints called
+# with user tokens, is passed to the Django application.
+class TelemetryApplication:
+    def __init__(self, application):
+        self.application = application
+        self.routes = {
+            '/api/readings/': self.readings,
+            '/sensor_update/': self.beat,
+            '/usertraining_update/': self.average,
+        }
+        self.queue = TelemetryQueue()
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='telemetry-writer')
+        self.refresher = ThreadPoolExecutor(max_workers=1, thread_name_prefix='telemetry-revocations')
+        self.loader = ThreadPoolExecutor(max_workers=4, thread_name_prefix='telemetry-live')
+        self.sessions = ThreadPoolExecutor(max_workers=4, thread_name_prefix='telemetry-sessions')
+        self.flusher = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] == 'http' and scope['method'] == 'GET':
+            match = LIVE_PATH.match(scope['path'])
+            if match:
+                return await self.live(scope, receive, send, int(match.group(1)))
+        handler = self.routes.get(scope['path']) if scope['type'] == 'http' and scope['method'] == 'POST' else None
+        if handler is None:
+            return await self.application(scope, receive, send)
+
+        started = time.perf_counter()
+        headers = []
+        try:
+            token = await self.authenticate(scope)
+            # User tokens are authorized by role, which needs the database
+            if token.subject == 'user':
+                return await self.application(scope, receive, send)
+            self.start()
+            status, payload = await handler(token, await read_body(scope, receive))
+        except HTTPError as error:
+            status, payload, headers = error.status, {'error': str(error)}, error.headers
+        except ReadingError as error:
+            status, payload = 400, {'error': str(error)}
+
+        await respond(send, status, payload, headers)
+        registry.observe('telemetry_request_duration_seconds', 'Telemetry fast path latency', LATENCY_BUCKETS, time.perf_counter() - started, route=scope['path'])
+        registry.increment('telemetry_requests_total', 'Telemetry fast path requests', route=scope['path'], status=status)
+
+    async def authenticate(self, scope):
+        scheme, _, value = header(scope, b'authorization').partition(' ')
+        if scheme.lower() != 'bearer' or not value.strip():
+            raise HTTPError(401, 'Bearer token required', [(b'www-authenticate', b'Bearer error="invalid_request"')])
+        if revocations.due():
+            await asyncio.get_running_loop().run_in_executor(self.refresher, revocations.refresh)
+        try:
+            return verify_token(value.strip(), refresh=False)
+        except TokenError as error:
+            raise HTTPError(401, str(error), [(b'www-authenticate', b'Bearer error="invalid_token"')])
+
+    def enqueue(self, readings=(), sensor_pulses=None, average_pulses=None):
+        if len(self.queue) >= getattr(settings, 'TELEMETRY_QUEUE_LIMIT', 100000) or (readings and not reading_buffer.add(readings)):
+            registry.increment('telemetry_backpressure_total', 'Telemetry requests refused because the queue was full')
+            raise HTTPError(503, 'Ingestion queue is full, retry later', [(b'retry-after', b'1')])
+        # A newer reading supersedes a queued pulse of the same sensor
+        for reading in readings:
+            self.queue.sensor_pulses.pop(reading.sensor_id, None)
+        self.queue.sensor_pulses.update(sensor_pulses or {})
+        self.queue.average_pulses.update(average_pulses or {})
+        registry.set('telemetry_queue_size', 'Pulses waiting to be written', len(self.queue))
+
+    # (sensor_id, user_id, timestamp) of the readings with a user whose user
+    # wears the token's sensor at the time. The active sessions answer from
+    # memory; reloading them or checking older readings runs in a thread.
+    async def wearers(self, token, readings):
+        triples = [
+            (reading.sensor_id, reading.user_id, reading.timestamp)
+            for reading in readings
+            if reading.user_id is not None and reading.sensor_id == token.subject_id
+        ]
+        if not session_resolver.due() and all(session_resolver.covers(triple[2]) for triple in triples):
+            return worn_sensors(triples)
+        return await asyncio.get_running_loop().run_in_executor(self.sessions, check_wearers, triples)
+
+    # POST /api/readings/ with the JSON body of the regular endpoint; readings
+    # with a user are only accepted while that user wears the token's sensor
+    async def readings(self, token, body):
+        readings, errors = parse_batch(body)
+        worn = await self.wearers(token, readings)
+        allowed = []
+        for reading in readings:
+            if reading.sensor_id == token.subject_id and (reading.user_id is None or (reading.sensor_id, reading.user_id, reading.timestamp) in worn):
+                allowed.append(reading)
+            else:
+                errors.append({'sensor_id': reading.sensor_id, 'user_id': reading.user_id, 'error': 'Not allowed for this token'})
+        self.enqueue(readings=allowed)
+        return 202 if allowed else 400, {'queued': len(allowed), 'rejected': len(errors), 'errors': errors}
+
+    # POST /sensor_update/ with the form of sketch.ino
+    async def beat(self, token, body):
+        form = dict(parse_qsl(body.decode('latin-1')))
+        sensor_id = parse_int(form.get('sensor_id'), 'sensor_id')
+        pulse = parse_int(form.get('pulse'), 'pulse')
+        if sensor_id != token.subject_id:
+            raise HTTPError(403, 'Not allowed for this token')
+        if 'user_id' in form:
+            reading = parse_reading(form, {})
+            if not await self.wearers(token, [reading]):
+                raise HTTPError(403, 'Not allowed for this token')
+            self.enqueue(readings=[reading])
+        else:
+            self.enqueue(sensor_pulses={sensor_id: pulse})
+        return 202, {'status': 'queued'}
+
+    # POST /usertraining_update/ by the wearer of the token's sensor. Like
+    # device_usertraining_update, the average goes to the session the sensor
+    # is worn in now; only the latest average of every session is written.
+    async def average(self, token, body):
+        form = dict(parse_qsl(body.decode('latin-1')))
+        user_id = parse_int(form.get('user_id'), 'user_id')
+        average_pulse = parse_int(form.get('average_pulse'), 'average_pulse')
+        if session_resolver.due():
+            await asyncio.get_running_loop().run_in_executor(self.sessions, refresh_sessions)
+        session = session_resolver.sensor_session(token.subject_id, timezone.now())
+        if session is None or session[1] != user_id:
+            raise HTTPError(403, 'Not allowed for this token')
+        self.enqueue(average_pulses={session[0]: (user_id, average_pulse)})
+        return 202, {'status': 'queued'}
+
+    # Sends a snapshot of the training's athletes, then their changes as they
+    # are stored, and a comment every LIVE_KEEPALIVE seconds so proxies keep
+    # the connection open. Coaches and admins see every training, athletes
+    # the trainings they take part in.
+    async def live(self, scope, receive, send, training_id):
+        loop = asyncio.get_running_loop()
+        try:
+            if live_hub.connections() >= getattr(settings, 'LIVE_MAX_CONNECTIONS', 1000):
+                raise HTTPError(503, 'Too many live connections, retry later', [(b'retry-after', b'5')])
+            user = await loop.run_in_executor(self.loader, scope_user, header(scope, b'authorization'), header(scope, b'cookie'))
+        except HTTPError as error:
+            return await respond(send, error.status, {'error': str(error)}, error.headers)
+
+        subscriber = live_hub.subscribe(training_id)
+        watcher = None
+        try:
+            if not await loop.run_in_executor(self.loader, live_hub.load, subscriber.training):
+                return await respond(send, 404, {'error': 'Training not found'})
+            athletes = live_hub.snapshot(subscriber.training)
+            if user.role not in ['admin', 'coach'] and user.pk not in {athlete['user_id'] for athlete in athletes}:
+                return await respond(send, 403, {'error': 'Not allowed for this training'})
+
+            await send({
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache'), (b'x-accel-buffering', b'no')],
+            })
+            await send_event(send, 'snapshot', {'training_id': training_id, 'athletes': athletes})
+            watcher = loop.create_task(wait_disconnect(receive, subscriber))
+            keepalive = getattr(settings, 'LIVE_KEEPALIVE', 15)
+            while not subscriber.closed:
+                try:
+                    await asyncio.wait_for(subscriber.event.wait(), keepalive)
+                except asyncio.TimeoutError:
+                    await send({'type': 'http.response.body', 'body': b': keepalive\n\n', 'more_body': True})
+                    continue
+                athletes = subscriber.take()
+                if athletes:
+                    await send_event(send, 'update', {'training_id': training_id, 'athletes': athletes})
+            if not watcher.done():
+                await send({'type': 'http.response.body', 'body': b''})
+        except OSError:
+            # The client went away while we were sending
+            pass
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+            live_hub.unsubscribe(subscriber)
+
+    def start(self):
+        if self.flusher is None:
+            self.flusher = asyncio.get_running_loop().create_task(self.flush_loop())
+
+    async def flush_loop(self):
+        while True:
+            await asyncio.sleep(getattr(settings, 'TELEMETRY_FLUSH_INTERVAL', 0.5))
+            await self.flush()
+
+    async def flush(self):
+        if not len(self.queue):
+            return
+        batch = self.queue.take()
+        registry.set('telemetry_queue_size', 'Pulses waiting to be written', 0)
+        await asyncio.get_running_loop().run_in_executor(self.writer, write_pulses, *batch)
+
+    # Ends the live connections and writes whatever is still queued or
+    # buffered before the server exits
+    async def stop(self):
+        live_hub.close()
+        if self.flusher is not None:
+            self.flusher.cancel()
+            try:
+                await self.flusher
+            except asyncio.CancelledError:
+                pass
+            self.flusher = None
+        await asyncio.get_running_loop().run_in_executor(self.writer, reading_buffer.close)
+        await self.flush()
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self.start()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.stop()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+def header(scope, name):
+    for key, value in scope['headers']:
+        if key == name:
+            return value.decode('latin-1')
+    return ''
+
+
+async def read_body(scope, receive):
+    limit = getattr(settings, 'TELEMETRY_MAX_BODY', 2 * 1024 * 1024)
+    length = header(scope, b'content-length')
+    if length.isdigit() and int(length) > limit:
+        raise HTTPError(413, f'Request body is larger than {limit} bytes')
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise HTTPError(400, 'Client disconnected')
+        body += message.get('body', b'')
+        if len(body) > limit:
+            raise HTTPError(413, f'Request body is larger than {limit} bytes')
+        if not message.get('more_body'):
+            return bytes(body)
+
+
+# The user of a live connection, from a user bearer token or the session cookie
+def scope_user(authorization, cookie):
+    close_old_connections()
+    scheme, _, value = authorization.partition(' ')
+    if value.strip():
+        if scheme.lower() != 'bearer':
+            raise HTTPError(401, 'Bearer token required', [(b'www-authenticate', b'Bearer error="invalid_request"')])
+        try:
+            token = verify_token(value.strip())
+        except TokenError as error:
+            raise HTTPError(401, str(error), [(b'www-authenticate', b'Bearer error="invalid_token"')])
+        if token.subject != 'user':
+            raise HTTPError(403, 'Device tokens are not accepted here')
+        user = token_user(token)
+    else:
+        session = import_module(settings.SESSION_ENGINE).SessionStore(parse_cookie(cookie).get(settings.SESSION_COOKIE_NAME))
+        user = get_user(SimpleNamespace(session=session))
+    if not user.is_authenticated:
+        raise HTTPError(401, 'Authentication required')
+    return user
+
+
+async def wait_disconnect(receive, subscriber):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+    subscriber.close()
+
+
+async def send_event(send, event, payload):
+    data = json.dumps(payload, cls=DjangoJSONEncoder)
+    await send({'type': 'http.response.body', 'body': f'event: {event}\ndata: {data}\n\n'.encode(), 'more_body': True})
+
+
+async def respond(send, status, payload, headers=()):
+    body = json.dumps(payload, cls=DjangoJSONEncoder).encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode()), *headers],
+    })
+    await send({'type': 'http.response.body', 'body': body})
@@ -1,3 +1,564 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import tempfile
+from datetime import timedelta
+from io import StringIO
 
-# Create your tests here.
+from django.core.asgi import get_asgi_application
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from .active_sessions import session_resolver
+from .backup_store import BackupStore
+from .ingestion import store_readings
+from .jobs import TASKS, claim_job, enqueue, requeue_stale_jobs, run_job
+from .models import (
+    Competition, DailyTrainingLoad, HeartRateMinute, HeartRateReading, HeartRateSecond, Job, Match, MatchResult,
+    MatchTeam, Sensor, Team, TeamCompetitionRecord, TeamStats, Training, TrainingHeartRate, TrainingLoad, User,
+    UserTraining,
+)
+from .pagination import keyset_paginate
+from .standings import get_standings
+from .telemetry import TelemetryApplication
+from .tokens import TokenError, issue_token, read_token, revoke_subject, revoke_token, verify_token
+from .training_load import build_training_loads, close_trainings, ended_user_trainings, insert_training_loads, trimp
+from .versions import throttled_bumps
+
+LOCMEM = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+def create_user(email, team=None, age=30):
+    return User.objects.create_user(
+        email=email, password='password', first_name=email.split('@')[0], age=age,
+        gender='male', height=180, weight=75, role='sportsman', team=team,
+    )
+
+
+@override_settings(CACHES=LOCMEM)
+class StandingsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.competition = Competition.objects.create(name='Cup', prize_pool=1000, league='A', sport_type='football')
+        self.red = Team.objects.create(name='Red', city='Kharkiv', sport_type='football')
+        self.blue = Team.objects.create(name='Blue', city='Kyiv', sport_type='football')
+
+    def play(self, red_score, blue_score):
+        match = Match.objects.create(datetime=timezone.now(), location='Stadium', duration=timedelta(minutes=90), competition=self.competition)
+        MatchTeam.objects.create(match=match, team=self.red, team_score=red_score)
+        MatchTeam.objects.create(match=match, team=self.blue, team_score=blue_score)
+        return match
+
+    def test_match_updates_records_and_team_stats(self):
+        self.play(3, 1)
+        red = TeamCompetitionRecord.objects.get(team=self.red, competition=self.competition)
+        blue = TeamCompetitionRecord.objects.get(team=self.blue, competition=self.competition)
+        self.assertEqual((red.matches, red.wins, red.score_for, red.score_against, red.points), (1, 1, 3, 1, 3))
+        self.assertEqual((blue.matches, blue.losses, blue.points), (1, 1, 0))
+
+        stats = TeamStats.objects.get(team=self.red)
+        self.assertEqual((stats.matches_count, stats.wins, stats.score_sum), (1, 1, 3))
+        self.assertEqual(stats.best_competition_id, self.competition.pk)
+        self.assertEqual(stats.win_percentage, 100)
+
+    def test_score_change_replaces_the_old_result(self):
+        match = self.play(3, 1)
+        blue_entry = MatchTeam.objects.get(match=match, team=self.blue)
+        blue_entry.team_score = 3
+        blue_entry.save()
+
+        red = TeamCompetitionRecord.objects.get(team=self.red, competition=self.competition)
+        self.assertEqual((red.matches, red.wins, red.draws, red.points), (1, 0, 1, 1))
+        self.assertEqual(TeamStats.objects.get(team=self.blue).score_sum, 3)
+
+    def test_deleted_match_is_taken_out(self):
+        self.play(3, 1).delete()
+        self.assertFalse(TeamCompetitionRecord.objects.exists())
+        stats = TeamStats.objects.get(team=self.red)
+        self.assertEqual((stats.matches_count, stats.wins, stats.score_sum, stats.best_competition_id), (0, 0, 0, None))
+
+    def test_members_update_team_stats(self):
+        first = create_user('first@example.com', team=self.red, age=20)
+        create_user('second@example.com', team=self.red, age=30)
+        self.assertEqual(TeamStats.objects.get(team=self.red).average_age, 25)
+
+        first.team = self.blue
+        first.save()
+        self.assertEqual(TeamStats.objects.get(team=self.red).members_count, 1)
+        self.assertEqual(TeamStats.objects.get(team=self.blue).age_sum, 20)
+
+    def test_standings_are_refreshed_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.play(2, 0)
+        self.assertEqual([row['team'] for row in get_standings(self.competition.pk)], ['Red', 'Blue'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.play(0, 5)
+        standings = get_standings(self.competition.pk)
+        self.assertEqual([row['team'] for row in standings], ['Blue', 'Red'])
+        self.assertEqual([(row['rank'], row['points'], row['played']) for row in standings], [(1, 3, 2), (2, 3, 2)])
+
+    def snapshot(self):
+        records = sorted(TeamCompetitionRecord.objects.values_list(
+            'team_id', 'competition_id', 'matches', 'wins', 'draws', 'losses', 'score_for', 'score_against', 'points',
+        ))
+        stats = sorted(TeamStats.objects.values_list(
+            'team_id', 'members_count', 'age_sum', 'matches_count', 'wins', 'score_sum', 'competitions_count',
+            'best_competition_id', 'best_competition_score',
+        ))
+        results = sorted(MatchResult.objects.values_list('match_id', 'competition_id', 'entries'))
+        return records, stats, results
+
+    def test_maintained_records_match_a_full_rebuild(self):
+        league = Competition.objects.create(name='League', prize_pool=500, league='B', sport_type='football')
+        green = Team.objects.create(name='Green', city='Lviv', sport_type='football')
+        create_user('member@example.com', team=green, age=24)
+
+        first = self.play(3, 1)
+        second = self.play(2, 2)
+        third = self.play(0, 1)
+        MatchTeam.objects.create(match=third, team=green, team_score=4)
+
+        entry = MatchTeam.objects.get(match=first, team=self.blue)
+        entry.team_score = 5
+        entry.save()
+        entry = MatchTeam.objects.get(match=second, team=self.red)
+        entry.match = third
+        entry.save()
+        third.competition = league
+        third.save()
+        MatchTeam.objects.get(match=second, team=self.blue).delete()
+        first.delete()
+        self.play(1, 0)
+
+        maintained = self.snapshot()
+        self.assertTrue(maintained[0])
+        call_command('rebuild_stats', stdout=StringIO())
+        self.assertEqual(self.snapshot(), maintained)
+
+
+@override_settings(CACHES=LOCMEM, QUERY_BUDGET_MODE='strict')
+class ViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.red = Team.objects.create(name='Red', city='Kharkiv', sport_type='football')
+        self.athlete = create_user('athlete@example.com', team=self.red)
+        self.coach = create_user('coach@example.com', team=self.red)
+        self.coach.role = 'coach'
+        self.coach.save()
+        self.other = create_user('other@example.com')
+
+    def test_unchanged_page_is_not_modified(self):
+        self.client.force_login(self.athlete)
+        url = f'/users/{self.athlete.pk}/'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Training.objects.create(datetime=timezone.now(), location='Gym', duration=timedelta(hours=1))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_pages_are_per_user(self):
+        url = f'/users/{self.athlete.pk}/'
+        self.client.force_login(self.athlete)
+        etag = self.client.get(url)['ETag']
+        self.client.force_login(self.coach)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_user_data_is_limited_to_the_user_and_team_coach(self):
+        paths = ['heart-rate', 'alerts', 'training-load']
+        for viewer, status in ((self.athlete, 200), (self.coach, 200), (self.other, 403)):
+            self.client.force_login(viewer)
+            for path in paths:
+                with self.subTest(viewer=viewer.email, path=path):
+                    self.assertEqual(self.client.get(f'/users/{self.athlete.pk}/{path}/').status_code, status)
+
+    def test_team_training_load_is_limited_to_the_coach(self):
+        for viewer, status in ((self.coach, 200), (self.athlete, 403), (self.other, 403)):
+            self.client.force_login(viewer)
+            with self.subTest(viewer=viewer.email):
+                self.assertEqual(self.client.get(f'/teams/{self.red.pk}/training-load/').status_code, status)
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.teams = [Team.objects.create(name=f'Team {number}', city='Kharkiv', sport_type='hockey') for number in range(5)]
+
+    def page(self, **params):
+        request = self.factory.get('/teams/', {'page_size': 2, **params})
+        return keyset_paginate(request, Team.objects.all(), 'team_id')
+
+    def test_walks_forward_and_back(self):
+        ids = [team.pk for team in self.teams]
+        first = self.page()
+        self.assertEqual([team.pk for team in first], ids[:2])
+        self.assertTrue(first.has_next)
+        self.assertFalse(first.has_previous)
+        self.assertIn(f'after={ids[1]}', first.next_query)
+
+        second = self.page(after=ids[1])
+        self.assertEqual([team.pk for team in second], ids[2:4])
+        self.assertTrue(second.has_previous)
+        self.assertIn(f'before={ids[2]}', second.previous_query)
+
+        last = self.page(after=ids[3])
+        self.assertEqual([team.pk for team in last], ids[4:])
+        self.assertFalse(last.has_next)
+
+        back = self.page(before=ids[2])
+        self.assertEqual([team.pk for team in back], ids[:2])
+        self.assertFalse(back.has_previous)
+        self.assertTrue(back.has_next)
+
+    def test_keeps_other_parameters_and_ignores_bad_cursors(self):
+        first = self.page(after='x', team='3')
+        self.assertEqual(len(first), 2)
+        self.assertFalse(first.has_previous)
+        self.assertIn('team=3', first.next_query)
+        self.assertNotIn('after=x', first.next_query)
+
+
+class TokenTests(TestCase):
+    def test_issued_token_verifies(self):
+        value, token = issue_token('user', 7)
+        verified = verify_token(value)
+        self.assertEqual((verified.subject, verified.subject_id, verified.token_id), ('user', 7, token.token_id))
+
+    def test_rejects_tampered_and_expired_tokens(self):
+        value, _ = issue_token('device', 3)
+        with self.assertRaises(TokenError):
+            verify_token(value[:-2] + ('aa' if value[-2:] != 'aa' else 'bb'))
+
+        with self.settings(DEVICE_TOKEN_TTL=-1):
+            expired, _ = issue_token('device', 3)
+        with self.assertRaisesMessage(TokenError, 'Token expired'):
+            verify_token(expired)
+        self.assertEqual(read_token(expired, check_expiry=False).subject_id, 3)
+
+    def test_rejects_unknown_subjects(self):
+        with self.assertRaises(ValueError):
+            issue_token('admin', 1)
+
+    def test_revoked_token_is_rejected(self):
+        value, token = issue_token('user', 8)
+        other, _ = issue_token('user', 8)
+        revoke_token(token)
+        with self.assertRaisesMessage(TokenError, 'Token revoked'):
+            verify_token(value)
+        self.assertEqual(verify_token(other).subject_id, 8)
+
+    def test_revoking_a_subject_rejects_all_its_tokens(self):
+        first, _ = issue_token('device', 9)
+        second, _ = issue_token('device', 9)
+        unrelated, _ = issue_token('device', 10)
+        revoke_subject('device', 9)
+        for value in (first, second):
+            with self.assertRaisesMessage(TokenError, 'Token revoked'):
+                verify_token(value)
+        self.assertEqual(verify_token(unrelated).subject_id, 10)
+
+
+class BackupStoreTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+        self.store = BackupStore(os.path.join(self.root, 'store'))
+
+    def write(self, name, data):
+        path = os.path.join(self.root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as handle:
+            handle.write(data)
+        return path
+
+    def read(self, path):
+        with open(path, 'rb') as handle:
+            return handle.read()
+
+    def test_file_round_trip_and_deduplication(self):
+        data = os.urandom(1 << 20)
+        first = self.store.add_snapshot(self.write('first.dump', data), name='first')
+        self.assertGreater(first['chunks_total'], 1)
+        self.assertEqual(first['chunks_new'], first['chunks_total'])
+        self.assertEqual(first['bytes_total'], len(data))
+
+        changed = data[:1000] + b'inserted' + data[1000:]
+        second = self.store.add_snapshot(self.write('second.dump', changed), name='second')
+        self.assertLess(second['chunks_new'], second['chunks_total'] / 2)
+
+        self.assertEqual(self.read(self.store.extract('first', os.path.join(self.root, 'out'))), data)
+        self.assertEqual(self.read(self.store.extract('second', os.path.join(self.root, 'out'))), changed)
+
+    def test_directory_round_trip(self):
+        files = {'toc.dat': b'table of contents', os.path.join('data', '3001.dat'): os.urandom(200000)}
+        for relative, data in files.items():
+            self.write(os.path.join('dump', relative), data)
+        manifest = self.store.add_snapshot(os.path.join(self.root, 'dump'), name='nightly')
+        self.assertTrue(manifest['directory'])
+
+        target = self.store.extract('nightly', os.path.join(self.root, 'out'))
+        for relative, data in files.items():
+            self.assertEqual(self.read(os.path.join(target, relative)), data)
+
+    def test_prune_keeps_the_chunks_of_kept_snapshots(self):
+        old = os.urandom(300000)
+        self.store.add_snapshot(self.write('old.dump', old), name='old')
+        self.store.add_snapshot(self.write('new.dump', os.urandom(300000)), name='new')
+
+        removed, (freed_chunks, _) = self.store.prune(keep_last=1)
+        self.assertEqual(removed, ['old'])
+        self.assertGreater(freed_chunks, 0)
+        self.assertEqual([manifest['name'] for manifest in self.store.snapshots()], ['new'])
+        self.assertEqual(self.store.gc(), (0, 0))
+        self.store.extract('new', os.path.join(self.root, 'out'))
+
+
+class HeartRateRollupTests(TestCase):
+    def setUp(self):
+        self.user = create_user('athlete@example.com')
+        self.sensor = Sensor.objects.create(heart_rate=0)
+        self.start = (timezone.now() - timedelta(days=2)).replace(second=0, microsecond=0)
+        self.training = Training.objects.create(datetime=self.start, location='Gym', duration=timedelta(hours=1))
+        self.user_training = UserTraining.objects.create(user=self.user, training=self.training, sensor=self.sensor, intensity=0)
+
+    def reading(self, seconds, pulse):
+        return HeartRateReading(sensor_id=self.sensor.pk, user_id=self.user.pk, timestamp=self.start + timedelta(seconds=seconds), pulse=pulse)
+
+    def test_readings_are_folded_into_the_rollups(self):
+        accepted, rejected = store_readings([self.reading(10, 100), self.reading(10.5, 110), self.reading(70, 130)])
+        self.assertEqual((len(accepted), rejected), (3, []))
+        store_readings([self.reading(20, 90), self.reading(7200, 80)])
+
+        training = TrainingHeartRate.objects.get(user_training=self.user_training)
+        self.assertEqual((training.count, training.pulse_sum, training.pulse_min, training.pulse_max), (4, 430, 90, 130))
+        self.assertEqual(training.first_timestamp, self.start + timedelta(seconds=10))
+        self.assertEqual(training.last_timestamp, self.start + timedelta(seconds=70))
+
+        minutes = list(HeartRateMinute.objects.filter(user=self.user).order_by('bucket').values_list('bucket', 'count', 'pulse_min', 'pulse_max'))
+        self.assertEqual(minutes, [
+            (self.start, 3, 90, 110),
+            (self.start + timedelta(minutes=1), 1, 130, 130),
+            (self.start + timedelta(hours=2), 1, 80, 80),
+        ])
+        second = HeartRateSecond.objects.get(user=self.user, bucket=self.start + timedelta(seconds=10))
+        self.assertEqual((second.count, second.average), (2, 105))
+        self.assertEqual(Sensor.objects.get(pk=self.sensor.pk).heart_rate, 80)
+
+    def test_unknown_users_and_sensors_are_rejected(self):
+        unknown = HeartRateReading(sensor_id=self.sensor.pk + 100, user_id=self.user.pk, timestamp=self.start, pulse=100)
+        accepted, rejected = store_readings([unknown, self.reading(5, 100)])
+        self.assertEqual(len(accepted), 1)
+        self.assertEqual([message for _, message in rejected], [f'Unknown sensor {self.sensor.pk + 100}'])
+        self.assertEqual(TrainingHeartRate.objects.get(user_training=self.user_training).count, 1)
+
+    def test_late_readings_reopen_the_training_load(self):
+        self.assertEqual(close_trainings(), 1)
+        day = DailyTrainingLoad.objects.get(user=self.user, date=timezone.localdate(self.start))
+        self.assertEqual(day.load, 0)
+
+        store_readings([self.reading(60, 150)])
+        self.assertFalse(TrainingLoad.objects.exists())
+        self.assertEqual(close_trainings(), 1)
+        day.refresh_from_db()
+        self.assertAlmostEqual(day.load, trimp(60, 150, self.user.age, self.user.gender))
+
+        self.user_training.delete()
+        day.refresh_from_db()
+        self.assertAlmostEqual(day.load, 0)
+
+    def test_a_training_load_is_added_once(self):
+        # A second worker built the same loads before the first one committed
+        loads = build_training_loads(ended_user_trainings(timezone.now()))
+        self.assertEqual(close_trainings(), 1)
+        self.assertEqual(insert_training_loads(loads), [])
+        self.assertEqual(close_trainings(), 0)
+
+        store_readings([self.reading(60, 150)])
+        self.assertEqual(close_trainings(), 1)
+        day = DailyTrainingLoad.objects.get(user=self.user, date=timezone.localdate(self.start))
+        self.assertAlmostEqual(day.load, trimp(60, 150, self.user.age, self.user.gender))
+
+
+class SessionResolverTests(TestCase):
+    def setUp(self):
+        session_resolver.invalidate()
+        self.addCleanup(session_resolver.invalidate)
+        self.sensor = Sensor.objects.create(heart_rate=0)
+        self.now = timezone.now()
+        self.training = Training.objects.create(datetime=self.now - timedelta(minutes=5), location='Gym', duration=timedelta(hours=1))
+        self.athlete = create_user('athlete@example.com')
+        self.user_training = UserTraining.objects.create(user=self.athlete, training=self.training, sensor=self.sensor, intensity=0)
+
+    def test_resolves_the_running_session_of_a_sensor(self):
+        self.assertTrue(session_resolver.due())
+        session_resolver.refresh()
+        self.assertFalse(session_resolver.due())
+        self.assertTrue(session_resolver.covers(self.now))
+        self.assertFalse(session_resolver.covers(self.now + timedelta(days=1)))
+
+        self.assertEqual(session_resolver.sensor_session(self.sensor.pk, self.now), (self.user_training.pk, self.athlete.pk))
+        self.assertIsNone(session_resolver.sensor_session(self.sensor.pk, self.now - timedelta(minutes=10)))
+        self.assertEqual(session_resolver.user_session(self.athlete.pk, self.now), self.user_training.pk)
+        self.assertTrue(session_resolver.running(self.athlete.pk, self.user_training.pk, self.now))
+        self.assertFalse(session_resolver.running(self.athlete.pk, self.user_training.pk, self.now + timedelta(hours=1)))
+
+    def test_a_shared_sensor_has_no_session(self):
+        partner = create_user('partner@example.com')
+        with self.captureOnCommitCallbacks(execute=True):
+            UserTraining.objects.create(user=partner, training=self.training, sensor=self.sensor, intensity=0)
+        self.assertTrue(session_resolver.due())
+        session_resolver.refresh()
+        self.assertIsNone(session_resolver.sensor_session(self.sensor.pk, self.now))
+        self.assertEqual(session_resolver.sensor_users(self.sensor.pk, self.now), {self.athlete.pk, partner.pk})
+
+
+class JobQueueTests(TestCase):
+    def register(self, name, function, max_attempts=None):
+        TASKS[name] = (function, max_attempts)
+        self.addCleanup(TASKS.pop, name)
+
+    def test_dedupe_key_shares_the_queued_job(self):
+        first = enqueue('close_trainings', dedupe_key='close_trainings')
+        later = timezone.now() + timedelta(minutes=5)
+        second = enqueue('close_trainings', run_after=later, dedupe_key='close_trainings')
+        self.assertEqual(second.pk, first.pk)
+        self.assertEqual(Job.objects.get(pk=first.pk).run_after, later)
+        self.assertEqual(Job.objects.filter(dedupe_key='close_trainings').count(), 1)
+
+        Job.objects.filter(pk=first.pk).update(run_after=timezone.now())
+        self.assertEqual(claim_job('worker').pk, first.pk)
+        third = enqueue('close_trainings', dedupe_key='close_trainings')
+        self.assertNotEqual(third.pk, first.pk)
+        self.assertEqual(enqueue('close_trainings').dedupe_key, '')
+
+    def test_moving_a_training_keeps_one_close_job(self):
+        training = Training.objects.create(datetime=timezone.now(), location='Gym', duration=timedelta(hours=1))
+        training.datetime += timedelta(hours=1)
+        training.save()
+        job = Job.objects.get(dedupe_key=f'close_trainings:{training.pk}')
+        self.assertEqual(job.run_after, training.datetime + training.duration)
+
+    def test_failed_jobs_are_retried_then_failed(self):
+        self.register('flaky', lambda: 1 / 0, max_attempts=2)
+        self.register('steady', lambda value: value * 2)
+        job = enqueue('flaky')
+        run_job(claim_job('worker'))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('queued', 1))
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertIn('ZeroDivisionError', job.error)
+        self.assertIsNone(claim_job('worker'))
+
+        Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        run_job(claim_job('worker'))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 2))
+
+        steady = enqueue('steady', value=21)
+        run_job(claim_job('worker'))
+        steady.refresh_from_db()
+        self.assertEqual((steady.status, steady.result, steady.locked_by), ('succeeded', 42, ''))
+
+    @override_settings(JOB_TIMEOUT=3600)
+    def test_stale_jobs_are_requeued(self):
+        job = enqueue('close_trainings')
+        claim_job('worker')
+        self.assertEqual(requeue_stale_jobs(), 0)
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(hours=2))
+        self.assertEqual(requeue_stale_jobs(), 1)
+        self.assertEqual(claim_job('other').pk, job.pk)
+
+
+# The telemetry fast path writes from its own threads, so its data has to be committed
+@override_settings(TELEMETRY_FLUSH_INTERVAL=0.05, READING_BUFFER_FLUSH_INTERVAL=0.05, LIVE_KEEPALIVE=0.05)
+class TelemetryTests(TransactionTestCase):
+    def setUp(self):
+        session_resolver.invalidate()
+        self.addCleanup(session_resolver.invalidate)
+        self.sensor = Sensor.objects.create(heart_rate=0)
+        self.athlete = create_user('athlete@example.com')
+        self.other = create_user('other@example.com')
+        self.training = Training.objects.create(datetime=timezone.now() - timedelta(minutes=5), location='Gym', duration=timedelta(hours=1))
+        self.user_training = UserTraining.objects.create(user=self.athlete, training=self.training, sensor=self.sensor, intensity=0)
+        self.device_token = issue_token('device', self.sensor.pk)[0]
+        self.application = TelemetryApplication(get_asgi_application())
+
+    def tearDown(self):
+        for executor in (self.application.writer, self.application.refresher, self.application.loader, self.application.sessions):
+            executor.shutdown()
+        # Throttled version bumps run in a timer thread
+        timer = throttled_bumps.timer
+        if timer is not None:
+            timer.join()
+
+    async def request(self, path, form=None, token=None, method='POST', messages=None):
+        body = '&'.join(f'{key}={value}' for key, value in (form or {}).items()).encode()
+        headers = [(b'content-type', b'application/x-www-form-urlencoded'), (b'content-length', str(len(body)).encode()), (b'host', b'testserver')]
+        if token:
+            headers.append((b'authorization', f'Bearer {token}'.encode()))
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method, 'scheme': 'http',
+            'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '', 'headers': headers,
+            'client': ('127.0.0.1', 1), 'server': ('testserver', 80),
+        }
+        messages = messages if messages is not None else asyncio.Queue()
+        await messages.put({'type': 'http.request', 'body': body, 'more_body': False})
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+        await self.application(scope, messages.get, send)
+        return sent[0]['status'], sent
+
+    def test_device_pulses_are_written(self):
+        async def scenario():
+            beat = {'sensor_id': self.sensor.pk, 'user_id': self.athlete.pk, 'pulse': 120}
+            statuses = [
+                (await self.request('/sensor_update/', beat, self.device_token))[0],
+                (await self.request('/sensor_update/', {**beat, 'user_id': self.other.pk}, self.device_token))[0],
+                (await self.request('/sensor_update/', beat))[0],
+                (await self.request('/usertraining_update/', {'user_id': self.athlete.pk, 'average_pulse': 133}, self.device_token))[0],
+                (await self.request('/usertraining_update/', {'user_id': self.other.pk, 'average_pulse': 99}, self.device_token))[0],
+            ]
+            await self.application.stop()
+            return statuses
+
+        self.assertEqual(asyncio.run(scenario()), [202, 403, 401, 202, 403])
+        reading = HeartRateReading.objects.get()
+        self.assertEqual((reading.user_id, reading.user_training_id, reading.pulse), (self.athlete.pk, self.user_training.pk, 120))
+        self.assertEqual(UserTraining.objects.get(pk=self.user_training.pk).intensity, 133)
+
+    def test_live_training_streams_a_snapshot(self):
+        coach = create_user('coach@example.com')
+        coach.role = 'coach'
+        coach.save()
+        coach_token = issue_token('user', coach.pk)[0]
+        other_token = issue_token('user', self.other.pk)[0]
+
+        async def scenario():
+            path = f'/trainings/{self.training.pk}/live/'
+            denied = (await self.request(path, token=other_token, method='GET'))[0]
+            missing = (await self.request(f'/trainings/{self.training.pk + 100}/live/', token=coach_token, method='GET'))[0]
+            anonymous = (await self.request(path, method='GET'))[0]
+
+            messages = asyncio.Queue()
+            stream = asyncio.ensure_future(self.request(path, token=coach_token, method='GET', messages=messages))
+            await asyncio.sleep(0.5)
+            await messages.put({'type': 'http.disconnect'})
+            status, sent = await asyncio.wait_for(stream, 5)
+            return denied, missing, anonymous, status, sent
+
+        denied, missing, anonymous, status, sent = asyncio.run(scenario())
+        self.assertEqual((denied, missing, anonymous, status), (403, 404, 401, 200))
+        event, data = sent[1]['body'].decode().strip().split('\n')
+        self.assertEqual(event, 'event: snapshot')
+        athletes = json.loads(data.removeprefix('data: '))['athletes']
+        self.assertEqual([athlete['user_id'] for athlete in athletes], [self.athlete.pk])
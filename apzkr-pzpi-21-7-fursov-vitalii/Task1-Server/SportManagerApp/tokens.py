@@ -0,0 +1,215 @@
+import secrets
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core import signing
+from django.http import JsonResponse
+from django.middleware.csrf import CsrfViewMiddleware
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
+from django.views.decorators.csrf import csrf_exempt
+
+from .models import RevokedToken, User
+
+SALT = 'SportManagerApp.tokens'
+SUBJECTS = ('device', 'user')
+
+
+class TokenError(Exception):
+    pass
+
+
+class Token:
+    def __init__(self, subject, subject_id, token_id, issued_at, expires_at):
+        self.subject = subject
+        self.subject_id = subject_id
+        self.token_id = token_id
+        self.issued_at = issued_at
+        self.expires_at = expires_at
+
+    # 'device:5' or 'user:3'
+    @property
+    def key(self):
+        return f'{self.subject}:{self.subject_id}'
+
+    def as_json(self):
+        return {
+            'token_id': self.token_id,
+            'subject': self.subject,
+            'subject_id': self.subject_id,
+            'issued_at': epoch_datetime(self.issued_at),
+            'expires_at': epoch_datetime(self.expires_at),
+        }
+
+
+def epoch_datetime(seconds):
+    return datetime.fromtimestamp(seconds, tz=dt_timezone.utc)
+
+
+def token_ttl(subject):
+    if subject == 'device':
+        return getattr(settings, 'DEVICE_TOKEN_TTL', 30 * 24 * 60 * 60)
+    return getattr(settings, 'USER_TOKEN_TTL', 24 * 60 * 60)
+
+
+# Returns (token string, Token). The token is the signed claims, so checking it
+# needs only the secret key: no session, user or token table is read.
+def issue_token(subject, subject_id, ttl=None):
+    if subject not in SUBJECTS:
+        raise ValueError(f'Unknown token subject: {subject}')
+    issued_at = int(time.time())
+    ttl = min(ttl or token_ttl(subject), token_ttl(subject))
+    claims = {'sub': subject, 'id': subject_id, 'jti': secrets.token_hex(8), 'iat': issued_at, 'exp': issued_at + ttl}
+    return signing.dumps(claims, salt=SALT), Token(subject, subject_id, claims['jti'], issued_at, claims['exp'])
+
+
+def read_token(value, check_expiry=True):
+    try:
+        claims = signing.loads(value, salt=SALT)
+        token = Token(claims['sub'], int(claims['id']), str(claims['jti']), int(claims['iat']), int(claims['exp']))
+    except (signing.BadSignature, KeyError, TypeError, ValueError):
+        raise TokenError('Invalid token')
+    if token.subject not in SUBJECTS:
+        raise TokenError('Invalid token')
+    if check_expiry and token.expires_at <= time.time():
+        raise TokenError('Token expired')
+    return token
+
+
+# refresh=False leaves reading new revocations to the caller, for async code
+# that must not query the database inline
+def verify_token(value, refresh=True):
+    token = read_token(value)
+    if revocations.is_revoked(token, refresh):
+        raise TokenError('Token revoked')
+    return token
+
+
+# Revocations held in memory by every process. New rows are read at most every
+# TOKEN_REVOCATION_REFRESH seconds, so a revocation reaches other processes
+# within that delay and token checks stay free of queries in between.
+class RevocationList:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.token_ids = {}
+        self.subjects = {}
+        self.last_id = 0
+        self.refreshed_at = None
+
+    def add(self, row):
+        expires_at = row.expires_at.timestamp()
+        if row.token_id:
+            self.token_ids[row.token_id] = expires_at
+        else:
+            issued_before, current_expiry = self.subjects.get(row.subject, (0, 0))
+            self.subjects[row.subject] = (max(issued_before, row.issued_before.timestamp()), max(current_expiry, expires_at))
+        self.last_id = max(self.last_id, row.revoked_id)
+
+    def due(self):
+        interval = getattr(settings, 'TOKEN_REVOCATION_REFRESH', 30)
+        return self.refreshed_at is None or time.monotonic() - self.refreshed_at >= interval
+
+    def refresh(self):
+        if not self.due():
+            return
+        with self.lock:
+            if not self.due():
+                return
+            for row in RevokedToken.objects.filter(revoked_id__gt=self.last_id).order_by('revoked_id'):
+                self.add(row)
+            now = time.time()
+            self.token_ids = {token_id: expires_at for token_id, expires_at in self.token_ids.items() if expires_at > now}
+            self.subjects = {subject: entry for subject, entry in self.subjects.items() if entry[1] > now}
+            self.refreshed_at = time.monotonic()
+
+    def is_revoked(self, token, refresh=True):
+        if refresh:
+            self.refresh()
+        if token.token_id in self.token_ids:
+            return True
+        # Claims carry whole seconds, so tokens issued in the second of the revocation are revoked too
+        issued_before, _ = self.subjects.get(token.key, (0, 0))
+        return token.issued_at <= issued_before
+
+
+revocations = RevocationList()
+
+
+def revoke(subject_key, token_id='', expires_at=None):
+    now = timezone.now()
+    if expires_at is None:
+        expires_at = now + timedelta(seconds=token_ttl(subject_key.split(':')[0]))
+    RevokedToken.objects.filter(expires_at__lt=now).delete()
+    row = RevokedToken.objects.create(token_id=token_id, subject=subject_key, issued_before=now, expires_at=expires_at)
+    with revocations.lock:
+        revocations.add(row)
+    return row
+
+
+def revoke_token(token):
+    return revoke(token.key, token.token_id, epoch_datetime(token.expires_at))
+
+
+# Revokes every token issued so far to a device or user
+def revoke_subject(subject, subject_id):
+    return revoke(f'{subject}:{subject_id}')
+
+
+def token_user(token):
+    return User.objects.filter(pk=token.subject_id).first() or AnonymousUser()
+
+
+def bearer_token(request):
+    scheme, _, value = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    if scheme.lower() != 'bearer' or not value.strip():
+        return None
+    return value.strip()
+
+
+def token_error(message, status=401, error='invalid_token'):
+    response = JsonResponse({'error': message}, status=status)
+    if status == 401:
+        response['WWW-Authenticate'] = f'Bearer error="{error}", error_description="{message}"'
+    return response
+
+
+# Authenticates a view with an "Authorization: Bearer <token>" header and puts
+# the Token on request.token. Token requests skip sessions and CSRF: request.user
+# is loaded from the token only if the view uses it. `subjects` limits the
+# accepted kinds of token; with allow_session, requests without a token fall
+# back to the session (request.token is None) and keep their CSRF check.
+def token_required(*subjects, allow_session=False):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            value = bearer_token(request)
+            if value is None:
+                if allow_session and request.user.is_authenticated:
+                    csrf = CsrfViewMiddleware(lambda request: None)
+                    csrf.process_request(request)
+                    failure = csrf.process_view(request, None, (), {})
+                    if failure is not None:
+                        return failure
+                    request.token = None
+                    return view(request, *args, **kwargs)
+                return token_error('Bearer token required', error='invalid_request')
+
+            try:
+                token = verify_token(value)
+            except TokenError as error:
+                return token_error(str(error))
+            if subjects and token.subject not in subjects:
+                return token_error(f'{token.subject.capitalize()} tokens are not accepted here', status=403)
+
+            request.token = token
+            if token.subject == 'user':
+                request.user = SimpleLazyObject(lambda: token_user(token))
+            else:
+                request.user = AnonymousUser()
+            return view(request, *args, **kwargs)
+        return csrf_exempt(wrapper)
+    return decorator
@@ -0,0 +1,56 @@
+import calendar
+from datetime import date, datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Training
+
+
+def calendar_cache_key(year, month):
+    return f'training_calendar:{year}:{month:02d}'
+
+
+def month_bounds(year, month):
+    start = timezone.make_aware(datetime(year, month, 1))
+    if month == 12:
+        end = timezone.make_aware(datetime(year + 1, 1, 1))
+    else:
+        end = timezone.make_aware(datetime(year, month + 1, 1))
+    return start, end
+
+
+# Builds the days of a month with their trainings from a single range query on Training.datetime
+def build_month(year, month):
+    start, end = month_bounds(year, month)
+    trainings_by_day = {}
+    for training in Training.objects.filter(datetime__gte=start, datetime__lt=end).order_by('datetime'):
+        trainings_by_day.setdefault(timezone.localtime(training.datetime).date(), []).append(training)
+
+    days_count = calendar.monthrange(year, month)[1]
+    days = []
+    for day in range(1, days_count + 1):
+        current_day = date(year, month, day)
+        days.append({'date': current_day, 'trainings': trainings_by_day.get(current_day, [])})
+    return days
+
+
+def get_month(year, month):
+    key = calendar_cache_key(year, month)
+    days = cache.get(key)
+    if days is None:
+        days = build_month(year, month)
+        cache.set(key, days, getattr(settings, 'TRAINING_CALENDAR_CACHE_TIMEOUT', 60 * 60 * 24))
+    return days
+
+
+# Drops the cached month that contains the given training datetime once the
+# transaction commits, so a concurrent read cannot cache the old month again
+def invalidate_month(value):
+    if value is None:
+        return
+    local = timezone.localtime(value) if timezone.is_aware(value) else value
+    key = calendar_cache_key(local.year, local.month)
+    transaction.on_commit(lambda: cache.delete(key))
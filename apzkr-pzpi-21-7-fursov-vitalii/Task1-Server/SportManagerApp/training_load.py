@@ -0,0 +1,183 @@
+import math
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import DateTimeField, ExpressionWrapper, F
+from django.utils import timezone
+
+from .jobs import enqueue
+from .models import DailyTrainingLoad, TrainingLoad, UserTraining
+from .versions import bump_versions
+
+ACUTE_DAYS = 7
+CHRONIC_DAYS = 28
+UPSERT_CHUNK = 1000
+
+
+# Banister's TRIMP: minutes x heart rate reserve x a * e^(b * heart rate reserve),
+# with the maximum heart rate 220 - age and a resting pulse of TRIMP_RESTING_HEART_RATE
+def trimp(minutes, pulse, age, gender):
+    rest = getattr(settings, 'TRIMP_RESTING_HEART_RATE', 60)
+    maximum = 220 - age
+    if maximum <= rest:
+        return 0.0
+    reserve = min(max((pulse - rest) / (maximum - rest), 0.0), 1.0)
+    a, b = (0.86, 1.67) if str(gender).lower().startswith('f') else (0.64, 1.92)
+    return minutes * reserve * a * math.exp(b * reserve)
+
+
+# User trainings whose training has ended and that have no TrainingLoad yet:
+# (user_training_id, user_id, age, gender, intensity, start, duration, reading count, pulse sum)
+def ended_user_trainings(now):
+    return (
+        UserTraining.objects.filter(training__datetime__lte=now, trainingload__isnull=True)
+        .annotate(end=ExpressionWrapper(F('training__datetime') + F('training__duration'), output_field=DateTimeField()))
+        .filter(end__lte=now)
+        .order_by('pk')
+        .values_list(
+            'user_training_id', 'user_id', 'user__age', 'user__gender', 'intensity',
+            'training__datetime', 'training__duration', 'trainingheartrate__count', 'trainingheartrate__pulse_sum',
+        )
+    )
+
+
+# TrainingLoads of ended trainings. The pulse is the average of the stored
+# readings, or the intensity reported by the sensor when there are none.
+def build_training_loads(rows):
+    loads = []
+    for user_training_id, user_id, age, gender, intensity, start, duration, count, pulse_sum in rows:
+        pulse = pulse_sum / count if count else intensity
+        loads.append(TrainingLoad(
+            user_training_id=user_training_id,
+            user_id=user_id,
+            date=timezone.localdate(start),
+            trimp=trimp(duration.total_seconds() / 60, pulse, age, gender),
+        ))
+    return loads
+
+
+# Adds training loads to the daily loads of their day and to the acute and
+# chronic loads of the days whose windows contain it. Every closed training
+# creates the rows of its whole window, so a row missing before had nothing to
+# add up and the increments alone keep all rows exact. One upsert per chunk.
+def apply_daily_loads(loads):
+    deltas = {}
+    for training_load in loads:
+        trimp_value = training_load.trimp
+        for offset in range(CHRONIC_DAYS):
+            entry = deltas.setdefault((training_load.user_id, training_load.date + timedelta(days=offset)), [0.0, 0.0, 0.0])
+            if offset == 0:
+                entry[0] += trimp_value
+            if offset < ACUTE_DAYS:
+                entry[1] += trimp_value
+            entry[2] += trimp_value * ACUTE_DAYS / CHRONIC_DAYS
+    if not deltas:
+        return
+
+    table = connection.ops.quote_name(DailyTrainingLoad._meta.db_table)
+    columns = ['user_id', 'date', 'load', 'acute', 'chronic']
+    updates = ', '.join(f'{column} = {table}.{column} + EXCLUDED.{column}' for column in columns[2:])
+    rows = sorted((user_id, day, *values) for (user_id, day), values in deltas.items())
+    placeholders = '(' + ', '.join(['%s'] * len(columns)) + ')'
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), UPSERT_CHUNK):
+            chunk = rows[start:start + UPSERT_CHUNK]
+            cursor.execute(
+                f'INSERT INTO {table} ({", ".join(columns)}) VALUES {", ".join([placeholders] * len(chunk))} '
+                f'ON CONFLICT (user_id, date) DO UPDATE SET {updates}',
+                [connection.ops.adapt_datefield_value(value) if isinstance(value, date) else value for row in chunk for value in row],
+            )
+
+
+# Inserts training loads, skipping user trainings that already have one, and
+# returns the loads actually inserted
+def insert_training_loads(loads):
+    if not loads:
+        return []
+    table = connection.ops.quote_name(TrainingLoad._meta.db_table)
+    columns = ['user_training_id', 'user_id', 'date', 'trimp', 'closed_at']
+    placeholders = '(' + ', '.join(['%s'] * len(columns)) + ')'
+    closed_at = connection.ops.adapt_datetimefield_value(timezone.now())
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} ({", ".join(columns)}) VALUES {", ".join([placeholders] * len(loads))} '
+            f'ON CONFLICT (user_training_id) DO NOTHING RETURNING user_training_id',
+            [
+                value
+                for load in loads
+                for value in (load.user_training_id, load.user_id, connection.ops.adapt_datefield_value(load.date), load.trimp, closed_at)
+            ],
+        )
+        inserted = {row[0] for row in cursor.fetchall()}
+    return [load for load in loads if load.user_training_id in inserted]
+
+
+# Computes the training load of every user training whose training has ended,
+# chunk_size at a time, each chunk in its own transaction. Returns the count.
+# Workers running this at the same time may compute the same user trainings;
+# only the one inserting a load adds it to the daily loads.
+def close_trainings(now=None, chunk_size=1000):
+    now = now or timezone.now()
+    closed = 0
+    while True:
+        with transaction.atomic():
+            loads = build_training_loads(ended_user_trainings(now)[:chunk_size])
+            inserted = insert_training_loads(loads)
+            apply_daily_loads(inserted)
+        closed += len(inserted)
+        if len(loads) < chunk_size:
+            break
+    if closed:
+        bump_versions([DailyTrainingLoad])
+    return closed
+
+
+# Takes the training loads of user trainings back out of the daily loads and
+# deletes them, so close_trainings computes them again from the current
+# training, readings and pulse. Returns how many were reopened.
+def reopen_training_loads(user_training_ids):
+    user_training_ids = list(user_training_ids)
+    if not user_training_ids:
+        return 0
+    with transaction.atomic():
+        loads = list(TrainingLoad.objects.select_for_update().filter(pk__in=user_training_ids).order_by('pk'))
+        if not loads:
+            return 0
+        apply_daily_loads([TrainingLoad(user_id=load.user_id, date=load.date, trimp=-load.trimp) for load in loads])
+        TrainingLoad.objects.filter(pk__in=[load.pk for load in loads]).delete()
+    bump_versions([DailyTrainingLoad])
+    return len(loads)
+
+
+# For writes that change the pulse of closed user trainings (late readings,
+# average pulses): reopens their loads and has them closed again by the one
+# queued close_trainings job
+def refresh_training_loads(user_training_ids):
+    if reopen_training_loads(user_training_ids):
+        enqueue('close_trainings', dedupe_key='close_trainings')
+
+
+# Recomputes the daily loads from the stored training loads, e.g. after they
+# were changed outside the application
+def rebuild_daily_loads(chunk_size=1000):
+    with transaction.atomic():
+        DailyTrainingLoad.objects.all().delete()
+        chunk = []
+        for training_load in TrainingLoad.objects.order_by('pk').iterator(chunk_size=chunk_size):
+            chunk.append(training_load)
+            if len(chunk) == chunk_size:
+                apply_daily_loads(chunk)
+                chunk = []
+        apply_daily_loads(chunk)
+    bump_versions([DailyTrainingLoad])
+
+
+# Daily loads of a user, or of every member of a team, between two dates:
+# one query on the (user, date) key, joined to the users by team for teams
+def user_training_loads(user_id, start, end):
+    return DailyTrainingLoad.objects.filter(user_id=user_id, date__gte=start, date__lte=end).order_by('date')
+
+
+def team_training_loads(team_id, start, end):
+    return DailyTrainingLoad.objects.filter(user__team_id=team_id, date__gte=start, date__lte=end).order_by('user_id', 'date')
@@ -0,0 +1,133 @@
+import hashlib
+import threading
+import time
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+
+from .models import Competition, DailyTrainingLoad, HeartRateReading, Match, MatchTeam, ModelVersion, Sensor, Team, Training, User, UserTraining
+
+# Models whose writes bump a version. Derived tables (results, statistics,
+# rollups) are maintained from writes to these, so views depend on the sources.
+TRACKED_MODELS = [User, Team, Match, MatchTeam, Competition, Training, UserTraining, Sensor, HeartRateReading, DailyTrainingLoad]
+
+
+def version_name(model):
+    return model._meta.model_name
+
+
+# Bumps the versions of models (or of plain version names) once the surrounding
+# transaction commits. Bumping earlier would let a request see the new version
+# together with the old rows and answer later requests with 304 for stale content.
+# With throttle, the bump goes through throttled_bumps instead: for the
+# ingestion path, which would otherwise update the same version rows with
+# every batch.
+def bump_versions(models, throttle=False):
+    names = {model if isinstance(model, str) else version_name(model) for model in models}
+    if names:
+        transaction.on_commit(lambda: throttled_bumps.add(names) if throttle else _bump(names))
+
+
+def _bump(names):
+    now = timezone.now()
+    updated = ModelVersion.objects.filter(name__in=names).update(version=F('version') + 1, updated_at=now)
+    if updated < len(names):
+        existing = set(ModelVersion.objects.filter(name__in=names).values_list('name', flat=True))
+        ModelVersion.objects.bulk_create(
+            [ModelVersion(name=name, version=1, updated_at=now) for name in names - existing],
+            ignore_conflicts=True,
+        )
+
+
+# Bumps versions at most once per VERSION_BUMP_INTERVAL seconds in a process.
+# Writes mark their names pending and a timer thread bumps everything pending
+# at the end of the interval, so a stream of batches costs one version update
+# per interval and pages built on it are stale for at most that long.
+class ThrottledBumps:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.bumped_at = 0.0
+        self.timer = None
+
+    def add(self, names):
+        with self.lock:
+            self.pending |= names
+            if self.timer is not None:
+                return
+            delay = max(self.bumped_at + getattr(settings, 'VERSION_BUMP_INTERVAL', 5.0) - time.monotonic(), 0.0)
+            self.timer = threading.Timer(delay, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush(self):
+        with self.lock:
+            names, self.pending = self.pending, set()
+            self.timer = None
+            self.bumped_at = time.monotonic()
+        try:
+            if names:
+                _bump(names)
+        finally:
+            connections.close_all()
+
+
+throttled_bumps = ThrottledBumps()
+
+
+# name -> (version, updated_at), read with one query and kept on the request
+# because Django asks for the ETag and the Last-Modified separately
+def request_versions(request, names):
+    versions = getattr(request, '_model_versions', None)
+    if versions is None:
+        versions = request._model_versions = {
+            name: (version, updated_at)
+            for name, version, updated_at in ModelVersion.objects.filter(name__in=names).values_list('name', 'version', 'updated_at')
+        }
+    return versions
+
+
+# Answers repeat GETs with 304 Not Modified when none of `models` changed,
+# without running the view. HTML pages show the navigation of the logged in
+# user and a CSRF token, so their ETag also covers the user and the CSRF
+# cookie, and they send no Last-Modified (it cannot tell users apart).
+def conditional(*models, per_user=True):
+    names = sorted({version_name(model) for model in models} | ({version_name(User)} if per_user else set()))
+
+    def etag(request, *args, **kwargs):
+        versions = request_versions(request, names)
+        parts = [request.resolver_match.view_name, request.get_full_path(), timezone.localdate().isoformat()]
+        # The stamp keeps ETags unique when a restored database brings back lower counters
+        parts += [f'{name}:{version}:{updated_at.timestamp()}' for name, (version, updated_at) in sorted(versions.items())]
+        if per_user:
+            parts += [str(request.user.pk), request.META.get('CSRF_COOKIE', '')]
+        return hashlib.md5('|'.join(parts).encode()).hexdigest()
+
+    # HTTP dates have one second resolution: a stamp from the current second could
+    # be followed by another write in the same second, so it is not sent yet
+    def last_modified(request, *args, **kwargs):
+        stamps = [updated_at for _, updated_at in request_versions(request, names).values()]
+        if not stamps or timezone.now() - max(stamps) < timedelta(seconds=1):
+            return None
+        return max(stamps)
+
+    def decorator(view):
+        conditional_view = condition(etag_func=etag, last_modified_func=None if per_user else last_modified)(view)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = conditional_view(request, *args, **kwargs)
+            # Browsers must revalidate every time; shared caches must not keep per-user pages
+            if per_user:
+                patch_cache_control(response, private=True, no_cache=True)
+            else:
+                patch_cache_control(response, no_cache=True)
+            return response
+        return wrapper
+    return decorator
@@ -2,36 +2,257 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.http import HttpResponse, HttpResponseForbidden
 from django.views import View
 from django.contrib.auth.decorators import login_required
-from .models import User, Team, Match, MatchTeam, Competition, Training, UserTraining, Sensor
-from django.db.models import Avg, Count, F, Q, Sum, FloatField
+from .models import User, Team, Match, MatchTeam, Competition, Training, UserTraining, Sensor, TeamStats, TrainingHeartRate, DatabaseBackup, Job, HeartRateReading, HeartRateAlert, DailyTrainingLoad
+from django.db.models import Avg, Count, F, Q, Sum, FloatField, Prefetch
 from .forms import UserForm, TeamForm, MatchForm, MatchTeamForm, CompetitionForm, TrainingForm, UserTrainingForm, SensorForm
 from django.contrib.auth import login, authenticate
 from django.contrib.auth.forms import AuthenticationForm, UserCreationForm
 from .forms import RegisterUserForm, LoginUserForm
-from django.http import JsonResponse
+from django.http import FileResponse, Http404, JsonResponse, StreamingHttpResponse
 from django.middleware.csrf import get_token
 from django.contrib import messages
+from django.conf import settings
 from django.core.management import call_command
 from io import StringIO
 import calendar
+import hmac
+import json
+from django.utils import timezone
+from django.utils.dateparse import parse_date
 from django.utils.timezone import now
 from datetime import date, datetime, timedelta
 from itertools import groupby
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from .active_sessions import session_resolver, worn_sensors
+from .ingestion import ReadingError, parse_batch, parse_int, parse_reading, parse_timestamp, store_readings
+from .backups import start_backup
+from .exports import DATASETS, FORMATS, export_stream
+from .jobs import enqueue
+from .metrics import registry
+from .middleware import query_budget
+from .page_cache import COMPETITION_DETAIL, COMPETITION_LIST, cached_page
+from .pagination import keyset_paginate, list_filters
+from .recommendations import get_recommendation, get_recommendations, invalidate_recommendations
+from .results import competition_match_results
+from .reading_buffer import buffering_enabled, reading_buffer
+from .rollups import heart_rate_series
+from .standings import get_standings
+from .training_calendar import get_month
+from .tokens import TokenError, bearer_token, issue_token, read_token, revoke_subject, revoke_token, token_error, token_required, verify_token
+from .training_load import refresh_training_loads, team_training_loads, user_training_loads
+from .versions import bump_versions, conditional
 
 # Generating CSRF token
 def get_csrf_token(request):
     return JsonResponse({'csrf_token': get_token(request)})
 
+def request_json(request):
+    try:
+        payload = json.loads(request.body or b'{}')
+    except ValueError:
+        return None
+    return payload if isinstance(payload, dict) else None
+
+def token_response(subject, subject_id, ttl):
+    value, token = issue_token(subject, subject_id, ttl)
+    return JsonResponse({'token': value, **token.as_json()}, status=201)
+
+# Issues a bearer token. {"email", "password"} gives a user token. With a user token
+# in the Authorization header, admins and coaches get a device token for
+# {"sensor_id": n} and everyone gets a fresh token of their own otherwise.
+@csrf_exempt
+@require_POST
+def token_issue(request):
+    payload = request_json(request)
+    if payload is None:
+        return JsonResponse({'error': 'Request body must be a JSON object'}, status=400)
+    ttl = payload.get('ttl')
+    if ttl is not None and (not isinstance(ttl, int) or ttl <= 0):
+        return JsonResponse({'error': 'ttl must be a positive number of seconds'}, status=400)
+
+    if 'email' in payload:
+        user = authenticate(request, email=payload.get('email'), password=payload.get('password'))
+        if user is None:
+            return JsonResponse({'error': 'Invalid email or password'}, status=401)
+        return token_response('user', user.pk, ttl)
+
+    value = bearer_token(request)
+    if value is None:
+        return token_error('Send an email and password or a user token', error='invalid_request')
+    try:
+        token = verify_token(value)
+    except TokenError as error:
+        return token_error(str(error))
+    if token.subject != 'user':
+        return token_error('Device tokens cannot issue tokens', status=403)
+
+    if 'sensor_id' not in payload:
+        return token_response('user', token.subject_id, ttl)
+    try:
+        sensor_id = parse_int(payload['sensor_id'], 'sensor_id')
+    except ReadingError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    role = User.objects.filter(pk=token.subject_id).values_list('role', flat=True).first()
+    if role not in ['admin', 'coach']:
+        return token_error('Only admins and coaches can issue device tokens', status=403)
+    if not Sensor.objects.filter(pk=sensor_id).exists():
+        return JsonResponse({'error': f'Unknown sensor {sensor_id}'}, status=404)
+    return token_response('device', sensor_id, ttl)
+
+# Revokes the token in the Authorization header, another token sent as {"token": "..."},
+# or every token of {"sensor_id": n} or {"user_id": n}. Admins may revoke any token,
+# coaches device tokens, everyone else only their own.
+@require_POST
+@token_required()
+def token_revoke(request):
+    payload = request_json(request)
+    if payload is None:
+        return JsonResponse({'error': 'Request body must be a JSON object'}, status=400)
+    role = getattr(request.user, 'role', None) if request.token.subject == 'user' else None
+
+    def allowed(subject, subject_id):
+        if request.token.subject == subject and request.token.subject_id == subject_id:
+            return True
+        return role == 'admin' or (role == 'coach' and subject == 'device')
+
+    if 'token' in payload:
+        try:
+            token = read_token(str(payload['token']), check_expiry=False)
+        except TokenError as error:
+            return JsonResponse({'error': str(error)}, status=400)
+        if not allowed(token.subject, token.subject_id):
+            return token_error('Not allowed to revoke this token', status=403)
+        revoke_token(token)
+        return JsonResponse({'revoked': token.as_json()})
+
+    for field, subject in [('sensor_id', 'device'), ('user_id', 'user')]:
+        if field in payload:
+            try:
+                subject_id = parse_int(payload[field], field)
+            except ReadingError as error:
+                return JsonResponse({'error': str(error)}, status=400)
+            if not allowed(subject, subject_id):
+                return token_error('Not allowed to revoke these tokens', status=403)
+            revoke_subject(subject, subject_id)
+            return JsonResponse({'revoked': {'subject': subject, 'subject_id': subject_id, 'all': True}})
+
+    revoke_token(request.token)
+    return JsonResponse({'revoked': request.token.as_json()})
+
 # Making a backup of the database
 def backup(request):
     if not request.user.is_authenticated or request.user.role != 'admin':
         return HttpResponseForbidden("You are not authorized to perform this action.")
     
-    out = StringIO()
-    call_command('backup', stdout=out)
-    messages.success(request, 'Backup completed successfully')
+    backup = start_backup(requested_by=request.user)
+    messages.success(request, f'Backup {backup.backup_id} queued')
     return redirect('home')
 
+# Queueing a rebuild of the match results and team statistics
+def rebuild_stats(request):
+    if not request.user.is_authenticated or request.user.role != 'admin':
+        return HttpResponseForbidden("You are not authorized to perform this action.")
+
+    job = enqueue('rebuild_stats', requested_by=request.user)
+    messages.success(request, f'Statistics rebuild queued as job {job.job_id}')
+    return redirect('home')
+
+def job_json(job):
+    return {
+        'job_id': job.job_id,
+        'task': job.task,
+        'status': job.status,
+        'attempts': job.attempts,
+        'max_attempts': job.max_attempts,
+        'run_after': job.run_after,
+        'result': job.result,
+        'error': job.error,
+        'created_at': job.created_at,
+        'started_at': job.started_at,
+        'finished_at': job.finished_at,
+    }
+
+# Status of a background job, visible to admins and to the user who queued it
+@token_required('user', allow_session=True)
+def job_status(request, pk):
+    job = get_object_or_404(Job, pk=pk)
+    if request.user.role != 'admin' and job.requested_by_id != request.user.pk:
+        return HttpResponseForbidden("You are not authorized to perform this action.")
+    return JsonResponse(job_json(job))
+
+# Recent background jobs
+@token_required('user', allow_session=True)
+def job_list(request):
+    if request.user.role != 'admin':
+        return HttpResponseForbidden("You are not authorized to perform this action.")
+    jobs = Job.objects.order_by('-job_id')
+    if request.GET.get('status'):
+        jobs = jobs.filter(status=request.GET['status'])
+    return JsonResponse({'jobs': [job_json(job) for job in jobs[:100]]})
+
+# File written by a finished export job
+@token_required('user', allow_session=True)
+def job_download(request, pk):
+    job = get_object_or_404(Job, pk=pk, task='export', status='succeeded')
+    if request.user.role != 'admin' and job.requested_by_id != request.user.pk:
+        return HttpResponseForbidden("You are not authorized to perform this action.")
+    try:
+        return FileResponse(open(job.result['path'], 'rb'), as_attachment=True, filename=job.result['filename'])
+    except FileNotFoundError:
+        raise Http404('The export file no longer exists')
+
+# Status of a backup started from the backup view
+@token_required('user', allow_session=True)
+def backup_status(request, pk):
+    if not request.user.is_authenticated or request.user.role != 'admin':
+        return HttpResponseForbidden("You are not authorized to perform this action.")
+
+    backup = get_object_or_404(DatabaseBackup, pk=pk)
+    return JsonResponse({
+        'backup_id': backup.backup_id,
+        'status': backup.status,
+        'progress': backup.progress,
+        'tables_done': backup.tables_done,
+        'tables_total': backup.tables_total,
+        'format': backup.format,
+        'path': backup.path,
+        'snapshot': backup.snapshot,
+        'error': backup.error,
+        'created_at': backup.created_at,
+        'started_at': backup.started_at,
+        'finished_at': backup.finished_at,
+    })
+
+# Streaming CSV/NDJSON export of training, match and heart-rate data
+@token_required('user', allow_session=True)
+def export_data(request, dataset):
+    if request.user.role not in ['admin', 'coach']:
+        return HttpResponseForbidden("You are not authorized to perform this action.")
+    export_format = request.GET.get('format', 'csv')
+    if dataset not in DATASETS or export_format not in FORMATS:
+        return JsonResponse({'error': 'Unknown dataset or format'}, status=404)
+
+    # ?background=1 writes the export in a worker instead of holding this request
+    if request.GET.get('background'):
+        params = {key: request.GET[key] for key in ('team', 'training', 'competition', 'date_from', 'date_to') if request.GET.get(key)}
+        job = enqueue('export', requested_by=request.user, dataset=dataset, export_format=export_format, params=params)
+        return JsonResponse(job_json(job), status=202)
+
+    response = StreamingHttpResponse(export_stream(dataset, request.GET, export_format), content_type=FORMATS[export_format])
+    response['Content-Disposition'] = f'attachment; filename="{dataset}.{export_format}"'
+    return response
+
+# Request latency and SQL metrics in Prometheus text format, for admins and
+# scrapers sending METRICS_TOKEN as bearer token
+def metrics(request):
+    expected = getattr(settings, 'METRICS_TOKEN', '')
+    token = bearer_token(request)
+    allowed = bool(expected) and token is not None and hmac.compare_digest(token.encode(), expected.encode())
+    if not allowed and not (request.user.is_authenticated and request.user.role == 'admin'):
+        return HttpResponseForbidden("You are not authorized to perform this action.")
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 # Redirect to the home page
 def home(request):
     return redirect('competition_list')
@@ -70,58 +291,136 @@ def logout(request):
 
 # User Views
 @login_required
+@conditional(User)
+@query_budget(5)
 def user_list(request):
-    users = User.objects.all()
-    return render(request, 'SportManagerApp/user_list.html', {'users': users})
-
-def generate_training_recommendation(trainings, user):
-    mhr = 220 - user.age
-    moderate_min = 0.5 * mhr
-    moderate_max = 0.7 * mhr
-    high_min = 0.7 * mhr
-    high_max = 0.85 * mhr
-
-    moderate_count = 0
-    high_count = 0
-
-    for training in trainings:
-        if moderate_min <= training.intensity <= moderate_max:
-            moderate_count += 1
-        elif high_min <= training.intensity <= high_max:
-            high_count += 1
-
-    total_trainings = len(trainings)
-
-    if total_trainings == 0:
-        recommendation = "No recent training data available."
-    else:
-        moderate_ratio = moderate_count / total_trainings
-        high_ratio = high_count / total_trainings
-
-        if moderate_ratio > 0.5:
-            recommendation = "You are doing a good amount of moderate intensity training. Keep it up!"
-        elif high_ratio > 0.5:
-            recommendation = "You are doing a lot of high intensity training. Consider incorporating more moderate intensity sessions."
-        else:
-            recommendation = "Your training intensity is well balanced. Continue with your current routine."
-
-    return recommendation
+    users = keyset_paginate(request, User.objects.filter(**list_filters(request.GET, team='team_id')), 'user_id')
+    return render(request, 'SportManagerApp/user_list.html', {'users': users, 'page': users})
 
 @login_required
+@conditional(User, UserTraining, Training, HeartRateReading, DailyTrainingLoad)
+@query_budget(9)
 def user_detail(request, pk):
     user = get_object_or_404(User, pk=pk)
     
-    trainings = UserTraining.objects.filter(user=user).order_by('-training__datetime')[:10]
+    trainings = list(UserTraining.objects.filter(user=user).select_related('training').order_by('-training__datetime')[:10])
+    heart_rates = TrainingHeartRate.objects.in_bulk([training.pk for training in trainings])
+    for training in trainings:
+        training.heart_rate = heart_rates.get(training.pk)
 
-    recommendation = generate_training_recommendation(trainings, user)
+    recommendation = get_recommendation(user.pk)['recommendation']
+    training_load = DailyTrainingLoad.objects.filter(user=user, date=timezone.localdate()).first()
 
     return render(request, 'SportManagerApp/user_detail.html', {
         'user': user,
         'trainings': trainings,
-        'recommendation': recommendation
+        'recommendation': recommendation,
+        'training_load': training_load,
     })
 
 
+# Health data of a user can be read by the user, by coaches of the user's
+# team and by admins; the loads of a team by its coaches and by admins
+def can_view_user(viewer, user_id):
+    role = getattr(viewer, 'role', None)
+    if role == 'admin' or viewer.pk == user_id:
+        return True
+    return role == 'coach' and viewer.team_id is not None and User.objects.filter(pk=user_id, team_id=viewer.team_id).exists()
+
+def can_view_team(viewer, team_id):
+    role = getattr(viewer, 'role', None)
+    return role == 'admin' or (role == 'coach' and viewer.team_id == team_id)
+
+def not_allowed():
+    return JsonResponse({'error': 'Not allowed'}, status=403)
+
+
+# Heart rate history of a user, read from the per-second or per-minute rollups
+@token_required('user', allow_session=True)
+def user_heart_rate(request, pk):
+    if not can_view_user(request.user, pk):
+        return not_allowed()
+    resolution = request.GET.get('resolution', 'minute')
+    if resolution not in ('second', 'minute'):
+        return JsonResponse({'error': 'resolution must be "second" or "minute"'}, status=400)
+    try:
+        end = parse_timestamp(request.GET.get('end'))
+        start = parse_timestamp(request.GET['start']) if request.GET.get('start') else end - timedelta(hours=1)
+    except ReadingError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+
+    series = [
+        {'time': bucket.isoformat(), 'count': count, 'average': pulse_sum / count, 'min': pulse_min, 'max': pulse_max}
+        for bucket, count, pulse_sum, pulse_min, pulse_max in heart_rate_series(pk, start, end, resolution)
+    ]
+    return JsonResponse({'user_id': pk, 'resolution': resolution, 'series': series})
+
+def training_load_dates(query):
+    end = parse_date(query['end']) if query.get('end') else timezone.localdate()
+    start = parse_date(query['start']) if query.get('start') else end - timedelta(days=27)
+    if start is None or end is None:
+        raise ValueError('start and end must be dates (YYYY-MM-DD)')
+    return start, end
+
+
+def training_load_json(training_load):
+    return {
+        'user_id': training_load.user_id,
+        'date': training_load.date,
+        'load': training_load.load,
+        'acute': training_load.acute,
+        'chronic': training_load.chronic,
+        'ratio': training_load.ratio,
+    }
+
+
+# Daily training load of a user with the acute (7 days) and chronic (28 days) loads,
+# for ?start= to ?end= (the last 28 days by default)
+@token_required('user', allow_session=True)
+def user_training_load(request, pk):
+    if not can_view_user(request.user, pk):
+        return not_allowed()
+    try:
+        start, end = training_load_dates(request.GET)
+    except ValueError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    days = [training_load_json(training_load) for training_load in user_training_loads(pk, start, end)]
+    return JsonResponse({'user_id': pk, 'start': start, 'end': end, 'days': days})
+
+# The same for every member of a team, in one query
+@token_required('user', allow_session=True)
+def team_training_load(request, pk):
+    if not can_view_team(request.user, pk):
+        return not_allowed()
+    try:
+        start, end = training_load_dates(request.GET)
+    except ValueError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    members = {}
+    for training_load in team_training_loads(pk, start, end):
+        members.setdefault(training_load.user_id, []).append(training_load_json(training_load))
+    return JsonResponse({'team_id': pk, 'start': start, 'end': end, 'members': [{'user_id': user_id, 'days': days} for user_id, days in members.items()]})
+
+# Heart rate alerts of a user, newest first, optionally of one kind
+@token_required('user', allow_session=True)
+def user_alerts(request, pk):
+    if not can_view_user(request.user, pk):
+        return not_allowed()
+    kind = request.GET.get('kind')
+    if kind is not None and kind not in dict(HeartRateAlert.KIND_CHOICES):
+        return JsonResponse({'error': f'kind must be one of {", ".join(dict(HeartRateAlert.KIND_CHOICES))}'}, status=400)
+    try:
+        end = parse_timestamp(request.GET.get('end'))
+        start = parse_timestamp(request.GET['start']) if request.GET.get('start') else end - timedelta(days=1)
+    except ReadingError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+
+    alerts = HeartRateAlert.objects.filter(user_id=pk, timestamp__gte=start, timestamp__lte=end)
+    if kind is not None:
+        alerts = alerts.filter(kind=kind)
+    fields = ['alert_id', 'sensor_id', 'user_training_id', 'kind', 'timestamp', 'pulse', 'expected', 'detail']
+    return JsonResponse({'user_id': pk, 'alerts': list(alerts.order_by('-timestamp').values(*fields)[:1000])})
+
 @login_required
 def user_create(request):
     if request.method == 'POST':
@@ -153,15 +452,35 @@ def user_delete(request, pk):
 
 # Team Views
 @login_required
+@conditional(Team)
+@query_budget(5)
 def team_list(request):
-    teams = Team.objects.all()
-    return render(request, 'SportManagerApp/team_list.html', {'teams': teams})
+    teams = keyset_paginate(request, Team.objects.all(), 'team_id')
+    return render(request, 'SportManagerApp/team_list.html', {'teams': teams, 'page': teams})
 
 @login_required
+@conditional(Team, User, Match, MatchTeam, Competition)
+@query_budget(4)
 def team_detail(request, pk):
+    stats = TeamStats.objects.select_related('team', 'best_competition').filter(team_id=pk).first()
+    if stats is None:
+        stats = TeamStats(team=get_object_or_404(Team, pk=pk))
+    return render(request, 'SportManagerApp/team_detail.html', {'team': stats.team, 'stats': stats})
+
+# Training recommendations for every member of a team, or for a squad chosen with ?users=1,2,3
+@login_required
+@conditional(Team, User, UserTraining, Training, HeartRateReading)
+@query_budget(6)
+def team_recommendations(request, pk):
     team = get_object_or_404(Team, pk=pk)
-    stats = team_statistics(pk)
-    return render(request, 'SportManagerApp/team_detail.html', {'team': team, 'stats': stats})
+    members = User.objects.filter(team=team).order_by('first_name', 'user_id')
+    squad = [value for value in request.GET.get('users', '').split(',') if value.isdigit()]
+    if squad:
+        members = members.filter(pk__in=squad)
+    members = list(members)
+    recommendations = get_recommendations([member.pk for member in members])
+    rows = [{'user': member, **recommendations[member.pk]} for member in members]
+    return render(request, 'SportManagerApp/team_recommendations.html', {'team': team, 'rows': rows})
 
 @login_required
 def team_create(request):
@@ -194,9 +513,17 @@ def team_delete(request, pk):
 
 # Match Views
 @login_required
+@conditional(Match, MatchTeam, Team)
+@query_budget(5)
 def match_list(request):
-    matches = Match.objects.all()
-    return render(request, 'SportManagerApp/match_list.html', {'matches': matches})
+    filters = list_filters(request.GET, team='matchteam__team_id', competition='competition_id', date='datetime')
+    queryset = Match.objects.filter(**filters).prefetch_related(
+        Prefetch('matchteam_set', queryset=MatchTeam.objects.select_related('team').order_by('match_team_id'))
+    )
+    if 'matchteam__team_id' in filters:
+        queryset = queryset.distinct()
+    matches = keyset_paginate(request, queryset, 'match_id')
+    return render(request, 'SportManagerApp/match_list.html', {'matches': matches, 'page': matches})
 
 @login_required
 def match_create(request):
@@ -218,7 +545,7 @@ def match_update(request, pk):
             form.save()
             return redirect('match_list')
     else:
-        match_teams = match.matchteam_set.all()
+        match_teams = list(match.matchteam_set.select_related('team').order_by('match_team_id'))
         initial_data = {
             'team1': match_teams[0].team if match_teams else None,
             'team2': match_teams[1].team if match_teams else None,
@@ -243,13 +570,17 @@ def match_detail(request, pk):
 
 # MatchTeam Views
 @login_required
+@conditional(MatchTeam, Match, Team)
+@query_budget(5)
 def matchteam_list(request):
-    matchteams = MatchTeam.objects.all()
-    return render(request, 'SportManagerApp/matchteam_list.html', {'matchteams': matchteams})
+    filters = list_filters(request.GET, team='team_id', competition='match__competition_id', date='match__datetime')
+    matchteams = keyset_paginate(request, MatchTeam.objects.filter(**filters).select_related('match', 'team'), 'match_team_id')
+    return render(request, 'SportManagerApp/matchteam_list.html', {'matchteams': matchteams, 'page': matchteams})
 
 @login_required
+@conditional(MatchTeam, Match, Team)
 def matchteam_detail(request, pk):
-    matchteam = get_object_or_404(MatchTeam, pk=pk)
+    matchteam = get_object_or_404(MatchTeam.objects.select_related('match', 'team'), pk=pk)
     return render(request, 'SportManagerApp/matchteam_detail.html', {'matchteam': matchteam})
 
 @login_required
@@ -282,17 +613,29 @@ def matchteam_delete(request, pk):
     return redirect('matchteam_list')
 
 # Competition Views
+@conditional(Competition)
+@cached_page(COMPETITION_LIST)
+@query_budget(4)
 def competition_list(request):
     competitions = Competition.objects.all()
     return render(request, 'SportManagerApp/competition_list.html', {'competitions': competitions})
 
-def competition_detail(request, pk):
-    competition = get_object_or_404(Competition, pk=pk)
-    matches = Match.objects.filter(competition_id=competition.competition_id)
-    match_results = []
+@conditional(Competition, per_user=False)
+@cached_page(COMPETITION_LIST, variant='json')
+def competition_list_json(request):
+    competitions = Competition.objects.order_by('competition_id').values('competition_id', 'name', 'prize_pool', 'league', 'sport_type')
+    return JsonResponse({'competitions': list(competitions)})
+
+def competition_matches(competition_id):
+    if getattr(settings, 'DENORMALIZED_MATCH_RESULTS', False):
+        return competition_match_results(competition_id)
 
+    matches = Match.objects.filter(competition_id=competition_id).order_by('datetime', 'match_id').prefetch_related(
+        Prefetch('matchteam_set', queryset=MatchTeam.objects.select_related('team').order_by('match_team_id'))
+    )
+    match_results = []
     for match in matches:
-        teams = MatchTeam.objects.filter(match_id=match.match_id)
+        teams = match.matchteam_set.all()
         if len(teams) == 2:
             match_results.append({
                 'team1': teams[0].team.name,
@@ -302,10 +645,48 @@ def competition_detail(request, pk):
                 'duration': match.duration,
                 'location': match.location,
             })
+    return match_results
 
+@conditional(Competition, Match, MatchTeam, Team)
+@cached_page(COMPETITION_DETAIL)
+@query_budget(5)
+def competition_detail(request, pk):
+    competition = get_object_or_404(Competition, pk=pk)
     return render(request, 'SportManagerApp/competition_detail.html', {
         'competition': competition,
-        'matches': match_results,
+        'matches': competition_matches(competition.competition_id),
+    })
+
+@conditional(Competition, Match, MatchTeam, Team, per_user=False)
+@cached_page(COMPETITION_DETAIL, variant='json')
+def competition_detail_json(request, pk):
+    competition = get_object_or_404(Competition, pk=pk)
+    return JsonResponse({
+        'competition_id': competition.competition_id,
+        'name': competition.name,
+        'prize_pool': competition.prize_pool,
+        'league': competition.league,
+        'sport_type': competition.sport_type,
+        'matches': competition_matches(competition.competition_id),
+    })
+
+# League table of a competition
+@conditional(Competition, Match, MatchTeam, Team)
+@query_budget(5)
+def competition_standings(request, pk):
+    competition = get_object_or_404(Competition, pk=pk)
+    return render(request, 'SportManagerApp/competition_standings.html', {
+        'competition': competition,
+        'standings': get_standings(competition.competition_id),
+    })
+
+@conditional(Competition, Match, MatchTeam, Team, per_user=False)
+def competition_standings_json(request, pk):
+    competition = get_object_or_404(Competition, pk=pk)
+    return JsonResponse({
+        'competition_id': competition.competition_id,
+        'name': competition.name,
+        'standings': get_standings(competition.competition_id),
     })
 
 def competition_create(request):
@@ -338,27 +719,22 @@ def competition_delete(request, pk):
 
 # Training Views
 @login_required
+@conditional(Training)
+@query_budget(4)
 def training_list(request, year=None, month=None):
     if year is None or month is None:
-        current_date = datetime.now()
-        year = current_date.year
-        month = current_date.month
+        today = timezone.localdate()
+        year = today.year
+        month = today.month
     else:
         year = int(year)
         month = int(month)
 
-    current_month = datetime(year, month, 1)
-    next_month = current_month + timedelta(days=31)
+    current_month = date(year, month, 1)
+    next_month = current_month + timedelta(days=calendar.monthrange(year, month)[1])
     previous_month = current_month - timedelta(days=1)
-    
-    days_in_calendar = []
-    start_day = current_month
-    end_day = next_month - timedelta(days=1)
 
-    while start_day <= end_day:
-        day_trainings = Training.objects.filter(datetime__date=start_day)
-        days_in_calendar.append({'date': start_day, 'trainings': day_trainings})
-        start_day += timedelta(days=1)
+    days_in_calendar = get_month(year, month)
 
     context = {
         'current_year': current_month.year,
@@ -373,9 +749,11 @@ def training_list(request, year=None, month=None):
 
 
 @login_required
+@conditional(Training, UserTraining, User)
+@query_budget(5)
 def training_detail(request, pk):
     training = get_object_or_404(Training, pk=pk)
-    user_trainings = UserTraining.objects.filter(training=training)
+    user_trainings = UserTraining.objects.filter(training=training).select_related('user')
     return render(request, 'SportManagerApp/training_detail.html', {'training': training, 'user_trainings': user_trainings})
 
 @login_required
@@ -422,13 +800,17 @@ def training_delete(request, pk):
 
 # UserTraining Views
 @login_required
+@conditional(UserTraining, User, Training)
+@query_budget(5)
 def usertraining_list(request):
-    usertrainings = UserTraining.objects.all()
-    return render(request, 'SportManagerApp/usertraining_list.html', {'usertrainings': usertrainings})
+    filters = list_filters(request.GET, team='user__team_id', training='training_id', date='training__datetime')
+    usertrainings = keyset_paginate(request, UserTraining.objects.filter(**filters).select_related('user', 'training'), 'user_training_id')
+    return render(request, 'SportManagerApp/usertraining_list.html', {'usertrainings': usertrainings, 'page': usertrainings})
 
 @login_required
+@conditional(UserTraining, User, Training, Sensor)
 def usertraining_detail(request, pk):
-    usertraining = get_object_or_404(UserTraining, pk=pk)
+    usertraining = get_object_or_404(UserTraining.objects.select_related('user', 'training', 'sensor'), pk=pk)
     return render(request, 'SportManagerApp/usertraining_detail.html', {'usertraining': usertraining})
 
 @login_required
@@ -462,11 +844,14 @@ def usertraining_delete(request, pk):
 
 # Sensor Views
 @login_required
+@conditional(Sensor)
+@query_budget(5)
 def sensor_list(request):
-    sensors = Sensor.objects.all()
-    return render(request, 'SportManagerApp/sensor_list.html', {'sensors': sensors})
+    sensors = keyset_paginate(request, Sensor.objects.all(), 'sensor_id')
+    return render(request, 'SportManagerApp/sensor_list.html', {'sensors': sensors, 'page': sensors})
 
 @login_required
+@conditional(Sensor)
 def sensor_detail(request, pk):
     sensor = get_object_or_404(Sensor, pk=pk)
     return render(request, 'SportManagerApp/sensor_detail.html', {'sensor': sensor})
@@ -500,42 +885,124 @@ def sensor_delete(request, pk):
     sensor.delete()
     return redirect('sensor_list')
 
-# Statistics of the team
-def team_statistics(team_id):
-    # 1. Number of competitions the team participated in
-    competitions_count = MatchTeam.objects.filter(team_id=team_id).values('match__competition').distinct().count()
-
-    # 2. The most successful competition
-    competition_scores = (
-        MatchTeam.objects.filter(team_id=team_id)
-        .values('match__competition__name')
-        .annotate(total_score=Sum('team_score'))
-        .order_by('-total_score')
+# Sensor API Views
+# Users a user token may submit data of: sportsmen only themselves, admins
+# and coaches anyone
+def token_allows_user(request, user_id):
+    return user_id == request.token.subject_id or getattr(request.user, 'role', None) in ['admin', 'coach']
+
+# Readings a token may submit: device tokens only for their own sensor and
+# for the athlete wearing it at the time, as found by device_wearers
+def token_allows_reading(request, reading, worn):
+    if request.token.subject == 'device':
+        return reading.sensor_id == request.token.subject_id and (
+            reading.user_id is None or (reading.sensor_id, reading.user_id, reading.timestamp) in worn
+        )
+    return token_allows_user(request, reading.user_id)
+
+def device_wearers(request, readings):
+    if request.token.subject != 'device':
+        return set()
+    return worn_sensors(
+        (reading.sensor_id, reading.user_id, reading.timestamp)
+        for reading in readings
+        if reading.user_id is not None and reading.sensor_id == request.token.subject_id
     )
-    most_successful_competition = competition_scores[0]['match__competition__name'] if competition_scores else None
-    most_successful_competition_score = competition_scores[0]['total_score'] if competition_scores else 0
-
-    # 3. Average age of team members
-    average_age = User.objects.filter(team_id=team_id).aggregate(Avg('age'))['age__avg']
-
-    # 4. Team's win percentage
-    total_matches = MatchTeam.objects.filter(team_id=team_id).count()
-    won_matches = MatchTeam.objects.filter(
-        team_id=team_id,
-        team_score__gt=F('match__matchteam__team_score')
-    ).count()
-    win_percentage = (won_matches / total_matches * 100) if total_matches > 0 else 0
-
-    # 5. Average goals (or points) per match
-    average_goals_per_match = MatchTeam.objects.filter(team_id=team_id).aggregate(Avg('team_score'))['team_score__avg']
-    
-    return {
-        'competitions_count': competitions_count,
-        'most_successful_competition': most_successful_competition,
-        'most_successful_competition_score': most_successful_competition_score,
-        'average_age': average_age,
-        'win_percentage': win_percentage,
-        'average_goals_per_match': average_goals_per_match,
-    }
-
 
+def buffer_full():
+    response = JsonResponse({'error': 'Ingestion buffer is full, retry later'}, status=503)
+    response['Retry-After'] = '1'
+    return response
+
+# Batched ingestion: one request carries many readings from one or many devices
+@require_POST
+@token_required()
+def reading_batch_create(request):
+    try:
+        readings, errors = parse_batch(request.body)
+    except ReadingError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+
+    allowed = []
+    worn = device_wearers(request, readings)
+    for reading in readings:
+        if token_allows_reading(request, reading, worn):
+            allowed.append(reading)
+        else:
+            errors.append({'sensor_id': reading.sensor_id, 'user_id': reading.user_id, 'error': 'Not allowed for this token'})
+
+    # Buffered readings are checked against known sensors and users when they are written
+    if buffering_enabled() and allowed:
+        if not reading_buffer.add(allowed):
+            return buffer_full()
+        return JsonResponse({'queued': len(allowed), 'rejected': len(errors), 'errors': errors}, status=202)
+
+    accepted, rejected = store_readings(allowed)
+    errors += [{'sensor_id': reading.sensor_id, 'user_id': reading.user_id, 'error': error} for reading, error in rejected]
+    return JsonResponse({'accepted': len(accepted), 'rejected': len(errors), 'errors': errors}, status=201 if accepted else 400)
+
+# Per-beat endpoint used by the ESP32 sketch
+@require_POST
+@token_required()
+def device_sensor_update(request):
+    try:
+        sensor_id = parse_int(request.POST.get('sensor_id'), 'sensor_id')
+        pulse = parse_int(request.POST.get('pulse'), 'pulse')
+        reading = parse_reading(request.POST.dict(), {}) if 'user_id' in request.POST else None
+        if reading is not None:
+            allowed = token_allows_reading(request, reading, device_wearers(request, [reading]))
+        elif request.token.subject == 'device':
+            allowed = sensor_id == request.token.subject_id
+        else:
+            allowed = token_allows_user(request, None)
+        if not allowed:
+            return JsonResponse({'error': 'Not allowed for this token'}, status=403)
+        if reading is not None and buffering_enabled():
+            if not reading_buffer.add([reading]):
+                return buffer_full()
+            return JsonResponse({'status': 'queued'}, status=202)
+        elif reading is not None:
+            accepted, rejected = store_readings([reading])
+            if rejected:
+                return JsonResponse({'error': rejected[0][1]}, status=400)
+        elif Sensor.objects.filter(pk=sensor_id).update(heart_rate=pulse):
+            bump_versions([Sensor], throttle=True)
+        else:
+            return JsonResponse({'error': f'Unknown sensor {sensor_id}'}, status=404)
+    except ReadingError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    return JsonResponse({'status': 'ok'})
+
+# Stores the running average pulse of the ESP32 on the user's latest started training.
+# A device token may only update the training session its sensor is worn in now.
+@require_POST
+@token_required()
+def device_usertraining_update(request):
+    try:
+        user_id = parse_int(request.POST.get('user_id'), 'user_id')
+        average_pulse = parse_int(request.POST.get('average_pulse'), 'average_pulse')
+    except ReadingError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+
+    if request.token.subject == 'device':
+        session_resolver.refresh()
+        session = session_resolver.sensor_session(request.token.subject_id, now())
+        if session is None or session[1] != user_id:
+            return JsonResponse({'error': 'Not allowed for this token'}, status=403)
+        user_training_id = session[0]
+    elif not token_allows_user(request, user_id):
+        return JsonResponse({'error': 'Not allowed for this token'}, status=403)
+    else:
+        user_training_id = (
+            UserTraining.objects.filter(user_id=user_id, training__datetime__lte=now())
+            .order_by('-training__datetime')
+            .values_list('user_training_id', flat=True)
+            .first()
+        )
+    if user_training_id is None:
+        return JsonResponse({'error': f'No started training for user {user_id}'}, status=404)
+    UserTraining.objects.filter(pk=user_training_id).update(intensity=average_pulse)
+    refresh_training_loads([user_training_id])
+    invalidate_recommendations([user_id])
+    bump_versions([UserTraining], throttle=True)
+    return JsonResponse({'status': 'ok', 'user_training_id': user_training_id})
@@ -2,6 +2,9 @@
 ASGI config for SportManagerProject project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+The device endpoints and the live training streams are answered by the
+telemetry fast path in front of Django; everything else goes to the Django
+application.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
@@ -13,4 +16,9 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'SportManagerProject.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported after get_asgi_application(), which sets Django up
+from SportManagerApp.telemetry import TelemetryApplication  # noqa: E402
+
+application = TelemetryApplication(django_application)
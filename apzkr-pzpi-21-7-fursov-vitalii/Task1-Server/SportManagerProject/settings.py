@@ -10,11 +10,17 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
+import shutil
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# Data the application writes at runtime (backup store, exports, file cache);
+# var/ is ignored by git. Set SPORTMANAGER_DATA_DIR to keep it elsewhere.
+DATA_DIR = Path(os.environ.get('SPORTMANAGER_DATA_DIR', BASE_DIR / 'var'))
+
 LOGOUT_REDIRECT_URL = '/login/'
 
 # Quick-start development settings - unsuitable for production
@@ -42,6 +48,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'SportManagerApp.middleware.QueryMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -134,4 +141,237 @@ STATIC_ROOT = BASE_DIR / "staticfiles"
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
-AUTH_USER_MODEL = 'SportManagerApp.User'
\ No newline at end of file
+AUTH_USER_MODEL = 'SportManagerApp.User'
+
+# Sensor data ingestion
+
+INGESTION_MAX_BATCH = 10000
+
+INGESTION_BULK_SIZE = 1000
+
+
+# Cached training calendar months, invalidated on Training changes. They live
+# in the default cache, which must be shared between processes (see CACHES).
+
+TRAINING_CALENDAR_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+# competition_detail reads the MatchResult table kept up to date by signals.
+# Run `manage.py rebuild_stats` after enabling it on an existing database.
+
+DENORMALIZED_MATCH_RESULTS = True
+
+
+# League table points. Run `manage.py rebuild_stats` after changing them.
+
+STANDINGS_POINTS = {'win': 3, 'draw': 1, 'loss': 0}
+
+STANDINGS_CACHE_TIMEOUT = 60 * 60
+
+
+# Keyset pagination of list views (?page_size= is capped at LIST_MAX_PAGE_SIZE)
+
+LIST_PAGE_SIZE = 50
+
+LIST_MAX_PAGE_SIZE = 500
+
+
+# Database backups (pg_dump). The directory format dumps tables in parallel
+# with BACKUP_JOBS workers; directory and custom formats are compressed.
+
+BACKUP_PG_DUMP_PATH = shutil.which('pg_dump') or '/Library/PostgreSQL/16/bin/pg_dump'
+
+BACKUP_DIR = BASE_DIR / 'backups'
+
+BACKUP_FORMAT = 'directory'
+
+BACKUP_JOBS = 4
+
+BACKUP_COMPRESSION = 6
+
+# Dumps are split into content-defined chunks and kept in a deduplicated
+# store; snapshots outside the retention policy are pruned. pg_dump then
+# writes uncompressed data and the store compresses the chunks with
+# BACKUP_COMPRESSION. Custom and plain dumps are chunked as pg_dump writes
+# them; directory dumps are written to BACKUP_DIR first, chunked file by file
+# and removed.
+
+BACKUP_USE_STORE = True
+
+BACKUP_STORE_DIR = DATA_DIR / 'backup-store'
+
+BACKUP_KEEP_LAST = 7
+
+BACKUP_KEEP_DAYS = 30
+
+# The restore command loads archive dumps with pg_restore (parallel data load,
+# indexes and constraints afterwards) and plain SQL dumps with psql.
+
+BACKUP_PG_RESTORE_PATH = shutil.which('pg_restore') or '/Library/PostgreSQL/16/bin/pg_restore'
+
+BACKUP_PSQL_PATH = shutil.which('psql') or '/Library/PostgreSQL/16/bin/psql'
+
+BACKUP_RESTORE_JOBS = 4
+
+# Background jobs are stored in the Job table and run by `manage.py runworker`.
+# Failed jobs are retried JOB_MAX_ATTEMPTS times with exponential backoff
+# starting at JOB_RETRY_DELAY seconds; jobs running longer than JOB_TIMEOUT
+# seconds are considered abandoned and requeued when a worker starts.
+
+JOB_WORKER_PROCESSES = 1
+
+JOB_WORKER_THREADS = 4
+
+JOB_POLL_INTERVAL = 1.0
+
+JOB_MAX_ATTEMPTS = 3
+
+JOB_RETRY_DELAY = 30
+
+JOB_TIMEOUT = 6 * 60 * 60
+
+EXPORT_DIR = DATA_DIR / 'exports'
+
+# Training recommendations are cached per user until that user's trainings,
+# readings or age change. They live in the default cache, which must be shared
+# between processes (see CACHES).
+
+RECOMMENDATION_CACHE_TIMEOUT = 24 * 60 * 60
+
+# Every request is timed and its SQL queries counted per view; the histograms
+# are served at /metrics to admins and to scrapers sending the bearer token
+# SPORTMANAGER_METRICS_TOKEN. Views declare a query budget with @query_budget(n)
+# (or QUERY_BUDGETS = {'view_name': n}); QUERY_BUDGET_MODE 'log' logs requests
+# over budget with their most repeated statements, 'strict' fails them (the
+# view tests override it).
+
+QUERY_BUDGET_MODE = 'log'
+
+QUERY_BUDGETS = {}
+
+METRICS_TOKEN = os.environ.get('SPORTMANAGER_METRICS_TOKEN', '')
+
+# Cache backend, chosen with the SPORTMANAGER_CACHE environment variable:
+# 'file' shares one cache between all processes on the host, 'database' between
+# all hosts (run `manage.py createcachetable` first), 'memory' keeps a cache
+# per process. Public competition pages, standings, calendar months and
+# recommendations are cached until a signal evicts them, which only reaches
+# the process it runs in with 'memory': the system check refuses it when
+# WEB_CONCURRENCY (the number of server worker processes) is above 1.
+
+CACHE_BACKENDS = {
+    'memory': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'sportmanager',
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': DATA_DIR / 'cache',
+    },
+    'database': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'sportmanager_cache',
+    },
+}
+
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', 1))
+
+CACHES = {
+    'default': {
+        **CACHE_BACKENDS[os.environ.get('SPORTMANAGER_CACHE', 'file')],
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+
+PAGE_CACHE_ALIAS = 'default'
+
+PAGE_CACHE_TIMEOUT = 24 * 60 * 60
+
+# Signed bearer tokens for devices and API clients (POST /api/tokens/). They are
+# checked without a database query; revocations reach every process within
+# TOKEN_REVOCATION_REFRESH seconds.
+
+DEVICE_TOKEN_TTL = 30 * 24 * 60 * 60
+
+USER_TOKEN_TTL = 24 * 60 * 60
+
+TOKEN_REVOCATION_REFRESH = 30
+
+# Telemetry fast path of the ASGI application (SportManagerProject/asgi.py):
+# readings go to the write-behind buffer, the latest sensor and average pulses
+# are written by one thread every TELEMETRY_FLUSH_INTERVAL seconds; above
+# TELEMETRY_QUEUE_LIMIT queued pulses devices get 503 and retry.
+
+TELEMETRY_FLUSH_INTERVAL = 0.5
+
+TELEMETRY_QUEUE_LIMIT = 100000
+
+TELEMETRY_MAX_BODY = 2 * 1024 * 1024
+
+# Write-behind buffer of every worker process: readings posted to the ingestion
+# endpoints are answered with 202 and written with one COPY per flush, every
+# READING_BUFFER_FLUSH_INTERVAL seconds or READING_BUFFER_FLUSH_SIZE readings.
+# Above READING_BUFFER_CAPACITY readings devices get 503. Set
+# READING_BUFFER_ENABLED = False to store readings within the request again.
+
+READING_BUFFER_ENABLED = True
+
+READING_BUFFER_CAPACITY = 200000
+
+READING_BUFFER_FLUSH_SIZE = 10000
+
+READING_BUFFER_FLUSH_INTERVAL = 1.0
+
+# Versions behind the ETags of pages are bumped by ingestion (readings, sensor
+# and average pulses) at most once per VERSION_BUMP_INTERVAL seconds per
+# process, so those pages may be that much behind the stored readings.
+
+VERSION_BUMP_INTERVAL = 5.0
+
+# Active training sessions held by every process to attribute readings of a
+# sensor to a user training (SportManagerApp/active_sessions.py): sessions from
+# SESSION_RESOLVER_GRACE seconds ago to SESSION_RESOLVER_HORIZON seconds ahead
+# are loaded at once, changes are picked up within SESSION_RESOLVER_CHECK_INTERVAL.
+
+SESSION_RESOLVER_HORIZON = 60 * 60
+
+SESSION_RESOLVER_GRACE = 5 * 60
+
+SESSION_RESOLVER_CHECK_INTERVAL = 1.0
+
+# Live training dashboards streamed by the ASGI application at
+# /trainings/<id>/live/: rolling averages over LIVE_AVERAGE_WINDOW seconds,
+# a keepalive comment every LIVE_KEEPALIVE seconds and at most
+# LIVE_MAX_CONNECTIONS open connections per process.
+
+LIVE_AVERAGE_WINDOW = 30
+
+LIVE_KEEPALIVE = 15
+
+LIVE_MAX_CONNECTIONS = 1000
+
+# Streaming heart rate anomaly detection on the ingestion path
+# (SportManagerApp/anomalies.py): zone limit as a fraction of 220 - age, spike
+# threshold in deviations from the EWMA, dropouts below HEART_RATE_MIN_PULSE
+# or after HEART_RATE_DROPOUT_GAP seconds without readings.
+
+HEART_RATE_ALERT_LIMIT = 0.95
+
+HEART_RATE_SPIKE_SIGMA = 4.0
+
+HEART_RATE_SPIKE_MIN_DELTA = 25
+
+HEART_RATE_EWMA_ALPHA = 0.2
+
+HEART_RATE_WARMUP = 30
+
+HEART_RATE_MIN_PULSE = 30
+
+HEART_RATE_DROPOUT_GAP = 10
+
+HEART_RATE_ALERT_COOLDOWN = 60
+
+# Training load (SportManagerApp/training_load.py): Banister TRIMP with this
+# resting heart rate, computed by the close_trainings task when a training ends.
+
+TRIMP_RESTING_HEART_RATE = 60
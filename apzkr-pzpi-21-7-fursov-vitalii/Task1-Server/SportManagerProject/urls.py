@@ -8,6 +8,7 @@ urlpatterns = [
     # Team URLs
     path('teams/', views.team_list, name='team_list'),
     path('teams/<int:pk>/', views.team_detail, name='team_detail'),
+    path('teams/<int:pk>/recommendations/', views.team_recommendations, name='team_recommendations'),
     path('teams/new/', views.team_create, name='team_create'),
     path('teams/<int:pk>/edit/', views.team_update, name='team_update'),
     path('teams/<int:pk>/delete/', views.team_delete, name='team_delete'),
@@ -29,6 +30,10 @@ urlpatterns = [
     # Competition URLs
     path('competitions/', views.competition_list, name='competition_list'),
     path('competitions/<int:pk>/', views.competition_detail, name='competition_detail'),
+    path('competitions/<int:pk>/standings/', views.competition_standings, name='competition_standings'),
+    path('api/competitions/', views.competition_list_json, name='competition_list_json'),
+    path('api/competitions/<int:pk>/', views.competition_detail_json, name='competition_detail_json'),
+    path('api/competitions/<int:pk>/standings/', views.competition_standings_json, name='competition_standings_json'),
     path('competitions/new/', views.competition_create, name='competition_create'),
     path('competitions/<int:pk>/edit/', views.competition_update, name='competition_update'),
     path('competitions/<int:pk>/delete/', views.competition_delete, name='competition_delete'),
@@ -55,9 +60,22 @@ urlpatterns = [
     path('sensors/<int:pk>/edit/', views.sensor_update, name='sensor_update'),
     path('sensors/<int:pk>/delete/', views.sensor_delete, name='sensor_delete'),
 
+    # Sensor API URLs
+    path('api/readings/', views.reading_batch_create, name='reading_batch_create'),
+    path('sensor_update/', views.device_sensor_update, name='device_sensor_update'),
+    path('usertraining_update/', views.device_usertraining_update, name='device_usertraining_update'),
+
+    # Token API URLs
+    path('api/tokens/', views.token_issue, name='token_issue'),
+    path('api/tokens/revoke/', views.token_revoke, name='token_revoke'),
+
     # User URLs
     path('users/', views.user_list, name='user_list'),
     path('users/<int:pk>/', views.user_detail, name='user_detail'),
+    path('users/<int:pk>/heart-rate/', views.user_heart_rate, name='user_heart_rate'),
+    path('users/<int:pk>/alerts/', views.user_alerts, name='user_alerts'),
+    path('users/<int:pk>/training-load/', views.user_training_load, name='user_training_load'),
+    path('teams/<int:pk>/training-load/', views.team_training_load, name='team_training_load'),
     path('users/new/', views.user_create, name='user_create'),
     path('users/<int:pk>/edit/', views.user_update, name='user_update'),
     path('users/<int:pk>/delete/', views.user_delete, name='user_delete'),
@@ -71,5 +89,12 @@ urlpatterns = [
     path('logout/', views.logout, name='logout'),
     path('home/', views.home, name='home'),
     path('csrf_token/', views.get_csrf_token, name='csrf_token'),
-    path('backup/', views.backup, name='backup')
+    path('backup/', views.backup, name='backup'),
+    path('backup/<int:pk>/', views.backup_status, name='backup_status'),
+    path('export/<str:dataset>/', views.export_data, name='export_data'),
+    path('rebuild_stats/', views.rebuild_stats, name='rebuild_stats'),
+    path('metrics', views.metrics, name='metrics'),
+    path('jobs/', views.job_list, name='job_list'),
+    path('jobs/<int:pk>/', views.job_status, name='job_status'),
+    path('jobs/<int:pk>/download/', views.job_download, name='job_download'),
 ]
@@ -0,0 +1,249 @@
+"""Simulated fleet of ESP32 heart-rate sensors for load testing the server.
+
+Every simulated device replays a training session: warm-up, work intervals
+and a cool-down, with beat-to-beat noise. Devices either speak the per-beat
+protocol of sketch.ino (two form POSTs per beat) or upload batches of
+[timestamp, pulse] pairs to /api/readings/.
+
+    python load_generator.py --devices 500 --duration 60 --protocol beat
+    python load_generator.py --devices 2000 --protocol batch --batch-interval 5 --json results.json
+
+Device i uses sensor_id = --first-sensor + i and user_id = --first-user + i,
+so the sensors and users must exist (see `manage.py seed_data`). The server
+expects a bearer token per device, issued with
+`manage.py issue_tokens --sensor-range 1 500 --output tokens.json` and passed
+with --tokens tokens.json. Only the standard library is used.
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import statistics
+import time
+from collections import Counter
+from urllib.parse import urlencode, urlsplit
+
+
+# Heart-rate curve of one training session: warm-up to the working level,
+# work/recovery intervals, cool-down, plus noise.
+class HeartRateCurve:
+    def __init__(self, rng, duration):
+        self.rng = rng
+        self.duration = duration
+        self.rest = rng.uniform(55, 75)
+        self.work = rng.uniform(130, 175)
+        self.interval = rng.uniform(60, 240)
+
+    def pulse(self, elapsed):
+        progress = elapsed / self.duration
+        level = max(0.0, min(1.0, progress * 6, (1 - progress) * 8))
+        intervals = 0.12 * math.sin(2 * math.pi * elapsed / self.interval)
+        pulse = self.rest + (self.work - self.rest) * level * (1 + intervals)
+        return int(max(40, min(220, pulse + self.rng.gauss(0, 2.5))))
+
+
+# Minimal HTTP/1.1 client over asyncio streams with keep-alive
+class Connection:
+    def __init__(self, host, port, timeout, keep_alive, token=None):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.keep_alive = keep_alive
+        self.authorization = f'Authorization: Bearer {token}\r\n' if token else ''
+        self.reader = self.writer = None
+
+    async def request(self, path, body, content_type):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+        head = (
+            f'POST {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n'
+            f'Content-Type: {content_type}\r\nContent-Length: {len(body)}\r\n{self.authorization}'
+            f"Connection: {'keep-alive' if self.keep_alive else 'close'}\r\n\r\n"
+        )
+        self.writer.write(head.encode() + body)
+        try:
+            return await asyncio.wait_for(self.read_response(), self.timeout)
+        except BaseException:
+            await self.close()
+            raise
+
+    async def read_response(self):
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError('Connection closed by the server')
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if 'content-length' in headers:
+            body = await self.reader.readexactly(int(headers['content-length']))
+        else:
+            body = await self.reader.read()
+        if not self.keep_alive or headers.get('connection', '').lower() == 'close' or 'content-length' not in headers:
+            await self.close()
+        return status, body
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+        self.reader = self.writer = None
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = []
+        self.reading_delays = []
+        self.statuses = Counter()
+        self.requests = 0
+        self.readings = 0
+        self.errors = 0
+
+    def record(self, started, status, readings=0, oldest_reading=None):
+        finished = time.time()
+        self.requests += 1
+        self.latencies.append(finished - started)
+        self.statuses[status] += 1
+        if isinstance(status, int) and status < 400:
+            self.readings += readings
+            if oldest_reading is not None:
+                self.reading_delays.append(finished - oldest_reading)
+        else:
+            self.errors += 1
+
+
+async def send(connection, stats, path, body, content_type, readings=0, oldest_reading=None):
+    started = time.time()
+    try:
+        status, _ = await connection.request(path, body, content_type)
+    except (OSError, asyncio.TimeoutError, ConnectionError, asyncio.IncompleteReadError, ValueError) as error:
+        status = type(error).__name__
+    stats.record(started, status, readings, oldest_reading)
+
+
+# One device: waits for its start offset, then produces a beat every 60/pulse seconds
+async def run_device(index, options, tokens, stats, stop_at):
+    rng = random.Random(options.seed + index)
+    sensor_id = options.first_sensor + index
+    user_id = options.first_user + index
+    curve = HeartRateCurve(rng, options.duration)
+    url = urlsplit(options.url)
+    connection = Connection(url.hostname, url.port or 80, options.timeout, not options.no_keep_alive, tokens.get(str(sensor_id)))
+
+    await asyncio.sleep(rng.uniform(0, options.ramp_up))
+    started = time.time()
+    total_pulse = beats = 0
+    pending = []
+    next_flush = time.time() + options.batch_interval
+
+    try:
+        while time.time() < stop_at:
+            pulse = curve.pulse(time.time() - started)
+            await asyncio.sleep(60 / pulse)
+            now = time.time()
+            total_pulse += pulse
+            beats += 1
+
+            if options.protocol == 'beat':
+                body = urlencode({'sensor_id': sensor_id, 'user_id': user_id, 'pulse': pulse}).encode()
+                await send(connection, stats, '/sensor_update/', body, 'application/x-www-form-urlencoded', 1, now)
+                body = urlencode({'user_id': user_id, 'average_pulse': total_pulse // beats}).encode()
+                await send(connection, stats, '/usertraining_update/', body, 'application/x-www-form-urlencoded')
+            else:
+                pending.append([round(now, 3), pulse])
+                if now >= next_flush:
+                    await flush(connection, stats, sensor_id, user_id, pending)
+                    pending = []
+                    next_flush = now + options.batch_interval
+
+        if pending:
+            await flush(connection, stats, sensor_id, user_id, pending)
+    finally:
+        await connection.close()
+
+
+async def flush(connection, stats, sensor_id, user_id, pending):
+    body = json.dumps({'sensor_id': sensor_id, 'user_id': user_id, 'readings': pending}).encode()
+    await send(connection, stats, '/api/readings/', body, 'application/json', len(pending), pending[0][0])
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def pick(fraction):
+        return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000, 1)
+
+    return {'p50_ms': pick(0.5), 'p95_ms': pick(0.95), 'p99_ms': pick(0.99), 'max_ms': round(ordered[-1] * 1000, 1), 'mean_ms': round(statistics.fmean(ordered) * 1000, 1)}
+
+
+async def report_progress(stats, started, interval):
+    while True:
+        await asyncio.sleep(interval)
+        elapsed = time.time() - started
+        print(f'{elapsed:6.0f}s  {stats.requests / elapsed:8.1f} req/s  {stats.readings / elapsed:8.1f} readings/s  {stats.errors} errors', flush=True)
+
+
+async def main(options):
+    tokens = {}
+    if options.tokens:
+        with open(options.tokens) as handle:
+            tokens = json.load(handle)['sensors']
+    stats = Stats()
+    started = time.time()
+    stop_at = started + options.ramp_up + options.duration
+    progress = asyncio.create_task(report_progress(stats, started, options.report_interval))
+    await asyncio.gather(*(run_device(index, options, tokens, stats, stop_at) for index in range(options.devices)))
+    progress.cancel()
+    elapsed = time.time() - started
+
+    result = {
+        'protocol': options.protocol,
+        'devices': options.devices,
+        'duration_s': round(elapsed, 1),
+        'requests': stats.requests,
+        'readings': stats.readings,
+        'requests_per_s': round(stats.requests / elapsed, 1),
+        'readings_per_s': round(stats.readings / elapsed, 1),
+        'error_rate': round(stats.errors / stats.requests, 4) if stats.requests else 0,
+        'statuses': {str(status): count for status, count in stats.statuses.items()},
+        'request_latency': percentiles(stats.latencies),
+        # From the moment a beat is measured on the device until the server acknowledged it
+        'end_to_end_latency': percentiles(stats.reading_delays),
+    }
+    print(json.dumps(result, indent=2))
+    if options.json:
+        with open(options.json, 'w') as handle:
+            json.dump(result, handle, indent=2)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Simulate a fleet of ESP32 heart-rate sensors')
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--devices', type=int, default=100)
+    parser.add_argument('--duration', type=float, default=60, help='Seconds each device keeps sending')
+    parser.add_argument('--ramp-up', type=float, default=5, help='Devices start spread over this many seconds')
+    parser.add_argument('--protocol', choices=['beat', 'batch'], default='beat')
+    parser.add_argument('--batch-interval', type=float, default=5, help='Seconds between batch uploads')
+    parser.add_argument('--first-sensor', type=int, default=1)
+    parser.add_argument('--first-user', type=int, default=1)
+    parser.add_argument('--timeout', type=float, default=10)
+    parser.add_argument('--no-keep-alive', action='store_true', help='Open a new connection per request like sketch.ino')
+    parser.add_argument('--report-interval', type=float, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--tokens', help='JSON file written by manage.py issue_tokens')
+    parser.add_argument('--json', help='Write the summary to this file')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_args()))
@@ -10,6 +10,8 @@ const char* usertraining_update_endpoint = "/usertraining_update/";
 
 const char* sensor_id = "1";
 const char* user_id = "1";
+// Device token of this sensor: manage.py issue_tokens --sensors 1
+const char* device_token = "";
 
 WiFiClient client;
 HTTPClient http;
@@ -56,7 +58,8 @@ void loop() {
     String sensor_update_url = String(server) + sensor_update_endpoint;
     http.begin(client, sensor_update_url);
     http.addHeader("Content-Type", "application/x-www-form-urlencoded");
-    String sensor_update_data = "sensor_id=" + String(sensor_id) + "&pulse=" + String(heartRate);
+    http.addHeader("Authorization", String("Bearer ") + device_token);
+    String sensor_update_data = "sensor_id=" + String(sensor_id) + "&user_id=" + String(user_id) + "&pulse=" + String(heartRate);
     int sensor_update_response_code = http.POST(sensor_update_data);
     if (sensor_update_response_code > 0) {
       Serial.println("sensor_update request sent successfully");
@@ -69,6 +72,7 @@ void loop() {
     String usertraining_update_url = String(server) + usertraining_update_endpoint;
     http.begin(client, usertraining_update_url);
     http.addHeader("Content-Type", "application/x-www-form-urlencoded");
+    http.addHeader("Authorization", String("Bearer ") + device_token);
     String usertraining_update_data = "user_id=" + String(user_id) + "&average_pulse=" + String(averageHeartRate);
     int usertraining_update_response_code = http.POST(usertraining_update_data);
     if (usertraining_update_response_code > 0) {
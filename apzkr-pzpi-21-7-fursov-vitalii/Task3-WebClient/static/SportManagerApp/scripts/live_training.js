@@ -0,0 +1,19 @@
+function showLiveHeartRate(athlete) {
+    var element = document.querySelector('[data-user-training="' + athlete.user_training_id + '"]');
+    if (!element || athlete.pulse === null) {
+        return;
+    }
+    element.innerText = ` - ${athlete.pulse} bpm (${athlete.zone}), average ${athlete.average} bpm`;
+    element.className = 'live zone-' + athlete.zone;
+}
+
+function showLiveEvent(event) {
+    JSON.parse(event.data).athletes.forEach(showLiveHeartRate);
+}
+
+var liveElement = document.getElementById("live");
+if (liveElement && window.EventSource) {
+    var source = new EventSource(liveElement.getAttribute('data-url'));
+    source.addEventListener('snapshot', showLiveEvent);
+    source.addEventListener('update', showLiveEvent);
+}